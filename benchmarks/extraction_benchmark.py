@@ -0,0 +1,121 @@
+"""Compares the throughput and peak memory of the HTML text extractors on a corpus of saved pages.
+
+Usage:
+    python -m benchmarks.extraction_benchmark --corpus path/to/pages
+    python -m benchmarks.extraction_benchmark --from-cache
+
+The corpus is either a directory of saved .html/.htm pages or the HTML stored in the page cache.
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from bs4 import BeautifulSoup
+
+from research_terminal.scraping.page_cache import CACHE_DIRECTORY
+from research_terminal.scraping.processing.extract import TEXT_TAGS, available_extractors
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def legacy_extract(html: str) -> str:
+    """The extraction WebScraper.get_text used before the extraction engines."""
+    soup = BeautifulSoup(html, 'html.parser')
+    text = ""
+    for element in soup.find_all(list(TEXT_TAGS)):
+        text += element.text + "\n\n"
+    return text
+
+
+def load_corpus(directory: str) -> List[str]:
+    pages = []
+    for root, _, filenames in os.walk(directory):
+        for filename in sorted(filenames):
+            if filename.endswith((".html", ".htm")):
+                with open(os.path.join(root, filename), "r", encoding="utf-8", errors="replace") as file:
+                    pages.append(file.read())
+    return pages
+
+
+def load_cached_corpus(directory: str) -> List[str]:
+    db = sqlite3.connect(os.path.join(directory, "index.sqlite3"))
+    pages = []
+    for (digest,) in db.execute("SELECT DISTINCT html_hash FROM pages"):
+        path = os.path.join(directory, "objects", digest[:2], digest)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                pages.append(file.read())
+    db.close()
+    return pages
+
+
+def get_engines() -> Dict[str, Callable[[str], str]]:
+    engines = {"legacy": legacy_extract}
+    engines.update({name: extractor.extract for name, extractor in available_extractors().items()})
+    return engines
+
+
+def max_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_engine(name: str, pages: List[str], repeats: int, results):
+    """Runs one engine in a fresh process so that its peak RSS is not polluted by the others."""
+    extract = get_engines()[name]
+    extract(pages[0])
+    baseline_rss = max_rss_mb()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for page in pages:
+            extract(page)
+    elapsed = time.perf_counter() - start
+    peak_rss = max_rss_mb() - baseline_rss
+
+    tracemalloc.start()
+    for page in pages:
+        extract(page)
+    _, peak_heap = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put((name, elapsed, peak_heap / (1024 * 1024), peak_rss))
+
+
+def benchmark(pages: List[str], repeats: int):
+    total_mb = sum(len(page.encode("utf-8")) for page in pages) * repeats / (1024 * 1024)
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    print(f"{len(pages)} pages, {total_mb / repeats:.1f}MB, {repeats} repeats")
+    print(f"{'engine':<14}{'seconds':>10}{'MB/s':>10}{'pages/s':>10}{'peak heap MB':>14}{'peak RSS MB':>13}")
+    for name in get_engines():
+        process = context.Process(target=run_engine, args=(name, pages, repeats, results))
+        process.start()
+        _, elapsed, peak_heap, peak_rss = results.get()
+        process.join()
+        print(f"{name:<14}{elapsed:>10.2f}{total_mb / elapsed:>10.2f}{len(pages) * repeats / elapsed:>10.1f}"
+              f"{peak_heap:>14.1f}{peak_rss:>13.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of saved .html pages")
+    parser.add_argument("--from-cache", nargs="?", const=CACHE_DIRECTORY, help="Use the pages stored in the page cache")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of passes over the corpus")
+    args = parser.parse_args()
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    elif args.from_cache:
+        corpus = load_cached_corpus(args.from_cache)
+    else:
+        parser.error("either --corpus or --from-cache is required")
+    if not corpus:
+        parser.error("the corpus is empty")
+    benchmark(corpus, args.repeats)
@@ -1,17 +1,92 @@
+import argparse
 import os
-from research_terminal.research_agent import ResearchAgent
+import time
+
+STARTED_AT = time.perf_counter()
+
+from typing import List, Optional
+
+from research_terminal.logger.timing import TIMINGS, timed
+with timed("import research agent"):
+    from research_terminal.research_agent import ResearchAgent
+from research_terminal.llm.grammar.pydantic_models import Reference, Section
+from research_terminal.llm.incremental_json import PartialField
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.panel import Panel
+from rich.live import Live
+from rich.table import Table
+from rich.text import Text
+
+# lines of the streamed output kept on screen while it is generated
+LIVE_LINES = 20
+
+
+def render_field(field: PartialField) -> Optional[Text]:
+    """Renders a validated field of the report, None for the ones not shown while it is generated."""
+    value = field.value
+    if field.name == "title":
+        return Text(value, style="bold")
+    if field.name == "executive_summary":
+        return Text(value)
+    if isinstance(value, Section):
+        return Text.assemble((value.title, "bold"), "\n", value.content)
+    if isinstance(value, Reference):
+        return Text.assemble(value.title, "\n", (value.url, "dim"))
+    return None
+
+
+def stream_answer(console: Console, agent: ResearchAgent, question: str):
+    """Runs the agent, showing its answer live as the model generates it, and the report section by section."""
+    streamed = []
+    sections: List[Text] = []
+    with Live(console=console, refresh_per_second=10, transient=True) as live:
+        def on_token(token: str):
+            streamed.append(token)
+            # only the end of the output is shown, so only the end is rejoined
+            tail = "".join(streamed[-LIVE_LINES * 40:]).splitlines()[-LIVE_LINES:]
+            live.update(Panel(Text("\n".join(tail)), title="[bold cyan]Generating...[/bold cyan]"))
+
+        def on_field(field: PartialField):
+            rendered = render_field(field)
+            if rendered is None:
+                return
+            sections.append(rendered)
+            tail = Text("\n\n").join(sections).split("\n")[-LIVE_LINES:]
+            live.update(Panel(Text("\n").join(tail), title="[bold cyan]Writing the report...[/bold cyan]"))
+        result = agent.run_agent(question, on_token=on_token, on_field=on_field)
+    console.print(Text(result))
+    return result
+
+
+def print_timings(console: Console, title: str):
+    """Prints the time taken by each timed startup step."""
+    table = Table(title=title)
+    table.add_column("Step")
+    table.add_column("Seconds", justify="right")
+    for name, seconds in TIMINGS.items():
+        table.add_row(name, f"{seconds:.3f}")
+    console.print(table)
+
 
 if __name__ == "__main__":
-    agent = ResearchAgent()
+    parser = argparse.ArgumentParser(description="Research Terminal")
+    parser.add_argument("--timings", action="store_true", help="report how long startup and the first use of each component took")
+    args = parser.parse_args()
+    with timed("create agent"):
+        agent = ResearchAgent()
     os.system('cls' if os.name == 'nt' else 'clear')  # Clear the console
     console = Console()
     console.print(Panel("[bold cyan]Welcome to the Research Terminal![/bold cyan]"))
+    TIMINGS["startup to prompt"] = time.perf_counter() - STARTED_AT
+    if args.timings:
+        print_timings(console, "Startup")
     while True:
         question = Prompt.ask("Please enter a research question or type 'exit' to quit:", default="Define the term 'quantum computing' and explain its applications.")
         if question == "exit":
             break
-        agent.run_agent(question)
-    console.print(Panel("[bold green]Question answered![/bold green]"))
\ No newline at end of file
+        stream_answer(console, agent, question)
+    agent.close()
+    if args.timings:
+        print_timings(console, "Startup and first use")
+    console.print(Panel("[bold green]Question answered![/bold green]"))
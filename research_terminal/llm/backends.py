@@ -0,0 +1,51 @@
+import os
+import threading
+from typing import List, Optional
+
+from research_terminal.llm.base_llm_model import BaseLLMModel, SingletonMeta
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "llama")
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def _get_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            from research_terminal.llm.router import ModelRouter
+            _router = ModelRouter()
+    return _router
+
+
+def get_llm_model(backend: str = LLM_BACKEND, task: Optional[str] = None) -> BaseLLMModel:
+    """Get the model serving the chat completions, created on first use and shared afterwards.
+
+    Args:
+        backend (str, optional): "llama" for a single in-process model, "llama_pool" for a pool of model worker processes,
+            "openai" for an OpenAI-compatible server
+        task (str, optional): The kind of call, one of router.TASKS; the llama backend serves each task with the
+            model configured for it, the other backends serve every task with their one model
+
+    Returns:
+        BaseLLMModel: The model
+    """
+    # imported here so only the selected backend is loaded
+    if backend == "llama" and task is not None:
+        return _get_router().model_for(task)
+    if backend == "llama":
+        from research_terminal.llm.llama_model import LlamaModel
+        return LlamaModel()
+    if backend == "llama_pool":
+        from research_terminal.llm.worker_pool import LlamaWorkerPool
+        return LlamaWorkerPool()
+    if backend == "openai":
+        from research_terminal.llm.openai_model import OpenAICompatibleModel
+        return OpenAICompatibleModel()
+    raise ValueError(f"Unknown LLM backend: {backend}")
+
+
+def loaded_models() -> List[BaseLLMModel]:
+    """Get the models loaded so far, to close them."""
+    return SingletonMeta.instances()
@@ -1,13 +1,71 @@
+import inspect
+import time
 from abc import ABC, abstractmethod, ABCMeta
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text
+from research_terminal.llm.response_cache import ResponseCache, model_identity, response_key
+from research_terminal.logger.logger import logger
 
 
 class SingletonMeta(ABCMeta):
+    """One instance per class and set of constructor arguments, so differently configured models can coexist."""
     _instances = {}
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
+        # the arguments are bound to the signature, so LlamaModel() and LlamaModel(n_ctx=N_CTX) share an instance
+        bound = inspect.signature(cls.__init__).bind(None, *args, **kwargs)
+        bound.apply_defaults()
+        key = (cls, tuple(bound.arguments.items())[1:])
+        if key not in cls._instances:
             instance = super().__call__(*args, **kwargs)
-            cls._instances[cls] = instance
-        return cls._instances[cls]
+            cls._instances[key] = instance
+        return cls._instances[key]
+
+    @classmethod
+    def instances(mcs) -> list:
+        """The instances created so far."""
+        return list(mcs._instances.values())
+
+@dataclass
+class StreamMetrics:
+    """Latency of a streamed completion, in seconds from the start of the call."""
+    time_to_first_token: Optional[float] = None
+    elapsed: float = 0.0
+    tokens: int = 0
+
+    @property
+    def tokens_per_second(self) -> float:
+        """The generation rate after the first token, which excludes the prompt processing."""
+        generating = self.elapsed - (self.time_to_first_token or 0.0)
+        return (self.tokens - 1) / generating if self.tokens > 1 and generating > 0 else 0.0
+
+
+def timed_stream(pieces: Iterable[str], on_token: Optional[Callable[[str], None]] = None,
+                 metrics: Optional[StreamMetrics] = None) -> Iterator[str]:
+    """Pass a stream of completion pieces through, timing it and calling on_token with each piece.
+
+    Args:
+        pieces (Iterable[str]): The pieces of the completion, one token each for llama.cpp
+        on_token (Callable[[str], None], optional): Called with each piece as soon as it is produced
+        metrics (StreamMetrics, optional): Filled in with the latency of the stream
+
+    Returns:
+        Iterator[str]: The pieces
+    """
+    metrics = metrics if metrics is not None else StreamMetrics()
+    start = time.perf_counter()
+    for piece in pieces:
+        if metrics.time_to_first_token is None:
+            metrics.time_to_first_token = time.perf_counter() - start
+        metrics.tokens += 1
+        if on_token:
+            on_token(piece)
+        yield piece
+    metrics.elapsed = time.perf_counter() - start
+    logger.info(f"Streamed {metrics.tokens} tokens, time to first token {metrics.time_to_first_token or 0.0:.2f}s, "
+                f"{metrics.tokens_per_second:.1f} tokens/s")
+
 
 class BaseLLMModel(ABC, metaclass=SingletonMeta):
     @abstractmethod
@@ -17,4 +75,101 @@ class BaseLLMModel(ABC, metaclass=SingletonMeta):
     @abstractmethod
     def chat_completion(self, user_prompt, **kwargs):
         pass
-    
\ No newline at end of file
+
+    # the number of calls the model can serve at the same time
+    parallelism = 1
+    model_path = ""
+    response_cache: Optional[ResponseCache] = None
+
+    def response_cache_key(self, system_prompt: str, user_prompt: str, use_cache: bool = True, **kwargs) -> Optional[str]:
+        """Get the key of a call in the response cache.
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                use_cache (bool): False for calls whose output should vary, such as high temperature sampling
+                **kwargs: The grammar and sampling parameters of the call
+            Returns:
+                Optional[str]: The key, None if the call is not to be cached"""
+        if not use_cache or self.response_cache is None:
+            return None
+        grammar = kwargs.pop("grammar", None)
+        grammar_text = None
+        if grammar is not None:
+            grammar_text = grammar if isinstance(grammar, str) else get_grammar_text(grammar)
+            if grammar_text is None:
+                # a grammar the cache cannot identify, its responses cannot be told apart
+                return None
+        params = {name: value for name, value in kwargs.items()
+                  if name not in ("on_token", "metrics", "max_retries", "validate")}
+        return response_key(model_identity(self.model_path), system_prompt, user_prompt, grammar_text, params)
+
+    def cached_response(self, key: Optional[str]) -> Optional[str]:
+        return self.response_cache.get(key) if key and self.response_cache else None
+
+    def store_response(self, key: Optional[str], response: str, finish_reason: Optional[str] = "stop",
+                       validate: Optional[Callable[[str], Any]] = None):
+        """Store a completion in the response cache, unless it is incomplete or invalid.
+
+        A stored completion is replayed on every later identical call, so a bad one must not be stored.
+            Args:
+                key (str, optional): The key of the call, None if it is not cached
+                response (str): The completion
+                finish_reason (str, optional): Why the generation ended, only completions that ended with "stop" are stored
+                validate (Callable[[str], Any], optional): Parses the completion, such as a pydantic model's
+                    model_validate_json, it is not stored if this raises"""
+        if not key or not self.response_cache:
+            return
+        if finish_reason != "stop":
+            logger.debug(f"Not caching a completion that ended with {finish_reason}")
+            return
+        if validate is not None:
+            try:
+                validate(response)
+            except Exception as e:
+                logger.debug(f"Not caching a completion that failed validation: {e}")
+                return
+        self.response_cache.put(key, response)
+
+    def cached_stream(self, key: Optional[str], pieces: Iterable[str], finish_reasons: Optional[List[str]] = None,
+                      validate: Optional[Callable[[str], Any]] = None) -> Iterator[str]:
+        """Pass a stream through, storing the whole response once the stream is complete.
+
+        finish_reasons is the list the stream appends its finish reason to, see store_response."""
+        collected = []
+        for piece in pieces:
+            collected.append(piece)
+            yield piece
+        self.store_response(key, "".join(collected), finish_reasons[-1] if finish_reasons else None, validate)
+
+    def map_chat_completions(self, requests: Iterable[Dict], **kwargs) -> Iterator[str]:
+        """Complete independent chat prompts, yielding the completions in the order of the requests.
+            Args:
+                requests (Iterable[Dict]): The keyword arguments of each chat_completion call, consumed lazily
+                **kwargs: Keyword arguments shared by every call
+            Returns:
+                Iterator[str]: The completions"""
+        for request in requests:
+            yield self.chat_completion(**kwargs, **request)
+
+    def stream_chat_completion(self, system_prompt: str, user_prompt: str,
+                               on_token: Optional[Callable[[str], None]] = None, metrics: Optional[StreamMetrics] = None,
+                               **kwargs) -> Iterator[str]:
+        """Complete a chat prompt, yielding the completion as it is produced.
+
+        Models that cannot stream yield the whole completion at once.
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                on_token (Callable[[str], None], optional): Called with each piece as soon as it is produced
+                metrics (StreamMetrics, optional): Filled in with the time to first token and tokens per second
+            Returns:
+                Iterator[str]: The pieces of the completion"""
+        def pieces() -> Iterator[str]:
+            yield self.chat_completion(system_prompt=system_prompt, user_prompt=user_prompt, **kwargs)
+        return timed_stream(pieces(), on_token, metrics)
+
+    def close(self):
+        """Releases what the model holds on to."""
+        if self.response_cache:
+            logger.info(f"LLM response cache stats: {self.response_cache.stats()}")
+            self.response_cache.close()
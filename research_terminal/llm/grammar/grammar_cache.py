@@ -0,0 +1,159 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+from typing import TYPE_CHECKING, Dict, Optional, Sequence, Tuple
+
+from research_terminal.logger.logger import logger
+
+if TYPE_CHECKING:
+    from llama_cpp.llama_grammar import LlamaGrammar
+
+GRAMMAR_CACHE_DIRECTORY = os.getenv("GRAMMAR_CACHE_DIR", "research_terminal/llm/grammar/cache")
+# bump when the grammar generator changes in a way the model schemas do not capture
+GENERATOR_VERSION = 1
+
+_texts: Dict[tuple, Tuple[str, str]] = {}
+# compiled grammars by their text, llama_cpp is only imported by the in-process models that compile them
+_compiled: Dict[str, "LlamaGrammar"] = {}
+# compiled grammars are kept alive by _compiled, so their ids stay valid
+_sources: Dict[int, str] = {}
+_lock = threading.Lock()
+
+
+def _memory_key(models: Sequence[type], options: dict) -> tuple:
+    return tuple(models), tuple(sorted(options.items()))
+
+
+def _model_schema(model: type):
+    if hasattr(model, "model_json_schema"):
+        return model.model_json_schema()
+    try:
+        return inspect.getsource(model)
+    except (OSError, TypeError):
+        return repr(inspect.signature(model))
+
+
+def _disk_key(models: Sequence[type], options: dict) -> str:
+    payload = json.dumps({
+        "version": GENERATOR_VERSION,
+        "models": [[f"{model.__module__}.{model.__qualname__}", _model_schema(model)] for model in models],
+        "options": sorted(options.items()),
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_from_disk(directory: str, key: str) -> Optional[Tuple[str, str]]:
+    grammar_path = os.path.join(directory, f"{key}.gbnf")
+    documentation_path = os.path.join(directory, f"{key}.md")
+    try:
+        with open(grammar_path, "r", encoding="utf-8") as grammar_file, \
+                open(documentation_path, "r", encoding="utf-8") as documentation_file:
+            return grammar_file.read(), documentation_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _save_to_disk(directory: str, key: str, grammar: str, documentation: str):
+    try:
+        os.makedirs(directory, exist_ok=True)
+        for extension, content in ((".gbnf", grammar), (".md", documentation)):
+            path = os.path.join(directory, key + extension)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save the grammar artifacts to {directory}: {e}")
+
+
+def get_grammar_text_and_documentation(models: Sequence[type], cache_directory: Optional[str] = GRAMMAR_CACHE_DIRECTORY,
+                                       **options) -> Tuple[str, str]:
+    """Get the GBNF grammar text and the documentation for a list of models, generating them only once.
+
+    Results are cached for the lifetime of the process, and in `cache_directory` across processes,
+    keyed by the models' JSON schemas and the generation options.
+
+    Args:
+        models (Sequence[type]): The pydantic model classes
+        cache_directory (str, optional): The directory of the on-disk artifact cache, None to disable it
+        **options: The options passed on to generate_gbnf_grammar_and_documentation
+
+    Returns:
+        Tuple[str, str]: The GBNF grammar and the documentation
+    """
+    key = _memory_key(models, options)
+    with _lock:
+        cached = _texts.get(key)
+    if cached:
+        return cached
+    disk_key = _disk_key(models, options) if cache_directory else None
+    result = _load_from_disk(cache_directory, disk_key) if disk_key else None
+    if result is None:
+        logger.debug(f"Generating grammar for {[model.__name__ for model in models]}")
+        from research_terminal.llm.grammar.pydantic_models_to_grammar import generate_gbnf_grammar_and_documentation
+        result = generate_gbnf_grammar_and_documentation(list(models), **options)
+        if disk_key:
+            _save_to_disk(cache_directory, disk_key, *result)
+    with _lock:
+        return _texts.setdefault(key, result)
+
+
+def get_grammar_and_documentation(models: Sequence[type], cache_directory: Optional[str] = GRAMMAR_CACHE_DIRECTORY,
+                                  **options) -> Tuple["LlamaGrammar", str]:
+    """Get the compiled LlamaGrammar and the documentation for a list of models, compiling them only once.
+
+    Args:
+        models (Sequence[type]): The pydantic model classes
+        cache_directory (str, optional): The directory of the on-disk artifact cache, None to disable it
+        **options: The options passed on to generate_gbnf_grammar_and_documentation
+
+    Returns:
+        Tuple[LlamaGrammar, str]: The compiled grammar and the documentation
+    """
+    grammar_text, documentation = get_grammar_text_and_documentation(models, cache_directory, **options)
+    return compile_grammar(grammar_text), documentation
+
+
+def compile_grammar(grammar_text: str) -> "LlamaGrammar":
+    """Compile a GBNF grammar into a LlamaGrammar, only once per grammar text.
+
+    Args:
+        grammar_text (str): The GBNF grammar
+
+    Returns:
+        LlamaGrammar: The compiled grammar
+    """
+    with _lock:
+        grammar = _compiled.get(grammar_text)
+    if grammar is None:
+        from llama_cpp.llama_grammar import LlamaGrammar
+        grammar = LlamaGrammar.from_string(grammar_text, verbose=False)
+        with _lock:
+            grammar = _compiled.setdefault(grammar_text, grammar)
+            _sources[id(grammar)] = grammar_text
+    return grammar
+
+
+def get_grammar_text(grammar: "LlamaGrammar") -> Optional[str]:
+    """Get the GBNF text a grammar returned by get_grammar_and_documentation was compiled from.
+
+    Compiled grammars cannot be sent to other processes, their text can.
+
+    Args:
+        grammar (LlamaGrammar): The compiled grammar
+
+    Returns:
+        Optional[str]: The grammar text, None if the grammar was not compiled by this cache
+    """
+    with _lock:
+        return _sources.get(id(grammar))
+
+
+def clear_grammar_cache():
+    """Drops the grammars cached in memory, the on-disk artifacts are kept."""
+    with _lock:
+        _texts.clear()
+        _compiled.clear()
+        _sources.clear()
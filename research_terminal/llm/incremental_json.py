@@ -0,0 +1,216 @@
+import json
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Generic, Iterable, List, Optional, Tuple, Type, TypeVar, Union, get_args
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from research_terminal.logger.logger import logger
+
+Path = Tuple[Union[str, int], ...]
+ModelT = TypeVar("ModelT", bound=BaseModel)
+WHITESPACE = " \t\n\r"
+
+
+@dataclass
+class _Frame:
+    kind: str
+    key: Union[str, int, None] = None
+    expecting_key: bool = False
+    value_start: Optional[int] = None
+
+
+class IncrementalJSONParser:
+    """Parses a JSON document fed piece by piece, reporting every value as soon as it is complete.
+
+    Values are reported with their path from the root, such as ("queries", 0) for the first
+    item of the "queries" list. Containers are reported after their children, the root last.
+    """
+    def __init__(self, on_value: Callable[[Path, Any], None]):
+        """Initializes the parser.
+        Args:
+            on_value: Called with the path and the decoded value of each completed value."""
+        self.on_value = on_value
+        self.stack: List[_Frame] = []
+        self.root_start: Optional[int] = None
+        self.done = False
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._scalar_start: Optional[int] = None
+        self._text = ""
+
+    def _path(self) -> Path:
+        return tuple(frame.key for frame in self.stack)  # type: ignore
+
+    def _value_starts(self, position: int):
+        if self.stack:
+            self.stack[-1].value_start = position
+        else:
+            self.root_start = position
+
+    def _value_ends(self, end: int):
+        start = self.stack[-1].value_start if self.stack else self.root_start
+        if start is None:
+            return
+        try:
+            value = json.loads(self._text[start:end])
+        except json.JSONDecodeError:
+            return
+        if self.stack:
+            self.stack[-1].value_start = None
+        else:
+            self.done = True
+        self.on_value(self._path(), value)
+
+    def _end_scalar(self, end: int):
+        if self._scalar_start is not None:
+            self._scalar_start = None
+            self._value_ends(end)
+
+    def feed(self, text: str):
+        """Parses the next piece of the document.
+        Args:
+            text (str): The piece, of any length"""
+        start = len(self._text)
+        self._text += text
+        for position in range(start, len(self._text)):
+            char = self._text[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    frame = self.stack[-1] if self.stack else None
+                    if frame is not None and frame.expecting_key:
+                        frame.key = json.loads(self._text[self._string_start:position + 1])
+                        frame.expecting_key = False
+                    else:
+                        self._value_ends(position + 1)
+                continue
+            if char in WHITESPACE:
+                self._end_scalar(position)
+            elif char == '"':
+                self._in_string = True
+                self._string_start = position
+                if not (self.stack and self.stack[-1].expecting_key):
+                    self._value_starts(position)
+            elif char in "{[":
+                self._value_starts(position)
+                self.stack.append(_Frame("object", expecting_key=True) if char == "{" else _Frame("array", key=0))
+            elif char in "}]":
+                self._end_scalar(position)
+                if not self.stack:
+                    continue
+                self.stack.pop()
+                self._value_ends(position + 1)
+            elif char == ",":
+                self._end_scalar(position)
+                if self.stack:
+                    frame = self.stack[-1]
+                    if frame.kind == "array":
+                        frame.key += 1  # type: ignore
+                    else:
+                        frame.expecting_key = True
+            elif char == ":":
+                continue
+            elif self._scalar_start is None:
+                self._scalar_start = position
+                self._value_starts(position)
+
+    def close(self):
+        """Ends the document, completing a scalar root value."""
+        self._end_scalar(len(self._text))
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+
+@dataclass
+class PartialField:
+    """A validated piece of a model: a field, or one item of a list field."""
+    path: Path
+    value: Any
+
+    @property
+    def name(self) -> str:
+        return self.path[0]  # type: ignore
+
+    @property
+    def index(self) -> Optional[int]:
+        return self.path[1] if len(self.path) > 1 else None  # type: ignore
+
+
+@dataclass
+class StreamingModelParser(Generic[ModelT]):
+    """Builds a pydantic model from a streamed JSON completion, validating its fields as they complete.
+
+    Every top-level field is reported once complete, and so is every item of a list field,
+    which lets callers act on the first search query or report section while the rest is
+    still being generated.
+    """
+    model: Type[ModelT]
+    on_field: Optional[Callable[[PartialField], None]] = None
+    fields: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._adapters: Dict[Tuple[str, int], Optional[TypeAdapter]] = {}
+        self._root: Optional[dict] = None
+        self._parser = IncrementalJSONParser(self._on_value)
+
+    def _adapter(self, path: Path) -> Optional[TypeAdapter]:
+        # every item of a list shares the adapter of the list's item type
+        key = (path[0], len(path))
+        if key not in self._adapters:
+            model_field = self.model.model_fields.get(path[0])  # type: ignore
+            annotation = model_field.annotation if model_field else None
+            if annotation is not None and len(path) == 2:
+                item_types = get_args(annotation)
+                annotation = item_types[0] if item_types else None
+            self._adapters[key] = TypeAdapter(annotation) if annotation is not None else None
+        return self._adapters[key]
+
+    def _on_value(self, path: Path, value: Any):
+        if not path:
+            self._root = value
+            return
+        if len(path) > 2 or (len(path) == 2 and not isinstance(path[1], int)):
+            return
+        adapter = self._adapter(path)
+        if adapter is None:
+            return
+        try:
+            validated = adapter.validate_python(value)
+        except ValidationError as e:
+            logger.debug(f"Streamed {'.'.join(map(str, path))} failed validation: {e}")
+            return
+        if len(path) == 1:
+            self.fields[path[0]] = validated  # type: ignore
+        if self.on_field:
+            self.on_field(PartialField(path, validated))
+
+    def feed(self, text: str):
+        """Parses the next piece of the completion."""
+        self._parser.feed(text)
+
+    def consume(self, pieces: Iterable[str]) -> ModelT:
+        """Parses a whole stream of pieces.
+        Args:
+            pieces (Iterable[str]): The streamed completion
+        Returns:
+            ModelT: The validated model"""
+        for piece in pieces:
+            self.feed(piece)
+        return self.result()
+
+    def result(self) -> ModelT:
+        """Validates the complete document.
+        Returns:
+            ModelT: The validated model
+        Raises:
+            ValueError: If the document is incomplete or does not match the model"""
+        self._parser.close()
+        if self._root is None:
+            raise ValueError(f"Incomplete {self.model.__name__} JSON: {self._parser.text[-200:]!r}")
+        return self.model(**self._root)
@@ -1,5 +1,10 @@
+from typing import Any, Callable, Iterator, List, Optional
 from llama_cpp import Llama
-from research_terminal.llm.base_llm_model import BaseLLMModel
+from research_terminal.llm.base_llm_model import BaseLLMModel, StreamMetrics, timed_stream
+from research_terminal.llm.grammar.grammar_cache import compile_grammar
+from research_terminal.llm.prompt_cache import PROMPT_CACHE_DIRECTORY, TieredPromptCache
+from research_terminal.llm import response_cache
+from research_terminal.scraping.processing.tokens import TokenCounter
 
 from research_terminal.logger.logger import logger
 from dotenv import load_dotenv
@@ -7,11 +12,155 @@ import os
 
 load_dotenv()
 
+MODEL_PATH = os.getenv("LLAMA_MODEL_PATH", "llama")
+N_CTX = 4096
+N_THREADS = int(os.getenv("LLAMA_THREADS", 5))
+N_GPU_LAYERS = int(os.getenv("LLAMA_GPU_LAYERS", 30))
+
+
+def load_llama(model_path: str, n_ctx: int = N_CTX, n_threads: int = N_THREADS, n_gpu_layers: int = N_GPU_LAYERS,
+               **kwargs) -> Llama:
+    """Load a Llama model
+
+    Args:
+        model_path (str): The path of the GGUF model file
+        n_ctx (int, optional): The context window
+        n_threads (int, optional): The number of threads used for generation and prompt processing
+        n_gpu_layers (int, optional): The number of layers offloaded to the GPU
+
+    Returns:
+        Llama: The Llama model
+    """
+    return Llama(model_path=model_path,
+                 n_threads=n_threads,
+                 n_threads_batch=n_threads,
+                 n_gpu_layers=n_gpu_layers,
+                 flash_attn=True,
+                 n_ctx=n_ctx,
+                 **kwargs)
+
+
+def prompt_cache_directory(model_path: str, n_ctx: int) -> str:
+    """Get the prompt cache directory of a model
+
+    Args:
+        model_path (str): The path of the GGUF model file
+        n_ctx (int): The context window
+
+    Returns:
+        str: The directory, under the prompt cache directory
+    """
+    name = os.path.splitext(os.path.basename(model_path))[0] or "model"
+    return os.path.join(PROMPT_CACHE_DIRECTORY, f"{name}-{n_ctx}")
+
+
+def _messages(system_prompt: str, user_prompt: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": f"{system_prompt}"
+        },
+        {
+            "role": "user",
+            "content": f"{user_prompt}"
+        }
+    ]
+
+
+def _compile_grammar(kwargs: dict):
+    # grammars are passed around as GBNF text, only the in-process models need them compiled
+    if isinstance(kwargs.get("grammar"), str):
+        kwargs["grammar"] = compile_grammar(kwargs["grammar"])
+
+
+def stream_chat(llm: Llama, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                finish_reasons: Optional[List[str]] = None, **kwargs) -> Iterator[str]:
+    """Complete a chat prompt with a Llama model, yielding the completion token by token
+
+    Empty responses are retried as long as nothing has been yielded yet.
+
+    Args:
+        llm (Llama): The model
+        system_prompt (str): The system prompt
+        user_prompt (str): The user prompt
+        max_retries (int): The maximum number of retries
+        finish_reasons (List[str], optional): The finish reason of the completion is appended to it, such as "stop" or "length"
+
+    Yields:
+        str: The next piece of the completion
+    """
+    _compile_grammar(kwargs)
+    for _ in range(max_retries):
+        streamed = False
+        finish_reason = None
+        for chunk in llm.create_chat_completion(messages=_messages(system_prompt, user_prompt), stream=True, **kwargs):
+            if not chunk.get("choices"): #type: ignore
+                continue
+            finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason #type: ignore
+            piece = chunk["choices"][0]["delta"].get("content") #type: ignore
+            if piece:
+                streamed = True
+                yield piece
+        if streamed:
+            if finish_reasons is not None:
+                finish_reasons.append(finish_reason)
+            return
+        logger.warning(f"Chat completion returned empty response, retrying")
+    logger.error(f"Chat completion failed after {max_retries} retries")
+    raise Exception(f"Chat completion failed after {max_retries} retries")
+
+
+def complete_chat(llm: Llama, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                  finish_reasons: Optional[List[str]] = None, **kwargs) -> str:
+    """Complete a chat prompt with a Llama model, retrying empty responses
+
+    Args:
+        llm (Llama): The model
+        system_prompt (str): The system prompt
+        user_prompt (str): The user prompt
+        max_retries (int): The maximum number of retries
+        finish_reasons (List[str], optional): The finish reason of the completion is appended to it, such as "stop" or "length"
+
+    Returns:
+        str: The completion of the chat prompt
+    """
+    _compile_grammar(kwargs)
+    retry_count = 0
+    while retry_count < max_retries:
+        output = llm.create_chat_completion(messages=_messages(system_prompt, user_prompt), **kwargs)
+        if "choices" in output and len(output["choices"]) > 0: #type: ignore
+            if output["choices"][0]["message"]["content"] != "": #type: ignore
+                if finish_reasons is not None:
+                    finish_reasons.append(output["choices"][0].get("finish_reason")) #type: ignore
+                return output["choices"][0]["message"]["content"] #type: ignore
+            else:
+                logger.warning(f"Chat completion returned empty response, retrying")
+                retry_count += 1
+    logger.error(f"Chat completion failed after {max_retries} retries")
+    raise Exception(f"Chat completion failed after {max_retries} retries")
+
 
 class LlamaModel(BaseLLMModel):
-    def __init__(self):
-        self.model_path = os.getenv("LLAMA_MODEL_PATH", "llama")
+    def __init__(self, model_path: str = MODEL_PATH, n_ctx: int = N_CTX, n_threads: int = N_THREADS,
+                 n_gpu_layers: int = N_GPU_LAYERS):
+        """Initializes the model, one instance being shared per set of arguments.
+        Args:
+            model_path: The path of the GGUF model file.
+            n_ctx: The context window.
+            n_threads: The number of threads used for generation and prompt processing.
+            n_gpu_layers: The number of layers offloaded to the GPU."""
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.n_gpu_layers = n_gpu_layers
         self.llm = self.load_model()
+        self.token_counter = TokenCounter(self.tokenize)
+        # reuse the evaluated state of shared prompt prefixes such as the long system prompts,
+        # states only fit the model and context size they were evaluated with
+        self.prompt_cache = TieredPromptCache(directory=prompt_cache_directory(model_path, n_ctx))
+        self.llm.set_cache(self.prompt_cache)
+        # replays calls made before, in this run or earlier ones
+        self.response_cache = response_cache.ResponseCache() if response_cache.ENABLED else None
         self.system_prompt = "You are an AI assistant. You are helping a user with a task."
         logger.debug("LlamaModel initialized")
 
@@ -22,49 +171,71 @@ class LlamaModel(BaseLLMModel):
             Llama: The Llama model
         """
         logger.debug("Loading Llama model")
-        llm = Llama(model_path=self.model_path,
-                    n_threads=5,
-                    n_threads_batch=5,
-                    n_gpu_layers=30,
-                    flash_attn=True,
-                    n_ctx=4096, 
-                    **kwargs)
-        
-        return llm
+        return load_llama(self.model_path, self.n_ctx, self.n_threads, self.n_gpu_layers, **kwargs)
+
+    def tokenize(self, text: str) -> list[int]:
+        """Tokenize a text with the model's tokenizer
+
+        Args:
+            text (str): The text to tokenize
+
+        Returns:
+            list[int]: The tokens, without the beginning of sequence token
+        """
+        return self.llm.tokenize(text.encode("utf-8"), add_bos=False)
     
-    def chat_completion(self, system_prompt: str, user_prompt: str, max_retries: int = 3, **kwargs) -> str:
+    def chat_completion(self, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                        on_token: Optional[Callable[[str], None]] = None, use_cache: bool = True,
+                        validate: Optional[Callable[[str], Any]] = None, **kwargs) -> str:
         """Complete a chat prompt
             Args:
                 system_prompt (str): The system prompt
                 user_prompt (str): The user prompt
                 max_retries (int): The maximum number of retries
+                on_token (Callable[[str], None], optional): Streams the completion, calling it with each token
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
             Returns:
                 str: The completion of the chat prompt"""
+        if on_token:
+            return "".join(self.stream_chat_completion(system_prompt, user_prompt, on_token, max_retries=max_retries,
+                                                       use_cache=use_cache, validate=validate, **kwargs))
+        key = self.response_cache_key(system_prompt, user_prompt, use_cache, **kwargs)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return cached
         logger.info(f"Beginning chat completion")
-        retry_count = 0
-        while retry_count < max_retries:
-            output = self.llm.create_chat_completion(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": f"{system_prompt}"
-                    },
-                    {
-                        "role": "user",
-                        "content": f"{user_prompt}"
-                    }
-                    ],
-                **kwargs
-                )
-            if "choices" in output and len(output["choices"]) > 0: #type: ignore
-                if output["choices"][0]["message"]["content"] != "": #type: ignore
-                    logger.debug(f"Finished chat completion")
-                    return output["choices"][0]["message"]["content"] #type: ignore
-                else:
-                    logger.warning(f"Chat completion returned empty response, retrying")
-                    retry_count += 1
-        logger.error(f"Chat completion failed after {max_retries} retries")
-        raise Exception(f"Chat completion failed after {max_retries} retries")
-                
-    
-    
\ No newline at end of file
+        finish_reasons: List[str] = []
+        completion = complete_chat(self.llm, system_prompt, user_prompt, max_retries, finish_reasons, **kwargs)
+        logger.debug(f"Finished chat completion, prompt cache: {self.prompt_cache.stats()}")
+        self.store_response(key, completion, finish_reasons[-1] if finish_reasons else None, validate)
+        return completion
+
+    def stream_chat_completion(self, system_prompt: str, user_prompt: str,
+                               on_token: Optional[Callable[[str], None]] = None, metrics: Optional[StreamMetrics] = None,
+                               max_retries: int = 3, use_cache: bool = True,
+                               validate: Optional[Callable[[str], Any]] = None, **kwargs) -> Iterator[str]:
+        """Complete a chat prompt, yielding the completion token by token
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                on_token (Callable[[str], None], optional): Called with each token as soon as it is produced
+                metrics (StreamMetrics, optional): Filled in with the time to first token and tokens per second
+                max_retries (int): The maximum number of retries
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+            Returns:
+                Iterator[str]: The tokens of the completion"""
+        key = self.response_cache_key(system_prompt, user_prompt, use_cache, **kwargs)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return timed_stream(iter([cached]), on_token, metrics)
+        logger.info(f"Beginning streamed chat completion")
+        finish_reasons: List[str] = []
+        pieces = stream_chat(self.llm, system_prompt, user_prompt, max_retries, finish_reasons, **kwargs)
+        return timed_stream(self.cached_stream(key, pieces, finish_reasons, validate), on_token, metrics)
+
+    def close(self):
+        """Saves the prompt cache, so the next run starts warm, and closes the response cache."""
+        self.prompt_cache.persist()
+        super().close()
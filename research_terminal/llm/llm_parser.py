@@ -1,10 +1,9 @@
 from research_terminal.logger.logger import logger
 from research_terminal.llm.prompts import check_relevance_prompt
 from research_terminal.llm.grammar.pydantic_models import CheckRelevance
-from research_terminal.llm.grammar.pydantic_models_to_grammar import generate_gbnf_grammar_and_documentation
-from llama_cpp.llama_grammar import LlamaGrammar
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text_and_documentation
 import json
-from research_terminal.llm.llama_model import LlamaModel
+from research_terminal.llm.backends import get_llm_model
 
 
 def check_relevance(question: str, text: str) -> CheckRelevance:
@@ -15,14 +14,13 @@ def check_relevance(question: str, text: str) -> CheckRelevance:
     Returns:
         CheckRelevance: The check relevance for the given question and text
     """
-    llm = LlamaModel()
+    llm = get_llm_model(task="relevance")
     check_relevance = check_relevance_prompt(question, text)
-    gbnf_grammar, documentation = generate_gbnf_grammar_and_documentation([CheckRelevance])
-    gbnf_grammar = LlamaGrammar.from_string(gbnf_grammar)
+    gbnf_grammar, documentation = get_grammar_text_and_documentation([CheckRelevance])
     check_relevance_system_message = """You are an advanced AI research assistant, tasked with determining whether the information provided is relevant to the query. The following is the expected output:\n\n""" + documentation
     relevance = llm.chat_completion(
         user_prompt=check_relevance, system_prompt=check_relevance_system_message,
-        grammar=gbnf_grammar, max_tokens=512
+        grammar=gbnf_grammar, max_tokens=512, validate=CheckRelevance.model_validate_json
     )
     relevance = json.loads(relevance) #type: ignore
     return CheckRelevance(**relevance)
@@ -0,0 +1,233 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from research_terminal.llm.base_llm_model import BaseLLMModel, StreamMetrics, timed_stream
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text
+from research_terminal.llm import response_cache
+from research_terminal.scraping.processing.tokens import TokenCounter
+from research_terminal.logger.logger import logger
+
+BASE_URL = os.getenv("OPENAI_BASE_URL", "http://localhost:8080/v1")
+API_KEY = os.getenv("OPENAI_API_KEY", "")
+MODEL = os.getenv("OPENAI_MODEL", "default")
+N_CTX = int(os.getenv("LLM_N_CTX", 4096))
+# concurrent requests sent to the server, match it to the server's slots
+PARALLELISM = int(os.getenv("LLM_SERVER_PARALLELISM", 4))
+TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", 600))
+
+
+class OpenAICompatibleModel(BaseLLMModel):
+    """Completes chats through an OpenAI-compatible server, such as the llama.cpp server or vLLM.
+
+    Requests go over a pooled keep-alive session, so several agent processes can share one
+    model server and each of them can have several requests in flight.
+    """
+    def __init__(self, base_url: str = BASE_URL, model: str = MODEL, api_key: str = API_KEY,
+                 parallelism: int = PARALLELISM, timeout: float = TIMEOUT):
+        """Initializes the client.
+        Args:
+            base_url: The url of the server's OpenAI API, ending in /v1.
+            model: The model name sent with every request.
+            api_key: The bearer token, if the server requires one.
+            parallelism: The number of requests sent to the server at the same time.
+            timeout: The read timeout of a completion in seconds."""
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.model_path = f"{self.base_url}#{model}"
+        self.n_ctx = N_CTX
+        self.parallelism = parallelism
+        self.timeout = timeout
+        self.system_prompt = "You are an AI assistant. You are helping a user with a task."
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=parallelism * 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.load_model()
+        self.token_counter = TokenCounter(self.tokenize if self._server_tokenizes() else None)
+        self.response_cache = response_cache.ResponseCache() if response_cache.ENABLED else None
+        logger.debug("OpenAICompatibleModel initialized")
+
+    def load_model(self, **kwargs):
+        """Checks that the server is up, the model itself is loaded by the server."""
+        try:
+            response = self.session.get(f"{self.base_url}/models", timeout=10)
+            response.raise_for_status()
+            models = [model.get("id") for model in response.json().get("data", [])]
+            logger.info(f"Connected to {self.base_url}, serving {models}")
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not list the models of {self.base_url}: {e}")
+
+    def _server_root(self) -> str:
+        return self.base_url[:-len("/v1")] if self.base_url.endswith("/v1") else self.base_url
+
+    def _server_tokenizes(self) -> bool:
+        try:
+            self.tokenize("probe")
+            return True
+        except (requests.RequestException, ValueError, KeyError):
+            logger.info("The server has no /tokenize endpoint, token counts are estimated")
+            return False
+
+    def tokenize(self, text: str) -> List[int]:
+        """Tokenize a text with the server's tokenizer, through the llama.cpp server's /tokenize endpoint
+
+        Args:
+            text (str): The text to tokenize
+
+        Returns:
+            List[int]: The tokens
+        """
+        response = self.session.post(f"{self._server_root()}/tokenize", json={"content": text}, timeout=10)
+        response.raise_for_status()
+        return response.json()["tokens"]
+
+    def _request_body(self, system_prompt: str, user_prompt: str, stream: bool, grammar=None,
+                      json_schema: Optional[dict] = None, **kwargs) -> dict:
+        body = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": f"{system_prompt}"},
+                {"role": "user", "content": f"{user_prompt}"},
+            ],
+            "stream": stream,
+            **kwargs,
+        }
+        if grammar is not None:
+            # the llama.cpp server takes GBNF grammars as text
+            body["grammar"] = grammar if isinstance(grammar, str) else get_grammar_text(grammar)
+            if body["grammar"] is None:
+                raise ValueError("Grammars sent to the server have to come from the grammar cache")
+        if json_schema is not None:
+            body["response_format"] = {"type": "json_schema",
+                                       "json_schema": {"name": json_schema.get("title", "response"), "schema": json_schema}}
+        return body
+
+    def _complete(self, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                  finish_reasons: Optional[List[str]] = None, **kwargs) -> str:
+        for _ in range(max_retries):
+            response = self.session.post(f"{self.base_url}/chat/completions", timeout=self.timeout,
+                                         json=self._request_body(system_prompt, user_prompt, False, **kwargs))
+            response.raise_for_status()
+            choices = response.json().get("choices") or []
+            if choices and choices[0]["message"].get("content"):
+                if finish_reasons is not None:
+                    finish_reasons.append(choices[0].get("finish_reason"))
+                return choices[0]["message"]["content"]
+            logger.warning("Chat completion returned empty response, retrying")
+        logger.error(f"Chat completion failed after {max_retries} retries")
+        raise Exception(f"Chat completion failed after {max_retries} retries")
+
+    def _stream(self, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                finish_reasons: Optional[List[str]] = None, **kwargs) -> Iterator[str]:
+        for _ in range(max_retries):
+            streamed = False
+            finish_reason = None
+            with self.session.post(f"{self.base_url}/chat/completions", timeout=self.timeout, stream=True,
+                                   json=self._request_body(system_prompt, user_prompt, True, **kwargs)) as response:
+                response.raise_for_status()
+                # server-sent events, one "data: {json}" line per chunk and "data: [DONE]" at the end
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or []
+                    if choices:
+                        finish_reason = choices[0].get("finish_reason") or finish_reason
+                    piece = choices[0].get("delta", {}).get("content") if choices else None
+                    if piece:
+                        streamed = True
+                        yield piece
+            if streamed:
+                if finish_reasons is not None:
+                    finish_reasons.append(finish_reason)
+                return
+            logger.warning("Chat completion returned empty response, retrying")
+        logger.error(f"Chat completion failed after {max_retries} retries")
+        raise Exception(f"Chat completion failed after {max_retries} retries")
+
+    def chat_completion(self, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                        on_token: Optional[Callable[[str], None]] = None, use_cache: bool = True,
+                        validate: Optional[Callable[[str], Any]] = None, **kwargs) -> str:
+        """Complete a chat prompt on the server
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                max_retries (int): The maximum number of retries
+                on_token (Callable[[str], None], optional): Streams the completion, calling it with each token
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+                **kwargs: The grammar or json_schema constraining the output, and the sampling parameters
+            Returns:
+                str: The completion of the chat prompt"""
+        if on_token:
+            return "".join(self.stream_chat_completion(system_prompt, user_prompt, on_token, max_retries=max_retries,
+                                                       use_cache=use_cache, validate=validate, **kwargs))
+        key = self.response_cache_key(system_prompt, user_prompt, use_cache, **kwargs)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return cached
+        logger.info("Beginning chat completion")
+        finish_reasons: List[str] = []
+        completion = self._complete(system_prompt, user_prompt, max_retries, finish_reasons, **kwargs)
+        self.store_response(key, completion, finish_reasons[-1] if finish_reasons else None, validate)
+        return completion
+
+    def stream_chat_completion(self, system_prompt: str, user_prompt: str,
+                               on_token: Optional[Callable[[str], None]] = None, metrics: Optional[StreamMetrics] = None,
+                               max_retries: int = 3, use_cache: bool = True,
+                               validate: Optional[Callable[[str], Any]] = None, **kwargs) -> Iterator[str]:
+        """Complete a chat prompt on the server, yielding the completion as the server streams it
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                on_token (Callable[[str], None], optional): Called with each token as soon as it is produced
+                metrics (StreamMetrics, optional): Filled in with the time to first token and tokens per second
+                max_retries (int): The maximum number of retries
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+            Returns:
+                Iterator[str]: The tokens of the completion"""
+        key = self.response_cache_key(system_prompt, user_prompt, use_cache, **kwargs)
+        cached = self.cached_response(key)
+        if cached is not None:
+            return timed_stream(iter([cached]), on_token, metrics)
+        logger.info("Beginning streamed chat completion")
+        finish_reasons: List[str] = []
+        pieces = self._stream(system_prompt, user_prompt, max_retries, finish_reasons, **kwargs)
+        return timed_stream(self.cached_stream(key, pieces, finish_reasons, validate), on_token, metrics)
+
+    def map_chat_completions(self, requests: Iterable[Dict], **kwargs) -> Iterator[str]:
+        """Complete independent chat prompts concurrently, yielding the completions in the order of the requests.
+
+        At most twice parallelism requests are taken from the iterable ahead of the completion being waited on.
+            Args:
+                requests (Iterable[Dict]): The keyword arguments of each chat_completion call, consumed lazily
+                **kwargs: Keyword arguments shared by every call
+            Returns:
+                Iterator[str]: The completions"""
+        window: deque = deque()
+        executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="llm-http")
+        try:
+            for request in requests:
+                window.append(executor.submit(lambda call: self.chat_completion(**call), {**kwargs, **request}))
+                if len(window) >= self.parallelism * 2:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            # the caller stopped early, the queued requests are dropped and the ones in flight are not waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """Closes the pooled connections and the response cache."""
+        self.session.close()
+        super().close()
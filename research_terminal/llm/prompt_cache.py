@@ -0,0 +1,251 @@
+import hashlib
+import os
+import pickle
+import queue
+import threading
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from llama_cpp.llama import LlamaState
+from llama_cpp.llama_cache import BaseLlamaCache
+from research_terminal.logger.logger import logger
+
+PROMPT_CACHE_DIRECTORY = os.getenv("PROMPT_CACHE_DIR", "research_terminal/llm/prompt_cache")
+RAM_CAPACITY_BYTES = int(float(os.getenv("PROMPT_CACHE_RAM_MB", 2048)) * 1024 * 1024)
+DISK_CAPACITY_BYTES = int(float(os.getenv("PROMPT_CACHE_DISK_MB", 8192)) * 1024 * 1024)
+# evicted states waiting for the disk writer, past this further evictions are dropped instead of spilled
+SPILL_BACKLOG_BYTES = int(float(os.getenv("PROMPT_CACHE_SPILL_BACKLOG_MB", 1024)) * 1024 * 1024)
+# shorter matches are not worth restoring a state for, a chat template header alone is about this long
+MIN_PREFIX_TOKENS = 16
+
+
+def longest_token_prefix(a: Sequence[int], b: Sequence[int]) -> int:
+    """Get the length of the common prefix of two token sequences
+
+    Args:
+        a (Sequence[int]): The first token sequence
+        b (Sequence[int]): The second token sequence
+
+    Returns:
+        int: The number of leading tokens the sequences share
+    """
+    length = min(len(a), len(b))
+    if not length:
+        return 0
+    mismatches = np.flatnonzero(np.asarray(a[:length]) != np.asarray(b[:length]))
+    return int(mismatches[0]) if len(mismatches) else length
+
+
+class TieredPromptCache(BaseLlamaCache):
+    """Two-tier LRU cache of evaluated llama.cpp states, keyed by the tokens they were evaluated on.
+
+    Llama looks up the state sharing the longest token prefix with each new prompt and only
+    evaluates the tokens that differ, so calls sharing a long system prompt skip most of
+    the prompt processing. States evicted from RAM spill to disk from a background thread,
+    so evictions never wait on pickling, and disk hits are promoted back to RAM. Both tiers
+    and the states waiting to be spilled are bounded in bytes.
+    """
+    def __init__(self, ram_capacity_bytes: int = RAM_CAPACITY_BYTES, directory: Optional[str] = PROMPT_CACHE_DIRECTORY,
+                 disk_capacity_bytes: int = DISK_CAPACITY_BYTES):
+        """Initializes the prompt cache.
+        Args:
+            ram_capacity_bytes: The size of the states kept in memory.
+            directory: The directory of the disk tier, None to keep states in memory only.
+            disk_capacity_bytes: The size of the states kept on disk."""
+        super().__init__(capacity_bytes=ram_capacity_bytes)
+        self.directory = directory
+        self.disk_capacity_bytes = disk_capacity_bytes
+        self.ram: OrderedDict[Tuple[int, ...], LlamaState] = OrderedDict()
+        self.disk: OrderedDict[Tuple[int, ...], Tuple[str, int]] = OrderedDict()
+        # evicted states until the writer has put them on disk, still served to lookups meanwhile
+        self.spilling: OrderedDict[Tuple[int, ...], LlamaState] = OrderedDict()
+        self.dropped = 0
+        self.lookups = 0
+        self.ram_hits = 0
+        self.disk_hits = 0
+        self.matched_tokens = 0
+        self._lock = threading.RLock()
+        self._spill_queue: queue.Queue = queue.Queue()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load_disk_index()
+            threading.Thread(target=self._spill_writer, name="prompt-cache-writer", daemon=True).start()
+
+    @property
+    def cache_size(self) -> int:
+        return sum(state.llama_state_size for state in self.ram.values())
+
+    @property
+    def disk_size(self) -> int:
+        return sum(size for _, size in self.disk.values())
+
+    @property
+    def spill_size(self) -> int:
+        return sum(state.llama_state_size for state in self.spilling.values())
+
+    def _find_longest_prefix_key(self, key: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        best_key = None
+        best_length = MIN_PREFIX_TOKENS - 1
+        for candidate in (*self.ram.keys(), *self.spilling.keys(), *self.disk.keys()):
+            length = longest_token_prefix(candidate, key)
+            if length > best_length:
+                best_key, best_length = candidate, length
+        return best_key
+
+    def __getitem__(self, key: Sequence[int]) -> LlamaState:
+        key = tuple(key)
+        with self._lock:
+            self.lookups += 1
+            best_key = self._find_longest_prefix_key(key)
+            if best_key is None:
+                raise KeyError("Key not found")
+            if best_key in self.ram:
+                self.ram.move_to_end(best_key)
+                self.ram_hits += 1
+                state = self.ram[best_key]
+            elif best_key in self.spilling:
+                # back to RAM before the writer got to it, the writer skips it
+                self.ram_hits += 1
+                state = self.spilling.pop(best_key)
+                self._put_ram(best_key, state)
+            else:
+                state = self._read_disk(best_key)
+                if state is None:
+                    raise KeyError("Key not found")
+                self.disk_hits += 1
+                self._put_ram(best_key, state)
+            self.matched_tokens += longest_token_prefix(best_key, key)
+            return state
+
+    def __contains__(self, key: Sequence[int]) -> bool:
+        with self._lock:
+            return self._find_longest_prefix_key(tuple(key)) is not None
+
+    def __setitem__(self, key: Sequence[int], value: LlamaState):
+        with self._lock:
+            self._put_ram(tuple(key), value)
+
+    def _put_ram(self, key: Tuple[int, ...], state: LlamaState):
+        self.ram[key] = state
+        self.ram.move_to_end(key)
+        while self.ram and self.cache_size > self.capacity_bytes:
+            evicted_key, evicted_state = self.ram.popitem(last=False)
+            if self.directory and evicted_key not in self.disk:
+                self._spill(evicted_key, evicted_state)
+
+    def _spill(self, key: Tuple[int, ...], state: LlamaState):
+        if self.spill_size + state.llama_state_size > SPILL_BACKLOG_BYTES:
+            # the disk cannot keep up, dropping the state is cheaper than stalling the model
+            self.dropped += 1
+            logger.debug("Prompt cache spill backlog is full, dropping an evicted state")
+            return
+        self.spilling[key] = state
+        self._spill_queue.put(key)
+
+    def _spill_writer(self):
+        while True:
+            key = self._spill_queue.get()
+            try:
+                with self._lock:
+                    if key in self.disk:
+                        self.spilling.pop(key, None)
+                    state = self.spilling.get(key)
+                # promoted back to RAM, or already on disk
+                if state is None:
+                    continue
+                # pickled and written without the lock, lookups and evictions go on meanwhile
+                size = self._write_disk(key, state)
+                with self._lock:
+                    if self.spilling.get(key) is state:
+                        del self.spilling[key]
+                    if size is not None:
+                        self._add_disk(key, size)
+            finally:
+                self._spill_queue.task_done()
+
+    def _entry_path(self, key: Tuple[int, ...]) -> str:
+        digest = hashlib.sha1(np.asarray(key, dtype=np.int32).tobytes()).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def _load_disk_index(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".tokens.npy"):
+                continue
+            path = os.path.join(self.directory, filename[:-len(".tokens.npy")])
+            try:
+                key = tuple(int(token) for token in np.load(f"{path}.tokens.npy"))
+                size = os.path.getsize(f"{path}.state")
+                entries.append((os.path.getmtime(f"{path}.state"), key, path, size))
+            except (OSError, ValueError):
+                continue
+        for _, key, path, size in sorted(entries):
+            self.disk[key] = (path, size)
+        if entries:
+            logger.debug(f"Prompt cache found {len(entries)} states on disk")
+
+    def _write_disk(self, key: Tuple[int, ...], state: LlamaState) -> Optional[int]:
+        path = self._entry_path(key)
+        # unique per process and thread, several models or processes may share the directory
+        tmp_path = f"{path}.state.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as file:
+                pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, f"{path}.state")
+            np.save(f"{path}.tokens.npy", np.asarray(key, dtype=np.int32))
+            return os.path.getsize(f"{path}.state")
+        except OSError as e:
+            logger.warning(f"Could not spill prompt state to disk: {e}")
+            return None
+
+    def _add_disk(self, key: Tuple[int, ...], size: int):
+        self.disk[key] = (self._entry_path(key), size)
+        while self.disk and self.disk_size > self.disk_capacity_bytes:
+            evicted_key, (evicted_path, _) = self.disk.popitem(last=False)
+            for suffix in (".state", ".tokens.npy"):
+                try:
+                    os.remove(evicted_path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def _read_disk(self, key: Tuple[int, ...]) -> Optional[LlamaState]:
+        path, _ = self.disk[key]
+        try:
+            with open(f"{path}.state", "rb") as file:
+                state = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Dropping unreadable prompt state {path}: {e}")
+            del self.disk[key]
+            return None
+        self.disk.move_to_end(key)
+        os.utime(f"{path}.state")
+        return state
+
+    def persist(self):
+        """Writes the states held in memory to the disk tier, so the next run starts warm, waiting for the writer to finish."""
+        if not self.directory:
+            return
+        with self._lock:
+            for key, state in self.ram.items():
+                if key not in self.disk and key not in self.spilling:
+                    self.spilling[key] = state
+                    self._spill_queue.put(key)
+        self._spill_queue.join()
+
+    def stats(self) -> dict:
+        """Gets the cache counters.
+        Returns:
+            dict: The lookups, hits per tier, hit rate and number of prompt tokens matched by cached states."""
+        with self._lock:
+            hits = self.ram_hits + self.disk_hits
+            return {
+                "lookups": self.lookups,
+                "ram_hits": self.ram_hits,
+                "disk_hits": self.disk_hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "matched_tokens": self.matched_tokens,
+                "ram_bytes": self.cache_size,
+                "disk_bytes": self.disk_size,
+                "spill_dropped": self.dropped,
+            }
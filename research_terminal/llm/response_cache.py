@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from research_terminal.logger.logger import logger
+
+RESPONSE_CACHE_PATH = os.getenv("LLM_RESPONSE_CACHE_PATH", "research_terminal/llm/cache/responses.sqlite3")
+MAX_BYTES = int(float(os.getenv("LLM_RESPONSE_CACHE_MB", 256)) * 1024 * 1024)
+ENABLED = os.getenv("LLM_RESPONSE_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def model_identity(model_path: str) -> str:
+    """Identify a model file, so that replacing the file at the same path invalidates its cached responses
+
+    Args:
+        model_path (str): The path of the model file
+
+    Returns:
+        str: The path along with the size and modification time of the file
+    """
+    try:
+        stat = os.stat(model_path)
+    except OSError:
+        return model_path
+    return f"{model_path}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def response_key(model: str, system_prompt: str, user_prompt: str, grammar: Optional[str], params: Dict[str, Any]) -> str:
+    """Hash everything that determines a completion into a cache key
+
+    Args:
+        model (str): The identity of the model
+        system_prompt (str): The system prompt
+        user_prompt (str): The user prompt
+        grammar (str, optional): The GBNF text of the grammar constraining the output
+        params (Dict[str, Any]): The sampling parameters
+
+    Returns:
+        str: The hex digest of the call
+    """
+    payload = json.dumps({
+        "model": model,
+        "system": system_prompt,
+        "user": user_prompt,
+        "grammar": grammar,
+        "params": params,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed cache of chat completions, evicting the least recently used ones beyond max_bytes."""
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, max_bytes: int = MAX_BYTES):
+        """Initializes the response cache.
+        Args:
+            path: The SQLite file to store the responses in.
+            max_bytes: The total size of the responses kept."""
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Gets a cached response.
+        Args:
+            key(str): The key of the call, see response_key.
+        Returns:
+            Optional[str]: The response, None if it is not cached."""
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        logger.debug(f"LLM response cache hit for {key[:12]}")
+        return row[0]
+
+    def _total_size(self) -> int:
+        # read from the file rather than tracked in memory, other models and processes write to it as well
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def put(self, key: str, response: str):
+        """Stores a response and evicts the least recently used ones if the cache is full.
+        Args:
+            key(str): The key of the call, see response_key.
+            response(str): The completion."""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, size, time.time()))
+            total = self._total_size()
+            if total > self.max_bytes:
+                self._evict(total)
+            self._db.commit()
+
+    def _evict(self, total: int):
+        evicted = 0
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} LLM responses from the cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "bytes": self._total_size()}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,119 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import psutil
+from research_terminal.llm.llama_model import MODEL_PATH, N_CTX, N_GPU_LAYERS, N_THREADS, LlamaModel
+from research_terminal.llm.prompt_cache import RAM_CAPACITY_BYTES
+from research_terminal.logger.logger import logger
+
+# the kinds of calls the agent makes, each can be served by its own model
+TASKS = ("queries", "relevance", "summary", "answer", "report")
+# share of the available memory the models may take, the rest is left to the browsers and the database
+MEMORY_SHARE = float(os.getenv("LLM_MEMORY_SHARE", 0.8))
+MEMORY_BUDGET_BYTES = int(float(os.getenv("LLM_MEMORY_BUDGET_MB", 0)) * 1024 * 1024)
+# used when the model file does not say how large its attention cache is
+DEFAULT_KV_BYTES_PER_TOKEN = 128 * 1024
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """The model and settings serving a task."""
+    model_path: str = MODEL_PATH
+    n_ctx: int = N_CTX
+    n_threads: int = N_THREADS
+    n_gpu_layers: int = N_GPU_LAYERS
+
+    @classmethod
+    def for_task(cls, task: str) -> "ModelSpec":
+        """Reads the spec of a task from LLM_<TASK>_MODEL_PATH, _N_CTX, _THREADS and _GPU_LAYERS, unset ones being the defaults."""
+        prefix = f"LLM_{task.upper()}_"
+        return cls(model_path=os.getenv(prefix + "MODEL_PATH", MODEL_PATH),
+                   n_ctx=int(os.getenv(prefix + "N_CTX", N_CTX)),
+                   n_threads=int(os.getenv(prefix + "THREADS", N_THREADS)),
+                   n_gpu_layers=int(os.getenv(prefix + "GPU_LAYERS", N_GPU_LAYERS)))
+
+
+def kv_bytes_per_token(model_path: str) -> int:
+    """Get the size of the attention cache per token of context, from the model file's metadata
+
+    Args:
+        model_path (str): The path of the GGUF model file
+
+    Returns:
+        int: The bytes per token, keys and values in f16
+    """
+    try:
+        from llama_cpp import Llama
+        metadata = Llama(model_path=model_path, vocab_only=True, verbose=False).metadata
+        architecture = metadata["general.architecture"]
+        layers = int(metadata[f"{architecture}.block_count"])
+        embedding = int(metadata[f"{architecture}.embedding_length"])
+        heads = int(metadata[f"{architecture}.attention.head_count"])
+        kv_heads = int(metadata.get(f"{architecture}.attention.head_count_kv", heads))
+    except Exception as e:
+        logger.warning(f"Could not read the attention shape of {model_path}, assuming "
+                       f"{DEFAULT_KV_BYTES_PER_TOKEN // 1024} KiB per token: {e}")
+        return DEFAULT_KV_BYTES_PER_TOKEN
+    # keys and values, for every layer, of the key-value heads, two bytes each
+    return 2 * layers * (embedding // heads) * kv_heads * 2
+
+
+def estimate_memory(spec: ModelSpec) -> int:
+    """Estimate the memory a model takes once loaded
+
+    The weights are counted whole even when some layers are offloaded to the GPU.
+
+    Args:
+        spec (ModelSpec): The model and its settings
+
+    Returns:
+        int: The bytes taken by the weights, the attention cache and the prompt cache held in memory
+    """
+    weights = os.path.getsize(spec.model_path) if os.path.exists(spec.model_path) else 0
+    return weights + spec.n_ctx * kv_bytes_per_token(spec.model_path) + RAM_CAPACITY_BYTES
+
+
+def memory_budget() -> int:
+    """The bytes the models may take, LLM_MEMORY_BUDGET_MB or a share of the available memory."""
+    return MEMORY_BUDGET_BYTES or int(psutil.virtual_memory().available * MEMORY_SHARE)
+
+
+class ModelRouter:
+    """Serves each task with its own model, such as a small fast model for the search queries
+    and relevance checks and a larger one for the reports.
+
+    Tasks configured alike share one model. When the distinct models would not fit the memory
+    budget together, every task falls back to the report model.
+    """
+    def __init__(self, specs: Optional[Dict[str, ModelSpec]] = None, budget: Optional[int] = None):
+        """Initializes the router, the models are loaded on first use.
+        Args:
+            specs: The spec of each task, read from the environment by default.
+            budget: The bytes the models may take together, see memory_budget."""
+        self.specs = specs or {task: ModelSpec.for_task(task) for task in TASKS}
+        self._lock = threading.Lock()
+        distinct = set(self.specs.values())
+        if len(distinct) > 1:
+            budget = budget if budget is not None else memory_budget()
+            needed = sum(estimate_memory(spec) for spec in distinct)
+            if needed > budget:
+                fallback = self.specs.get("report", ModelSpec())
+                logger.warning(f"The {len(distinct)} task models need {needed / 2**30:.1f} GiB, more than the "
+                               f"{budget / 2**30:.1f} GiB budget, every task uses {fallback.model_path}")
+                self.specs = {task: fallback for task in self.specs}
+            else:
+                logger.info(f"The {len(distinct)} task models need {needed / 2**30:.1f} GiB of the "
+                            f"{budget / 2**30:.1f} GiB budget")
+
+    def model_for(self, task: str) -> LlamaModel:
+        """Get the model serving a task.
+        Args:
+            task (str): One of TASKS, unknown tasks are served by the default model
+        Returns:
+            LlamaModel: The model, loaded on first use and shared by the tasks configured alike"""
+        spec = self.specs.get(task, ModelSpec())
+        # two tasks asking for the same model at once must not load it twice
+        with self._lock:
+            return LlamaModel(spec.model_path, spec.n_ctx, spec.n_threads, spec.n_gpu_layers)
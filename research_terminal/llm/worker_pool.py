@@ -0,0 +1,442 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from llama_cpp import Llama
+from research_terminal.llm.base_llm_model import BaseLLMModel, StreamMetrics, timed_stream
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text
+from research_terminal.llm.llama_model import MODEL_PATH, N_CTX, complete_chat, load_llama, stream_chat
+from research_terminal.llm.prompt_cache import TieredPromptCache
+from research_terminal.llm import response_cache
+from research_terminal.scraping.processing.tokens import TokenCounter
+from research_terminal.logger.logger import logger
+
+N_WORKERS = int(os.getenv("LLM_WORKERS", 2))
+THREADS_PER_WORKER = int(os.getenv("LLM_WORKER_THREADS", max((os.cpu_count() or 1) // N_WORKERS, 1)))
+# the pool is meant for CPU boxes, offloading several model copies would not fit most GPUs
+WORKER_GPU_LAYERS = int(os.getenv("LLM_WORKER_GPU_LAYERS", 0))
+WORKER_PROMPT_CACHE_BYTES = int(float(os.getenv("LLM_WORKER_PROMPT_CACHE_MB", 512)) * 1024 * 1024)
+# calls waiting for each worker on top of the one it is running
+QUEUE_DEPTH = 2
+START_TIMEOUT = 600
+# how long closing the pool waits for the calls already queued
+CLOSE_TIMEOUT = 30
+# dead workers restarted over the pool's lifetime, past this the pool keeps going with the ones left
+MAX_RESTARTS = int(os.getenv("LLM_WORKER_RESTARTS", 3))
+HEALTH_CHECK_INTERVAL = 1.0
+
+
+def _worker_main(worker_id: int, model_path: str, n_ctx: int, n_threads: int, n_gpu_layers: int, cache_bytes: int,
+                 tasks, results):
+    """Runs in each worker process: loads a model and completes the calls the pool assigns to it, one at a time.
+
+    Results are sent back as (worker id, task id, kind, value), kind being "token" for each
+    streamed token, "done" with the completion and its finish reason, or "error" with the error
+    message. Once the model is loaded, the worker reports "done" or "error" without a task id.
+    """
+    try:
+        llm = load_llama(model_path, n_ctx, n_threads, n_gpu_layers, verbose=False)
+        llm.set_cache(TieredPromptCache(cache_bytes, directory=None))
+    except Exception as e:
+        results.put((worker_id, None, "error", f"Worker {worker_id} could not load the model: {e}"))
+        return
+    results.put((worker_id, None, "done", None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, kwargs = task
+        try:
+            stream = kwargs.pop("stream", False)
+            finish_reasons: List[str] = []
+            if stream:
+                pieces = []
+                for piece in stream_chat(llm, finish_reasons=finish_reasons, **kwargs):
+                    results.put((worker_id, task_id, "token", piece))
+                    pieces.append(piece)
+                completion = "".join(pieces)
+            else:
+                completion = complete_chat(llm, finish_reasons=finish_reasons, **kwargs)
+            results.put((worker_id, task_id, "done", (completion, finish_reasons[-1] if finish_reasons else None)))
+        except Exception as e:
+            results.put((worker_id, task_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class LlamaWorkerPool(BaseLLMModel):
+    """Serves chat completions from several worker processes, each holding its own Llama instance.
+
+    Calls wait in the pool's backlog and are handed to whichever worker frees up first, so a
+    slow call never holds up the others, and the pool always knows which call each worker runs.
+    The number of calls in flight is bounded: submitting blocks while every slot is taken, which
+    keeps a fast producer, such as a long page being chunked, from queueing unbounded work.
+    A worker that dies fails the call it was running and is restarted, up to MAX_RESTARTS times.
+    """
+    def __init__(self, workers: int = N_WORKERS, threads_per_worker: int = THREADS_PER_WORKER,
+                 queue_depth: int = QUEUE_DEPTH):
+        """Initializes the pool and waits for every worker to load its model.
+        Args:
+            workers: The number of worker processes.
+            threads_per_worker: The number of threads each worker's model runs with.
+            queue_depth: The number of calls queued per worker on top of the one it is running."""
+        self.model_path = MODEL_PATH
+        self.n_ctx = N_CTX
+        self.parallelism = workers
+        self.threads_per_worker = threads_per_worker
+        self.max_pending = workers * (1 + queue_depth)
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        # each worker gets its own queue, holding at most the one call assigned to it
+        self._task_queues = [self._context.Queue() for _ in range(workers)]
+        # the calls not assigned yet, and the call assigned to each busy worker
+        self._backlog: deque = deque()
+        self._assigned: Dict[int, int] = {}
+        # the workers that have loaded the model and may be assigned calls
+        self._ready: set = set()
+        self._restarts = 0
+        # the workers that died once the restarts ran out
+        self._lost: set = set()
+        # the future of each call in flight, the queue its tokens are streamed to, and its cache key and validator
+        self._pending: Dict[int, Tuple[Future, Optional[queue.Queue], Optional[str], Optional[Callable[[str], Any]]]] = {}
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.response_cache = response_cache.ResponseCache() if response_cache.ENABLED else None
+        self.processes = self.load_model()
+        # the tokenizer is all the parent process needs to budget prompts
+        self.tokenizer = Llama(model_path=self.model_path, vocab_only=True, verbose=False)
+        self._tokenizer_lock = threading.Lock()
+        self.token_counter = TokenCounter(self.tokenize)
+        self._collector = threading.Thread(target=self._collect, name="llm-pool-collector", daemon=True)
+        self._collector.start()
+        logger.debug("LlamaWorkerPool initialized")
+
+    def load_model(self, **kwargs) -> List[multiprocessing.Process]:
+        """Starts the worker processes and waits until each has loaded the model.
+
+        Returns:
+            List[Process]: The worker processes
+        """
+        logger.info(f"Starting {self.parallelism} model workers with {self.threads_per_worker} threads each")
+        processes = [self._start_worker(worker_id) for worker_id in range(self.parallelism)]
+        for _ in processes:
+            try:
+                worker_id, _, kind, value = self._results.get(timeout=START_TIMEOUT)
+            except queue.Empty:
+                worker_id, kind, value = None, "error", f"Model workers did not start within {START_TIMEOUT}s"
+            if kind == "error":
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError(value)
+            self._ready.add(worker_id)
+        return processes
+
+    def _start_worker(self, worker_id: int) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=_worker_main, name=f"llm-worker-{worker_id}", daemon=True,
+            args=(worker_id, self.model_path, self.n_ctx, self.threads_per_worker, WORKER_GPU_LAYERS,
+                  WORKER_PROMPT_CACHE_BYTES, self._task_queues[worker_id], self._results),
+        )
+        process.start()
+        return process
+
+    def tokenize(self, text: str) -> list[int]:
+        """Tokenize a text with the model's tokenizer
+
+        Args:
+            text (str): The text to tokenize
+
+        Returns:
+            list[int]: The tokens, without the beginning of sequence token
+        """
+        with self._tokenizer_lock:
+            return self.tokenizer.tokenize(text.encode("utf-8"), add_bos=False)
+
+    def submit(self, token_queue: Optional[queue.Queue] = None, use_cache: bool = True,
+               validate: Optional[Callable[[str], Any]] = None, **kwargs) -> Future:
+        """Queues a chat completion, blocking while the pool already has max_pending calls in flight.
+
+        Calls found in the response cache are resolved right away without using a worker.
+            Args:
+                token_queue (queue.Queue, optional): Streams the completion, each token is put on it, then None
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+                **kwargs: The arguments of chat_completion
+            Returns:
+                Future: The future of the completion"""
+        if self._closed:
+            raise RuntimeError("The worker pool is closed")
+        if len(self._lost) == len(self.processes):
+            raise RuntimeError("Every model worker of the pool died")
+        key = self.response_cache_key(use_cache=use_cache, **kwargs)
+        cached = self.cached_response(key)
+        future: Future = Future()
+        if cached is not None:
+            future.set_result(cached)
+            if token_queue is not None:
+                token_queue.put(cached)
+                token_queue.put(None)
+            return future
+        grammar = kwargs.get("grammar")
+        if grammar is not None and not isinstance(grammar, str):
+            # compiled grammars cannot be sent to the workers, their text is compiled there once
+            kwargs["grammar"] = get_grammar_text(grammar)
+            if kwargs["grammar"] is None:
+                raise ValueError("Grammars sent to the worker pool have to come from the grammar cache")
+        if token_queue is not None:
+            kwargs["stream"] = True
+        self._slots.acquire()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = (future, token_queue, key, validate)
+            self._backlog.append((task_id, kwargs))
+            self._assign()
+        return future
+
+    def _assign(self):
+        """Hands the backlog to the idle workers, the caller holds the lock."""
+        for worker_id in sorted(self._ready - set(self._assigned)):
+            if not self._backlog:
+                return
+            task_id, kwargs = self._backlog.popleft()
+            # recorded before the worker can take it, so a worker dying at any point fails its call
+            self._assigned[worker_id] = task_id
+            self._task_queues[worker_id].put((task_id, kwargs))
+
+    def cancel(self, future: Future) -> bool:
+        """Cancels a call that no worker has started yet.
+            Args:
+                future (Future): The future returned by submit
+            Returns:
+                bool: Whether the call was cancelled, False if it is running or done"""
+        with self._lock:
+            task_id = next((task_id for task_id, entry in self._pending.items() if entry[0] is future), None)
+            queued = next((task for task in self._backlog if task[0] == task_id), None)
+            if queued is None or not future.cancel():
+                return False
+            self._backlog.remove(queued)
+            _, token_queue, _, _ = self._pending.pop(task_id)
+        self._slots.release()
+        if token_queue is not None:
+            token_queue.put(None)
+        return True
+
+    def _collect(self):
+        """Resolves the futures of finished calls, and checks on the workers every HEALTH_CHECK_INTERVAL seconds."""
+        checked = time.monotonic()
+        while True:
+            if time.monotonic() - checked >= HEALTH_CHECK_INTERVAL:
+                self._check_workers()
+                checked = time.monotonic()
+            try:
+                item = self._results.get(timeout=HEALTH_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            self._handle(item)
+
+    def _handle(self, item: Tuple[int, Optional[int], str, Any]):
+        worker_id, task_id, kind, value = item
+        if task_id is None:
+            # a restarted worker reporting whether it loaded the model
+            if kind == "error":
+                logger.error(value)
+                return
+            with self._lock:
+                self._ready.add(worker_id)
+                self._assign()
+            return
+        with self._lock:
+            if kind == "token":
+                entry = self._pending.get(task_id)
+            else:
+                entry = self._pending.pop(task_id, None)
+                if self._assigned.get(worker_id) == task_id:
+                    del self._assigned[worker_id]
+                self._assign()
+        if entry is None:
+            return
+        future, token_queue, key, validate = entry
+        if kind == "token":
+            if token_queue is not None:
+                token_queue.put(value)
+            return
+        self._slots.release()
+        try:
+            if kind == "done":
+                completion, finish_reason = value
+                self.store_response(key, completion, finish_reason, validate)
+                future.set_result(completion)
+            else:
+                future.set_exception(Exception(value))
+        except InvalidStateError:
+            pass
+        if token_queue is not None:
+            token_queue.put(None)
+
+    def _drain(self):
+        """Handles the results already sent, so the ones a dead worker sent before dying are not lost."""
+        while True:
+            try:
+                item = self._results.get_nowait()
+            except queue.Empty:
+                return
+            if item is None:
+                # closing, left for the collector loop to stop on
+                self._results.put(None)
+                return
+            self._handle(item)
+
+    def _check_workers(self):
+        """Fails the call of each dead worker and restarts the worker, or gives up on it once the restarts ran out."""
+        if self._closed:
+            return
+        dead = [worker_id for worker_id, process in enumerate(self.processes)
+                if worker_id not in self._lost and not process.is_alive()]
+        if not dead:
+            return
+        self._drain()
+        for worker_id in dead:
+            process = self.processes[worker_id]
+            error = RuntimeError(f"Model worker {worker_id} died with exit code {process.exitcode}")
+            with self._lock:
+                self._ready.discard(worker_id)
+                task_id = self._assigned.pop(worker_id, None)
+                entry = self._pending.pop(task_id, None) if task_id is not None else None
+            if entry is not None:
+                future, token_queue, _, _ = entry
+                self._slots.release()
+                try:
+                    future.set_exception(error)
+                except InvalidStateError:
+                    pass
+                if token_queue is not None:
+                    token_queue.put(None)
+            if self._restarts < MAX_RESTARTS:
+                self._restarts += 1
+                logger.warning(f"{error}, restarting it ({self._restarts} of {MAX_RESTARTS} restarts)")
+                # a fresh queue, the old one may hold a call the dead worker never took
+                self._task_queues[worker_id] = self._context.Queue()
+                self.processes[worker_id] = self._start_worker(worker_id)
+                continue
+            self._lost.add(worker_id)
+            alive = len(self.processes) - len(self._lost)
+            logger.error(f"{error}, the pool carries on with {alive} of {len(self.processes)} workers")
+            if not alive:
+                self._fail_pending(RuntimeError("Every model worker of the pool died"))
+
+    def _fail_pending(self, error: Exception):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._backlog.clear()
+            self._assigned.clear()
+        if pending:
+            logger.error(f"{error}, failing {len(pending)} pending calls")
+        for future, token_queue, _, _ in pending.values():
+            self._slots.release()
+            if not future.cancel():
+                try:
+                    future.set_exception(error)
+                except InvalidStateError:
+                    pass
+            if token_queue is not None:
+                token_queue.put(None)
+
+    def chat_completion(self, system_prompt: str, user_prompt: str, max_retries: int = 3,
+                        on_token: Optional[Callable[[str], None]] = None, use_cache: bool = True,
+                        validate: Optional[Callable[[str], Any]] = None, **kwargs) -> str:
+        """Complete a chat prompt on the next free worker
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                max_retries (int): The maximum number of retries
+                on_token (Callable[[str], None], optional): Streams the completion, calling it with each token
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+            Returns:
+                str: The completion of the chat prompt"""
+        if on_token:
+            return "".join(self.stream_chat_completion(system_prompt, user_prompt, on_token, max_retries=max_retries,
+                                                       use_cache=use_cache, validate=validate, **kwargs))
+        logger.info("Beginning chat completion")
+        return self.submit(system_prompt=system_prompt, user_prompt=user_prompt, max_retries=max_retries,
+                           use_cache=use_cache, validate=validate, **kwargs).result()
+
+    def stream_chat_completion(self, system_prompt: str, user_prompt: str,
+                               on_token: Optional[Callable[[str], None]] = None, metrics: Optional[StreamMetrics] = None,
+                               max_retries: int = 3, use_cache: bool = True,
+                               validate: Optional[Callable[[str], Any]] = None, **kwargs) -> Iterator[str]:
+        """Complete a chat prompt on the next free worker, yielding the completion token by token
+            Args:
+                system_prompt (str): The system prompt
+                user_prompt (str): The user prompt
+                on_token (Callable[[str], None], optional): Called with each token as soon as it is produced
+                metrics (StreamMetrics, optional): Filled in with the time to first token and tokens per second
+                max_retries (int): The maximum number of retries
+                use_cache (bool): Whether to serve and store the completion in the response cache
+                validate (Callable[[str], Any], optional): Parses the completion, it is only cached if this succeeds
+            Returns:
+                Iterator[str]: The tokens of the completion"""
+        logger.info("Beginning streamed chat completion")
+        token_queue: queue.Queue = queue.Queue()
+        future = self.submit(token_queue=token_queue, use_cache=use_cache, validate=validate, system_prompt=system_prompt,
+                             user_prompt=user_prompt, max_retries=max_retries, **kwargs)
+
+        def pieces() -> Iterator[str]:
+            while True:
+                piece = token_queue.get()
+                if piece is None:
+                    break
+                yield piece
+            # raises the error of a failed call
+            future.result()
+        return timed_stream(pieces(), on_token, metrics)
+
+    def map_chat_completions(self, requests: Iterable[Dict], **kwargs) -> Iterator[str]:
+        """Complete independent chat prompts across the workers, yielding the completions in the order of the requests.
+
+        At most max_pending requests are taken from the iterable ahead of the completion being waited on.
+            Args:
+                requests (Iterable[Dict]): The keyword arguments of each chat_completion call, consumed lazily
+                **kwargs: Keyword arguments shared by every call
+            Returns:
+                Iterator[str]: The completions"""
+        window: deque = deque()
+        try:
+            for request in requests:
+                window.append(self.submit(**kwargs, **request))
+                if len(window) >= self.max_pending:
+                    yield window.popleft().result()
+            while window:
+                yield window.popleft().result()
+        finally:
+            # the caller stopped early, the calls no worker has started are dropped
+            for future in window:
+                self.cancel(future)
+
+    def close(self):
+        """Stops the workers once they have finished the calls already queued."""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            futures = [entry[0] for entry in self._pending.values()]
+        # the collector keeps handing the backlog to the workers meanwhile
+        wait(futures, timeout=CLOSE_TIMEOUT)
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=CLOSE_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=5)
+        self._fail_pending(RuntimeError("The worker pool was closed"))
+        super().close()
@@ -0,0 +1,23 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Generator
+
+from research_terminal.logger.logger import logger
+
+# seconds spent in each timed step, in the order the steps finished
+TIMINGS: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(name: str) -> Generator[None, None, None]:
+    """Time a block and record it in TIMINGS under the given name
+
+    Args:
+        name (str): The name of the step, such as "load model"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS[name] = TIMINGS.get(name, 0.0) + time.perf_counter() - start
+        logger.debug(f"{name} took {TIMINGS[name]:.3f}s")
@@ -1,65 +1,182 @@
-from research_terminal.llm.llama_model import LlamaModel
+from research_terminal.llm.backends import get_llm_model, loaded_models
 from research_terminal.llm.prompts import generate_search_queries_prompt,  answer_question_prompt, research_report_prompt, generate_report_prompt
 from research_terminal.llm.llm_parser import check_relevance
 import json
-from research_terminal.llm.grammar.pydantic_models import Summary
-from research_terminal.scraping.web_search import Duckduckgo
+from research_terminal.llm.grammar.pydantic_models import Relevant, Summary
+from research_terminal.scraping.web_search import Duckduckgo, merge_search_results
+from research_terminal.scraping.search_cache import SearchCache, normalize_query
 from research_terminal.scraping.web_scrape import WebScraper
+from research_terminal.scraping.browser_pool import BrowserPool
+from research_terminal.scraping.http_fetch import HttpFetcher
+from research_terminal.scraping.page_cache import PageCache
+from research_terminal.scraping.processing.boilerplate import MainContentExtractor
+from research_terminal.scraping.processing.dedup import DedupIndex
+from research_terminal.scraping.processing.context_packer import ContextPacker
+from research_terminal.scraping.processing.tokens import input_token_budget
+from research_terminal.scraping.scheduler import CrawlScheduler
 from research_terminal.scraping.processing.text import summarize_text, write_to_file
-from research_terminal.llm.grammar.pydantic_models_to_grammar import generate_gbnf_grammar_and_documentation
-from llama_cpp.llama_grammar import LlamaGrammar
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text_and_documentation
 from research_terminal.llm.grammar.pydantic_models import SearchQueries, ResearchReport
+from research_terminal.llm.incremental_json import PartialField, StreamingModelParser
 from pathvalidate import sanitize_filename
 import os
 from research_terminal.vector_db.chroma import ChromaDBClient
+from research_terminal.vector_db.relevance_gate import RelevanceGate, similarity
 from research_terminal.logger.logger import logger
-from typing import List
+import threading
+from research_terminal.llm.base_llm_model import BaseLLMModel
+from research_terminal.logger.timing import timed
+from typing import Callable, Dict, Generator, List, Optional, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+MAX_LINKS = 3
+NUM_QUERIES = 3
+# share of the context window kept for the report, the rest holds the prompt and the articles
+REPORT_OUTPUT_SHARE = 0.5
+SEARCH_RESULTS = 5
 
 class ResearchAgent:
     def __init__(self):
-        self.model = LlamaModel()
-        self.db = ChromaDBClient()
+        # the model, the database and the indexes built from it are loaded on first use
+        self._models: Dict[str, BaseLLMModel] = {}
+        self._db: Optional[ChromaDBClient] = None
+        self._stored_index: Optional[DedupIndex] = None
+        self._chunk_index: Optional[DedupIndex] = None
+        self._init_lock = threading.RLock()
+        self.browser_pool = BrowserPool('firefox')
+        self.scraper = WebScraper(pool=self.browser_pool, fetcher=HttpFetcher(), cache=PageCache(), extractor=MainContentExtractor())
+        self.scheduler = CrawlScheduler(self.scraper)
+        self.search_cache = SearchCache()
+        # long-lived threads, so the Duckduckgo session each of them opens is reused across research runs
+        self.search_executor = ThreadPoolExecutor(max_workers=NUM_QUERIES + 1, thread_name_prefix="search")
         self.visited_urls = set()
-        
+        self.page_index = DedupIndex(name="scraped pages")
+        self.relevance_gate = RelevanceGate()
+
+    @property
+    def model(self) -> BaseLLMModel:
+        """The model writing the reports."""
+        return self.model_for("report")
+
+    def model_for(self, task: str) -> BaseLLMModel:
+        """The model serving a kind of call, see router.TASKS, loaded on first use."""
+        with self._init_lock:
+            if task not in self._models:
+                with timed(f"load {task} model"):
+                    self._models[task] = get_llm_model(task=task)
+        return self._models[task]
+
+    @property
+    def db(self) -> ChromaDBClient:
+        with self._init_lock:
+            if self._db is None:
+                with timed("open database"):
+                    self._db = ChromaDBClient()
+        return self._db
+
+    @property
+    def stored_index(self) -> DedupIndex:
+        """Index of the documents stored in the database."""
+        with self._init_lock:
+            if self._stored_index is None:
+                index = DedupIndex(name="stored documents")
+                with timed("index stored documents"):
+                    index.add_many(self.db.get_documents())
+                self._stored_index = index
+        return self._stored_index
+
+    @property
+    def chunk_index(self) -> DedupIndex:
+        """Index of the chunks summarized in this research run, seeded with the stored documents."""
+        with self._init_lock:
+            if self._chunk_index is None:
+                self._chunk_index = self.stored_index.copy()
+                self._chunk_index.name = "scraped chunks and stored documents"
+        return self._chunk_index
 
     
-    def generate_search_queries(self, question: str, num_queries: int = 3) -> SearchQueries:
+    def generate_search_queries(self, question: str, num_queries: int = NUM_QUERIES,
+                                on_query: Optional[Callable[[str], None]] = None) -> SearchQueries:
         """Generates the search queries for the given question.
         Args:
             question (str): The question to generate the search queries for
+            on_query (Callable[[str], None], optional): Called with each query as soon as it is generated
         Returns:
             SearchQueries: The search queries for the given question
             """
         search_query_prompt = generate_search_queries_prompt(question, num_queries)
-        gbnf_grammar, documentation = generate_gbnf_grammar_and_documentation([SearchQueries])
-        gbnf_grammar = LlamaGrammar.from_string(gbnf_grammar)
+        gbnf_grammar, documentation = get_grammar_text_and_documentation([SearchQueries])
         search_query_system_message = """You are an advanced AI research assistant, tasked with creating search queries in JSON format to find information on a given prompt. The following is the expected output:\n\n""" + documentation
 
-        search_queries = self.model.chat_completion(
+        def on_field(field: PartialField):
+            if on_query and field.name == "queries" and field.index is not None:
+                on_query(field.value)
+        parser = StreamingModelParser(SearchQueries, on_field=on_field)
+        return parser.consume(self.model_for("queries").stream_chat_completion(
             user_prompt=search_query_prompt, system_prompt=search_query_system_message,
-            grammar=gbnf_grammar, max_tokens=1024
-        )
-
-        search_queries = json.loads(search_queries) #type: ignore
-        return SearchQueries(**search_queries)
+            grammar=gbnf_grammar, max_tokens=1024, validate=SearchQueries.model_validate_json
+        ))
     
     
-    def search_web(self, query: str, max_links: int=1)-> List[str]:
-        ddg = Duckduckgo(query)
+    def search(self, query: str, max_results: int = SEARCH_RESULTS) -> List[Dict]:
+        ddg = Duckduckgo(query, cache=self.search_cache)
         logger.debug(f"Searching the web for query: {query}")
-        results = ddg.search()
-        search_urls = [result['href'] for result in results if result['href'] not in self.visited_urls]
-        new_search_urls = search_urls[:max_links]
-        return [self.browse_website(url, query) for url in new_search_urls if url is not None]
-    
-    
-    def browse_website(self, url: str, question: str)-> str:
+        try:
+            return ddg.search(max_results)
+        except Exception as e:
+            logger.error(f"Search failed for query {query}: {e}")
+            return []
+
+    def search_queries(self, queries: List[str], max_links: int = MAX_LINKS) -> List[str]:
+        """Runs the searches for all the queries concurrently and ranks the urls they return.
+        Args:
+            queries (List[str]): The queries to search for
+            max_links (int): The number of urls to return
+        Returns:
+            List[str]: The best ranked urls that have not been visited yet, across all queries
+        """
+        if not queries:
+            return []
+        result_lists = list(self.search_executor.map(self.search, queries))
+        urls = merge_search_results(result_lists, max_links, exclude=self.visited_urls)
+        logger.info(f"Selected {len(urls)} urls from {len(queries)} searches")
+        return urls
+
+    def search_web(self, query: str, max_links: int=1)-> List[str]:
+        return self.browse_websites(self.search_queries([query], max_links), query)
+
+    def browse_websites(self, urls: List[str], question: str) -> List[str]:
+        # pages are summarized in the order they finish loading, while the rest are still being scraped
+        pages = ((url, text) for url, text in self.scrape_websites(urls) if not self.page_index.check(url, text))
+        parallelism = self.model_for("summary").parallelism
+        if parallelism > 1:
+            # pages are summarized side by side, the model's workers interleave their chunks
+            with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="summarize") as executor:
+                summaries = list(executor.map(lambda page: self.summarize_website(page[0], question, page[1]), pages))
+        else:
+            summaries = [self.summarize_website(url, question, text) for url, text in pages]
+        return [summary for summary in summaries if summary]
+
+    def scrape_websites(self, urls: List[str]) -> Generator[Tuple[str, str], None, None]:
+        """Scrapes the urls concurrently, politely per domain, and yields each page as soon as it is done.
+        Args:
+            urls (List[str]): The urls to scrape
+        Yields:
+            Tuple[str, str]: The url and the text of the page, in completion order
+        """
+        yield from self.scheduler.scrape_all(urls)
+
+    def browse_website(self, url: str, question: str)-> Optional[str]:
         logger.info(f"Browsing website: {url}")
-        scraper = WebScraper('firefox')
-        text = scraper.scrape(url)
-        summary = summarize_text(question, text)
+        text = self.scraper.scrape(url)
+        return self.summarize_website(url, question, text)
+
+    def summarize_website(self, url: str, question: str, text: str) -> Optional[str]:
+        logger.info(f"Summarizing website: {url}")
+        summary = summarize_text(question, text, dedup=self.chunk_index, source=url)
         self.visited_urls.add(url)
-        scraper.quit()
+        if summary is None:
+            return None
         return f"""
     Article Summary:
         Title: {summary.title}
@@ -79,39 +196,83 @@ class ResearchAgent:
         return '\n'.join(f"Question: {summary.question}\nSummary: {summary.summary}\nRelevance: {summary.relevance}" for summary in chunk_summaries)
     
     
-    def query_db(self, question: str):
+    def query_db(self, question: str) -> Optional[Tuple[str, Optional[float]]]:
+        """Looks the question up in the database.
+        Args:
+            question (str): The question
+        Returns:
+            Optional[Tuple[str, Optional[float]]]: The documents found and the similarity of the closest one, None if nothing was found
+        """
         results = self.db.query_text(question)
         # if the documents returned in the form of [[]], then no results were found
         if results['documents'] == [[]]:
             return None
-        return json.dumps(results['documents'])
-    
-    
-        
-    
-    def process_db_results(self, question: str, db_results: str):
+        distances = results.get('distances') or [[]]
+        closest = similarity(distances[0][0], self.db.distance_space) if distances[0] else None
+        return json.dumps(results['documents']), closest
+
+    def process_db_results(self, question: str, db_results: str, on_token: Optional[Callable[[str], None]] = None,
+                           db_similarity: Optional[float] = None):
+        """Answers the question from the database results if they are relevant.
+
+        With the similarity of the results, the relevance gate settles clear cases without the model.
+        Args:
+            question (str): The question
+            db_results (str): The documents found in the database
+            on_token (Callable[[str], None], optional): Called with each token of the answer as it is generated
+            db_similarity (float, optional): The similarity of the question and the closest document
+        Returns:
+            Optional[str]: The answer, None if the results are not relevant
+        """
         logger.info(f"Checking relevance of database results for question: {question}")
-        relevance = check_relevance(question, db_results)
-        if relevance.relevance == 'yes':
+
+        def judge() -> bool:
+            return check_relevance(question, db_results).relevance == Relevant.YES
+
+        if db_similarity is None:
+            relevant = judge()
+        else:
+            relevant = self.relevance_gate.decide(question, db_similarity, judge).relevant
+        if relevant:
             logger.info(f"Database results are relevant for question: {question}")
             prompt = answer_question_prompt(question, db_results)
-            result = self.model.chat_completion(system_prompt=self.model.system_prompt, user_prompt=prompt)
+            model = self.model_for("answer")
+            result = model.chat_completion(system_prompt=model.system_prompt, user_prompt=prompt, on_token=on_token)
             return result
         else:
             logger.info(f"Database results not relevant for question: {question}")
             return None
-    def generate_report(self, queries: List[str], research_info: str)-> ResearchReport:
+
+    def generate_report(self, queries: List[str], articles: List[str], on_token: Optional[Callable[[str], None]] = None,
+                        on_field: Optional[Callable[[PartialField], None]] = None)-> ResearchReport:
+        """Writes the research report from the article summaries.
+
+        The articles are packed into what the context window leaves next to the prompt and the
+        report, the least relevant ones being compressed or dropped.
+        Args:
+            queries (List[str]): The question followed by the search queries
+            articles (List[str]): The summary of each article
+        Returns:
+            ResearchReport: The report
+        """
         logger.info(f"Generating research report")
-        report_prompt = research_report_prompt(queries, research_info)
-        gbnf_grammar, documentation = generate_gbnf_grammar_and_documentation([ResearchReport])
-        gbnf_grammar = LlamaGrammar.from_string(gbnf_grammar)
+        gbnf_grammar, documentation = get_grammar_text_and_documentation([ResearchReport])
         report_system_message = generate_report_prompt(documentation=documentation)
-        report = self.model.chat_completion(
-            user_prompt=report_prompt, system_prompt=report_system_message,
-            grammar=gbnf_grammar, max_tokens=4096, temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17
-        )
-        report = json.loads(report)
-        return ResearchReport(**report)
+        max_tokens = int(self.model.n_ctx * REPORT_OUTPUT_SHARE)
+        budget = input_token_budget(self.model.n_ctx, max_tokens, report_system_message,
+                                    research_report_prompt(queries, ""), counter=self.model.token_counter)
+        research_info, _ = ContextPacker(self.model.token_counter).pack(articles, " ".join(queries), budget)
+        report_prompt = research_report_prompt(queries, research_info)
+        # sections are validated as soon as they are generated, instead of after the whole report
+        parser = StreamingModelParser(ResearchReport, on_field=on_field or self.log_report_field)
+        return parser.consume(self.model.stream_chat_completion(
+            user_prompt=report_prompt, system_prompt=report_system_message, on_token=on_token,
+            grammar=gbnf_grammar, max_tokens=max_tokens, validate=ResearchReport.model_validate_json, temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17
+        ))
+
+    def log_report_field(self, field: PartialField):
+        if field.name == "main_body" and field.index is not None:
+            logger.info(f"Report section {field.index + 1} ready: {field.value.title}")
     
     def beautify_report(self, report: ResearchReport) -> str:
         return (
@@ -127,31 +288,105 @@ class ResearchAgent:
             + "\n\n".join(f"{reference.title}\n{reference.url}" for reference in report.references)
     )
 
-    def process_web_search(self, question: str):
+    def get_queries(self, question: str, on_query: Optional[Callable[[str], None]] = None) -> List[str]:
+        """Gets the question along with the generated search queries, without duplicates.
+        Args:
+            question (str): The research question
+            on_query (Callable[[str], None], optional): Called with each unique query as soon as it is known
+        Returns:
+            List[str]: The queries
+        """
+        unique: Dict[str, str] = {}
+
+        def add(query: str):
+            key = normalize_query(query)
+            if key and key not in unique:
+                unique[key] = query.strip()
+                if on_query:
+                    on_query(unique[key])
+        add(question)
+        try:
+            self.generate_search_queries(question, on_query=add)
+        except Exception as e:
+            # the queries streamed before the failure are kept
+            logger.error(f"Failed to generate search queries, searching {len(unique)} queries: {e}")
+        logger.info(f"Searching for queries: {list(unique.values())}")
+        return list(unique.values())
+
+    def search_as_generated(self, question: str, max_links: int = MAX_LINKS) -> Tuple[List[str], List[str]]:
+        """Generates the search queries and runs each search as soon as its query is generated.
+        Args:
+            question (str): The research question, searched while the queries are generated
+            max_links (int): The number of urls to return
+        Returns:
+            Tuple[List[str], List[str]]: The queries, and the best ranked urls of their searches
+        """
+        searches: Dict[str, Future] = {}
+        queries = self.get_queries(question, on_query=lambda query: searches.setdefault(
+            query, self.search_executor.submit(self.search, query)))
+        result_lists = [searches[query].result() for query in queries]
+        urls = merge_search_results(result_lists, max_links, exclude=self.visited_urls)
+        logger.info(f"Selected {len(urls)} urls from {len(queries)} searches")
+        return queries, urls
+
+    def process_web_search(self, question: str, on_token: Optional[Callable[[str], None]] = None,
+                           on_field: Optional[Callable[[PartialField], None]] = None):
         logger.info(f"Searching the web for question: {question}")
-        search_results = [self.search_web(question, 3)]
+        queries, urls = self.search_as_generated(question, MAX_LINKS)
+        search_results = self.browse_websites(urls, question)
         logger.debug(f"Search completed for question: {question} saving results...")
-        research_info = '\n\n'.join(result for search_result in search_results for result in search_result)     
-        result = self.generate_report([question], research_info)
+        # the report is streamed as JSON, callers showing its sections have no use for the raw tokens
+        result = self.generate_report(queries, search_results, None if on_field else on_token, on_field)
         result = self.beautify_report(result)
         logger.debug(f"Presenting research information for question: {question}")
-        print(result)
         os.makedirs('./results', exist_ok=True)
         write_to_file(f"./results/{sanitize_filename(question)}.txt", result)
-        self.db.add_text(result)
+        self.stored_index.add_many(self.db.add_text(result))
         return result
        
-    def run_agent(self, question: str):
+    def run_agent(self, question: str, on_token: Optional[Callable[[str], None]] = None,
+                  on_field: Optional[Callable[[PartialField], None]] = None):
+        """Answers the question from the database when it holds relevant documents, by researching the web otherwise.
+        Args:
+            question (str): The research question
+            on_token (Callable[[str], None], optional): Called with each token of the answer or report as it is generated
+            on_field (Callable[[PartialField], None], optional): Called with each section of the report once validated,
+                the report's tokens then no longer go to on_token
+        Returns:
+            str: The answer or the report
+        """
         logger.info(f"Running research agent for question: {question}")
+        self.reset_dedup()
         logger.info(f"Checking database for question: {question}")
-        db_results = self.query_db(question)
-        if db_results:
+        found = self.query_db(question)
+        if found:
             logger.info(f"Database results found for question: {question}")
-            result = self.process_db_results(question, db_results)
+            db_results, db_similarity = found
+            result = self.process_db_results(question, db_results, on_token, db_similarity)
             if result:
-                print(result)
                 return result
-        return self.process_web_search(question)
+        return self.process_web_search(question, on_token, on_field)
+
+    def reset_dedup(self):
+        """Starts new dedup indexes for a research run, seeded with the documents stored in the database."""
+        self.page_index = DedupIndex(name="scraped pages")
+        with self._init_lock:
+            self._chunk_index = None
+
+    def close(self):
+        """Releases the model, browsers and connections held by the agent."""
+        for model in loaded_models():
+            model.close()
+        if self._db is not None:
+            self._db.close()
+        self.browser_pool.close()
+        self.scraper.fetcher.close()
+        logger.info(f"Page cache stats: {self.scraper.cache.stats()}")
+        self.scraper.cache.close()
+        logger.info(f"Database relevance gate stats: {self.relevance_gate.stats()}")
+        self.search_executor.shutdown()
+        logger.info(f"Search cache stats: {self.search_cache.stats()}")
+        self.search_cache.close()
 
     
     
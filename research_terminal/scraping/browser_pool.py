@@ -0,0 +1,216 @@
+import atexit
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Generator, List, Optional
+
+import psutil
+from research_terminal.logger.logger import logger
+
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+POOL_SIZE = 3
+MAX_PAGES_PER_DRIVER = 50
+MAX_DRIVER_RSS_MB = 1024
+ACQUIRE_TIMEOUT = 60
+
+
+def create_driver(browser: str) -> "WebDriver":
+    """Create a new headless webdriver
+
+    Args:
+        browser (str): The browser to drive, either "chrome" or "firefox"
+
+    Returns:
+        WebDriver: The webdriver
+
+    Raises:
+        Exception: If the browser is not supported
+    """
+    # selenium is only imported once a browser is actually needed
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
+    from selenium.webdriver.firefox.options import Options as FirefoxOptions
+    drivers = {
+        "chrome": webdriver.Chrome,
+        "firefox": webdriver.Firefox
+    }
+    if browser not in drivers:
+        logger.error(f"{browser} is not a supported browser")
+        raise Exception(f"{browser} is not a supported browser")
+
+    options = ChromeOptions() if browser == "chrome" else FirefoxOptions()
+    options.add_argument("--headless")
+    options.add_argument("--enable-javascript")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    logger.debug(f"Getting {browser} driver")
+    return drivers[browser](options=options)
+
+
+class PooledDriver:
+    """A webdriver owned by a BrowserPool, along with its usage counters."""
+    def __init__(self, driver: "WebDriver"):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.monotonic()
+
+    def rss_mb(self) -> float:
+        """Get the resident memory of the driver service and the browser processes it spawned
+
+        Returns:
+            float: The resident set size in megabytes, 0 if the processes cannot be inspected
+        """
+        service = getattr(self.driver, "service", None)
+        process = getattr(service, "process", None)
+        if process is None:
+            return 0.0
+        try:
+            root = psutil.Process(process.pid)
+            rss = root.memory_info().rss
+            for child in root.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    continue
+        except psutil.Error:
+            return 0.0
+        return rss / (1024 * 1024)
+
+    def is_alive(self) -> bool:
+        """Check that the browser still answers commands
+
+        Returns:
+            bool: True if the driver is healthy
+        """
+        try:
+            self.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit driver cleanly: {e}")
+
+
+class BrowserPool:
+    """Keeps a fixed number of warm webdrivers and leases them out for each page.
+
+    Drivers are recycled after `max_pages` pages or once the browser's resident memory
+    exceeds `max_rss_mb`. Every driver is health-checked before it is handed out and
+    crashed drivers are replaced transparently.
+    """
+    def __init__(self, browser: str = "firefox", size: int = POOL_SIZE, max_pages: int = MAX_PAGES_PER_DRIVER,
+                 max_rss_mb: float = MAX_DRIVER_RSS_MB, acquire_timeout: float = ACQUIRE_TIMEOUT):
+        """Initializes a browser pool. Drivers are started on first use or by `warm_up`.
+        Args:
+            browser: The browser to drive, either "chrome" or "firefox".
+            size: The maximum number of drivers kept alive at once.
+            max_pages: The number of pages a driver serves before it is recycled.
+            max_rss_mb: The resident memory in megabytes above which a driver is recycled.
+            acquire_timeout: The number of seconds to wait for a free driver."""
+        self.browser = browser
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.acquire_timeout = acquire_timeout
+        self._idle: queue.LifoQueue[PooledDriver] = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._drivers: List[PooledDriver] = []
+        self._closed = False
+        atexit.register(self.close)
+        logger.debug(f"BrowserPool initialized with {size} {browser} drivers")
+
+    def warm_up(self, count: Optional[int] = None):
+        """Start drivers ahead of time so the first pages do not pay browser startup.
+        Args:
+            count: The number of drivers to start, defaults to the pool size."""
+        count = min(count or self.size, self.size)
+        with self._lock:
+            missing = count - len(self._drivers)
+        for _ in range(max(missing, 0)):
+            self._idle.put(self._spawn())
+        logger.info(f"BrowserPool warmed up with {count} drivers")
+
+    @contextmanager
+    def driver(self) -> Generator["WebDriver", None, None]:
+        """Lease a healthy driver for the duration of the block.
+
+        Yields:
+            WebDriver: The leased driver
+
+        Raises:
+            TimeoutError: If no driver becomes available within the acquire timeout
+        """
+        if self._closed:
+            raise RuntimeError("BrowserPool is closed")
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError(f"No browser available after {self.acquire_timeout} seconds")
+        pooled = None
+        try:
+            pooled = self._checkout()
+            yield pooled.driver
+            pooled.pages += 1
+        except Exception:
+            # the page may have left the browser in a bad state, let the health check decide
+            if pooled is not None and not pooled.is_alive():
+                self._retire(pooled, "crashed")
+                pooled = None
+            raise
+        finally:
+            if pooled is not None:
+                self._checkin(pooled)
+            self._slots.release()
+
+    def _checkout(self) -> PooledDriver:
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                return self._spawn()
+            if pooled.is_alive():
+                return pooled
+            self._retire(pooled, "failed health check")
+
+    def _checkin(self, pooled: PooledDriver):
+        if self._closed:
+            self._retire(pooled, "pool closed")
+        elif pooled.pages >= self.max_pages:
+            self._retire(pooled, f"served {pooled.pages} pages")
+        elif self.max_rss_mb and (rss := pooled.rss_mb()) > self.max_rss_mb:
+            self._retire(pooled, f"using {rss:.0f}MB of memory")
+        else:
+            self._idle.put(pooled)
+
+    def _spawn(self) -> PooledDriver:
+        start = time.perf_counter()
+        pooled = PooledDriver(create_driver(self.browser))
+        with self._lock:
+            self._drivers.append(pooled)
+        logger.debug(f"Started {self.browser} driver in {time.perf_counter() - start:.2f}s")
+        return pooled
+
+    def _retire(self, pooled: PooledDriver, reason: str):
+        logger.info(f"Recycling {self.browser} driver: {reason}")
+        with self._lock:
+            if pooled in self._drivers:
+                self._drivers.remove(pooled)
+        pooled.quit()
+
+    def close(self):
+        """Quit every driver owned by the pool."""
+        if self._closed:
+            return
+        self._closed = True
+        with self._lock:
+            drivers, self._drivers = self._drivers, []
+        if drivers:
+            logger.info(f"Closing BrowserPool with {len(drivers)} drivers")
+        for pooled in drivers:
+            pooled.quit()
@@ -0,0 +1,113 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from research_terminal.logger.logger import logger
+
+POOL_SIZE = 10
+TIMEOUT = 10
+MIN_BODY_TEXT_LENGTH = 400
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0"
+
+BODY_PATTERN = re.compile(r"<body\b[^>]*>(.*)</body>", re.IGNORECASE | re.DOTALL)
+INVISIBLE_PATTERN = re.compile(r"<(script|style|noscript|template|svg)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+NOSCRIPT_PATTERN = re.compile(r"<noscript\b[^>]*>(.*?)</noscript\s*>", re.IGNORECASE | re.DOTALL)
+JS_REQUIRED_PATTERN = re.compile(r"(enable|turn on|activate)\s+javascript|javascript\s+(is\s+)?(required|disabled|must be enabled)", re.IGNORECASE)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+@dataclass
+class FetchRecord:
+    """Records how a page was fetched and how long it took."""
+    url: str
+    method: str
+    elapsed: float
+    status: Optional[int] = None
+    reason: Optional[str] = None
+    removed_chars: int = 0
+    removed_tokens: int = 0
+
+
+@dataclass
+class FetchedPage:
+    """The HTML of a page along with the validators needed to revalidate it later."""
+    html: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False
+    record: Optional[FetchRecord] = None
+
+
+class HttpFetcher:
+    """Fetches pages with plain HTTP GETs over a pooled keep-alive session."""
+    def __init__(self, pool_size: int = POOL_SIZE, timeout: float = TIMEOUT, user_agent: str = USER_AGENT):
+        """Initializes the HTTP fetcher.
+        Args:
+            pool_size: The number of keep-alive connections kept per host.
+            timeout: The connect and read timeout in seconds.
+            user_agent: The User-Agent header sent with every request."""
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504]))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "User-Agent": user_agent,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding": "gzip, deflate",
+            "Accept-Language": "en-US,en;q=0.5",
+        })
+        logger.debug(f"HttpFetcher initialized with a pool of {pool_size} connections")
+
+    def fetch(self, url: str, headers: Optional[dict] = None) -> requests.Response:
+        """Fetch a page
+
+        Args:
+            url (str): The url to fetch
+            headers (dict, optional): Extra request headers
+
+        Returns:
+            requests.Response: The response, with its encoding detected when the server does not send one
+
+        Raises:
+            requests.RequestException: If the request fails or returns an error status
+        """
+        logger.debug(f"Fetching {url} over HTTP")
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        if "charset" not in response.headers.get("Content-Type", "").lower():
+            response.encoding = response.apparent_encoding
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+def looks_js_rendered(response: requests.Response, min_text_length: int = MIN_BODY_TEXT_LENGTH) -> Optional[str]:
+    """Check whether a page needs a browser to render its content
+
+    Args:
+        response (requests.Response): The HTTP response of the page
+        min_text_length (int, optional): The visible body text below which the page is considered empty
+
+    Returns:
+        Optional[str]: The reason the page needs a browser, None if the HTML can be used as is
+    """
+    content_type = response.headers.get("Content-Type", "text/html").lower()
+    if "html" not in content_type:
+        return f"unsupported content type {content_type}"
+    html = response.text
+    for noscript in NOSCRIPT_PATTERN.findall(html):
+        if JS_REQUIRED_PATTERN.search(noscript):
+            return "noscript marker"
+    match = BODY_PATTERN.search(html)
+    body = match.group(1) if match else html
+    text = WHITESPACE_PATTERN.sub(" ", TAG_PATTERN.sub(" ", INVISIBLE_PATTERN.sub(" ", body))).strip()
+    if len(text) < min_text_length:
+        return f"nearly empty body ({len(text)} characters)"
+    return None
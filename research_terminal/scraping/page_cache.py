@@ -0,0 +1,212 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from research_terminal.scraping.urls import normalize_url
+from research_terminal.logger.logger import logger
+
+CACHE_DIRECTORY = 'research_terminal/scraping/cache'
+TTL = 24 * 60 * 60
+MAX_BYTES = 512 * 1024 * 1024
+
+
+@dataclass
+class CachedPage:
+    """A page stored in the PageCache."""
+    url: str
+    html: str
+    text: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+    size: int
+
+    def conditional_headers(self) -> dict:
+        """Get the headers to revalidate the page with a conditional request
+
+        Returns:
+            dict: The If-None-Match and If-Modified-Since headers the page has validators for
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """Content-addressed on-disk cache of fetched pages and their extracted text.
+
+    Entries are keyed by normalized url and point at blobs named by the SHA-256 of their
+    content, so identical pages served from different urls are stored once. Entries older
+    than the TTL are revalidated with their ETag/Last-Modified validators and the least
+    recently used entries are evicted once the blobs exceed `max_bytes`.
+    """
+    def __init__(self, directory: str = CACHE_DIRECTORY, ttl: float = TTL, max_bytes: int = MAX_BYTES):
+        """Initializes the page cache.
+        Args:
+            directory: The directory to store the index and the blobs in.
+            ttl: The number of seconds a page is served without revalidation.
+            max_bytes: The size of the stored pages above which entries are evicted."""
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                html_hash TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )""")
+        self._db.commit()
+        logger.debug(f"PageCache initialized in {directory}")
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Get a page from the cache, fresh or not.
+        Args:
+            url(str): The url of the page.
+        Returns:
+            Optional[CachedPage]: The cached page, None if the url is not cached."""
+        key = normalize_url(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT html_hash, text_hash, etag, last_modified, fetched_at, size FROM pages WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            html_hash, text_hash, etag, last_modified, fetched_at, size = row
+            html, text = self._read_blob(html_hash), self._read_blob(text_hash)
+            if html is None or text is None:
+                logger.warning(f"Cached blobs for {key} are missing, dropping the entry")
+                self._db.execute("DELETE FROM pages WHERE url = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), key))
+            self._db.commit()
+        return CachedPage(url, html, text, etag, last_modified, fetched_at, size)
+
+    def is_fresh(self, page: CachedPage) -> bool:
+        return time.time() - page.fetched_at < self.ttl
+
+    def put(self, url: str, html: str, text: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Stores a page and its extracted text.
+        Args:
+            url(str): The url of the page.
+            html(str): The HTML of the page.
+            text(str): The text extracted from the page.
+            etag(str): The ETag the server sent with the page.
+            last_modified(str): The Last-Modified date the server sent with the page."""
+        key = normalize_url(url)
+        now = time.time()
+        with self._lock:
+            html_hash, html_size = self._write_blob(html)
+            text_hash, text_size = self._write_blob(text)
+            previous = self._db.execute("SELECT html_hash, text_hash FROM pages WHERE url = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, html_hash, text_hash, etag, last_modified, now, now, html_size + text_size)
+            )
+            self._db.commit()
+            if previous:
+                self._release_blobs(*previous)
+            self._evict()
+
+    def revalidated(self, page: CachedPage):
+        """Marks a stale page as confirmed unchanged by the server and counts it as a hit.
+        Args:
+            page(CachedPage): The page the server answered 304 Not Modified for."""
+        with self._lock:
+            self._db.execute("UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), normalize_url(page.url)))
+            self._db.commit()
+            self.revalidations += 1
+        self.record_hit(page)
+
+    def record_hit(self, page: CachedPage):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(page.html.encode("utf-8"))
+        logger.debug(f"Page cache hit for {page.url}")
+
+    def record_miss(self, url: str):
+        with self._lock:
+            self.misses += 1
+        logger.debug(f"Page cache miss for {url}")
+
+    def stats(self) -> dict:
+        """Gets the cache counters.
+        Returns:
+            dict: The hits, misses, revalidations and bytes saved since the cache was opened."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "bytes_saved": self.bytes_saved,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def _write_blob(self, content: str) -> tuple[str, int]:
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        return digest, len(data)
+
+    def _read_blob(self, digest: str) -> Optional[str]:
+        try:
+            with open(self._blob_path(digest), "rb") as file:
+                return file.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+
+    def _release_blobs(self, *digests: str):
+        for digest in set(digests):
+            in_use = self._db.execute(
+                "SELECT 1 FROM pages WHERE html_hash = ? OR text_hash = ? LIMIT 1", (digest, digest)
+            ).fetchone()
+            if not in_use:
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT url, html_hash, text_hash, size FROM pages ORDER BY accessed_at").fetchall()
+        for url, html_hash, text_hash, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._release_blobs(html_hash, text_hash)
+            total -= size
+            logger.debug(f"Evicted {url} from the page cache")
+        self._db.commit()
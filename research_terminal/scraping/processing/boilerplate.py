@@ -0,0 +1,199 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+import lxml.html
+from lxml.html import HtmlElement
+from research_terminal.scraping.processing.extract import (TEXT_TAGS, BeautifulSoupExtractor, Extraction, TextExtractor,
+                                                           join_texts, parse_html)
+from research_terminal.scraping.processing.tokens import estimate_tokens
+from research_terminal.scraping.urls import normalize_url, url_host
+from research_terminal.logger.logger import logger
+
+UNLIKELY_TAGS = ('script', 'style', 'noscript', 'template', 'svg', 'iframe', 'form', 'button', 'nav', 'aside', 'footer')
+BLOCK_TAGS = ('div', 'section', 'article', 'main', 'td', 'blockquote', 'pre')
+NEGATIVE_PATTERN = re.compile(
+    r"cookie|consent|gdpr|banner|nav|menu|breadcrumb|sidebar|footer|masthead|related|recommend|share|social|"
+    r"comment|subscribe|newsletter|signup|promo|sponsor|advert|\bads?\b|popup|modal|outbrain|taboola|widget",
+    re.IGNORECASE
+)
+POSITIVE_PATTERN = re.compile(r"article|body|content|entry|main|post|story|text|blog", re.IGNORECASE)
+MIN_PARAGRAPH_LENGTH = 25
+MAX_LINK_DENSITY = 0.5
+SIBLING_SCORE_RATIO = 0.2
+REPEAT_THRESHOLD = 3
+MIN_CONTENT_RATIO = 0.1
+# paragraphs whose page counts are remembered, the least recently seen ones are forgotten first
+MAX_TRACKED_PARAGRAPHS = int(os.getenv("BOILERPLATE_TRACKED_PARAGRAPHS", 20000))
+
+
+class MainContentExtractor(TextExtractor):
+    """Readability-style extractor that keeps the main content block of a page.
+
+    Blocks are scored by the amount of paragraph text they contain, penalised by their link
+    density, and only the best block and its similarly scored siblings are kept. Paragraphs
+    that show up on `repeat_threshold` different pages of the same host during the run are
+    treated as boilerplate of the site (bylines, disclaimers, footers) and dropped as well.
+    Extracting the same url again does not count as another page.
+    """
+    name = "main-content"
+
+    def __init__(self, repeat_threshold: int = REPEAT_THRESHOLD, min_content_ratio: float = MIN_CONTENT_RATIO,
+                 max_tracked_paragraphs: int = MAX_TRACKED_PARAGRAPHS):
+        """Initializes the main content extractor.
+        Args:
+            repeat_threshold: The number of pages of a host a paragraph has to appear on to be dropped as boilerplate.
+            min_content_ratio: The fraction of the page's text below which the extraction is considered
+                a failure and the whole page text is returned instead.
+            max_tracked_paragraphs: The number of paragraphs whose page counts are remembered."""
+        self.repeat_threshold = repeat_threshold
+        self.min_content_ratio = min_content_ratio
+        self.max_tracked_paragraphs = max_tracked_paragraphs
+        # the pages each paragraph was seen on, keyed by host and paragraph
+        self._paragraph_pages: "OrderedDict[Tuple[str, str], Set[str]]" = OrderedDict()
+        self._fallback = BeautifulSoupExtractor()
+        self._lock = threading.Lock()
+
+    def extract(self, html: str) -> str:
+        return self.extract_with_report(html).text
+
+    def extract_with_report(self, html: str, url: Optional[str] = None) -> Extraction:
+        if not html.strip():
+            return Extraction("")
+        root = parse_html(html, lxml.html.document_fromstring)
+        if root is None:
+            return Extraction(self._fallback.extract(html))
+        full_texts = [element.text_content() for element in root.iter(*TEXT_TAGS)]
+        full_text = join_texts(full_texts)
+
+        title = next(root.iter('h1'), None)
+        self.remove_unlikely(root)
+        scores = self.score_blocks(root)
+        blocks = self.content_blocks(scores) if scores else [root]
+        elements = [element for block in blocks for element in block.iter(*TEXT_TAGS)]
+        if title is not None and title not in elements:
+            elements.insert(0, title)
+        texts = unique_paragraphs([
+            element.text_content() for element in elements if link_density(element) <= MAX_LINK_DENSITY
+        ])
+        main_text = join_texts(texts)
+        # without a url, a page is told apart from the others by its HTML
+        page = normalize_url(url) if url else hashlib.sha1(html.encode("utf-8")).hexdigest()
+        text = join_texts(self.drop_repeated(texts, page, url_host(url) if url else ""))
+        min_length = len(full_text.strip()) * self.min_content_ratio
+        if len(main_text.strip()) < min_length:
+            logger.debug("Main content extraction kept too little text, using the whole page")
+            text = full_text
+        elif len(text.strip()) < min_length:
+            logger.debug("Dropping the paragraphs repeated across the site kept too little text, keeping them")
+            text = main_text
+        return Extraction(text, len(full_text) - len(text), estimate_tokens(full_text) - estimate_tokens(text))
+
+    def remove_unlikely(self, root: HtmlElement):
+        """Removes the elements that cannot be part of the main content, keeping their tail text."""
+        for element in list(root.iter(*UNLIKELY_TAGS)):
+            if element.getparent() is not None:
+                element.drop_tree()
+        for element in list(root.iter(*BLOCK_TAGS, 'ul', 'ol', 'header', 'span', 'p')):
+            if element.getparent() is None or element.tag in ('html', 'body'):
+                continue
+            attributes = f"{element.get('class', '')} {element.get('id', '')} {element.get('role', '')}"
+            if NEGATIVE_PATTERN.search(attributes) and not POSITIVE_PATTERN.search(attributes):
+                element.drop_tree()
+
+    def score_blocks(self, root: HtmlElement) -> Dict[HtmlElement, float]:
+        """Scores the parents and grandparents of paragraphs by their text, weighted against their links.
+
+        Returns:
+            Dict[HtmlElement, float]: The score of every block holding paragraphs, empty if there are none
+        """
+        scores: Dict[HtmlElement, float] = {}
+        for paragraph in root.iter('p', 'pre', 'td'):
+            text = paragraph.text_content().strip()
+            if len(text) < MIN_PARAGRAPH_LENGTH:
+                continue
+            score = 1 + text.count(',') + min(len(text) / 100, 3)
+            parent = paragraph.getparent()
+            if parent is None:
+                continue
+            scores[parent] = scores.get(parent, 0) + score
+            grandparent = parent.getparent()
+            if grandparent is not None:
+                scores[grandparent] = scores.get(grandparent, 0) + score / 2
+        for element in scores:
+            scores[element] *= 1 - link_density(element)
+        return scores
+
+    def content_blocks(self, scores: Dict[HtmlElement, float]) -> List[HtmlElement]:
+        """Gets the best scored block along with the siblings that score close to it, in document order."""
+        candidate = max(scores, key=scores.get)
+        parent = candidate.getparent()
+        if parent is None:
+            return [candidate]
+        threshold = max(10, scores[candidate] * SIBLING_SCORE_RATIO)
+        blocks = []
+        for sibling in parent:
+            if sibling is candidate or scores.get(sibling, 0) >= threshold:
+                blocks.append(sibling)
+            elif sibling.tag == 'p':
+                text = sibling.text_content().strip()
+                if len(text) > 80 and link_density(sibling) < 0.25:
+                    blocks.append(sibling)
+        return blocks
+
+    def drop_repeated(self, texts: List[str], page: str, host: str = "") -> List[str]:
+        """Drops the paragraphs seen on too many other pages of the host during the run.
+        Args:
+            texts (List[str]): The paragraphs of the page, without duplicates
+            page (str): The identity of the page, its normalized url
+            host (str): The host of the page
+        Returns:
+            List[str]: The paragraphs kept"""
+        kept = []
+        with self._lock:
+            for text in texts:
+                key = (host, paragraph_key(text))
+                pages = self._paragraph_pages.pop(key, set())
+                pages.add(page)
+                # moved to the end, the least recently seen paragraphs are forgotten first
+                self._paragraph_pages[key] = pages
+                if len(pages) < self.repeat_threshold:
+                    kept.append(text)
+            while len(self._paragraph_pages) > self.max_tracked_paragraphs:
+                self._paragraph_pages.popitem(last=False)
+        return kept
+
+
+def paragraph_key(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def unique_paragraphs(texts: List[str]) -> List[str]:
+    """Drops the empty paragraphs and the ones repeated within a page, keeping the first of each."""
+    seen = set()
+    unique = []
+    for text in texts:
+        key = paragraph_key(text)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(text)
+    return unique
+
+
+def link_density(element: HtmlElement) -> float:
+    """Get the share of an element's text that sits inside links
+
+    Args:
+        element (HtmlElement): The element to measure
+
+    Returns:
+        float: The link text length divided by the text length
+    """
+    text_length = len(element.text_content())
+    if not text_length:
+        return 0.0
+    link_length = sum(len(link.text_content()) for link in element.iter('a'))
+    return min(link_length / text_length, 1.0)
@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, List, Sequence, Tuple
+
+from research_terminal.logger.logger import logger
+
+WORD_PATTERN = re.compile(r"[a-z0-9]{3,}")
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+SOURCE_PATTERN = re.compile(r"Source:\s*(\S+)")
+# the first lines of a block name its source, they are kept when the block is compressed
+HEADER_LINES = 3
+# a block compressed below this many tokens is not worth keeping
+MIN_BLOCK_TOKENS = 64
+BLOCK_SEPARATOR = "\n\n"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def words(text: str) -> List[str]:
+    return WORD_PATTERN.findall(text.lower())
+
+
+def relevance_scores(query: str, texts: Sequence[str]) -> List[float]:
+    """Score texts against a query with BM25, the texts being the corpus
+
+    Args:
+        query (str): The query, such as the question along with the search queries
+        texts (Sequence[str]): The texts to score
+
+    Returns:
+        List[float]: The score of each text, higher is more relevant
+    """
+    documents = [Counter(words(text)) for text in texts]
+    if not documents:
+        return []
+    average_length = sum(sum(document.values()) for document in documents) / len(documents) or 1
+    terms = set(words(query))
+    frequencies = {term: sum(1 for document in documents if term in document) for term in terms}
+    scores = []
+    for document in documents:
+        length = sum(document.values())
+        score = 0.0
+        for term in terms:
+            count = document.get(term, 0)
+            if not count:
+                continue
+            idf = math.log(1 + (len(documents) - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+            score += idf * count * (BM25_K1 + 1) / (count + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+        scores.append(score)
+    return scores
+
+
+@dataclass
+class PackedBlock:
+    """What the packer did with one block of context."""
+    label: str
+    score: float
+    tokens: int
+    kept_tokens: int
+    text: str
+
+    @property
+    def action(self) -> str:
+        if self.kept_tokens == self.tokens:
+            return "kept"
+        return "compressed" if self.kept_tokens else "dropped"
+
+
+class ContextPacker:
+    """Fits blocks of context, such as article summaries, into a token budget.
+
+    Blocks are ranked by relevance to the query and placed in that order. A block is kept whole
+    if it fits; otherwise it is compressed to its most relevant sentences within an even share
+    of the tokens left, or dropped if too little of it would remain. The blocks keep their
+    original order in the packed text.
+    """
+    def __init__(self, count_tokens: Callable[[str], int], min_block_tokens: int = MIN_BLOCK_TOKENS):
+        """Initializes the packer.
+        Args:
+            count_tokens: The function measuring the tokens of a text.
+            min_block_tokens: The smallest compressed block worth keeping."""
+        self.count_tokens = count_tokens
+        self.min_block_tokens = min_block_tokens
+
+    def _joined_tokens(self, texts: Sequence[str]) -> int:
+        return sum(self.count_tokens(text) for text in texts) + self.count_tokens(BLOCK_SEPARATOR) * max(len(texts) - 1, 0)
+
+    def compress(self, text: str, query: str, budget: int) -> str:
+        """Keep the header and the sentences of a block most relevant to the query that fit the budget.
+        Args:
+            text (str): The block
+            query (str): The query the sentences are ranked against
+            budget (int): The number of tokens the compressed block may use
+        Returns:
+            str: The compressed block, empty if not even its header fits
+        """
+        lines = text.strip().split("\n")
+        header = "\n".join(lines[:HEADER_LINES])
+        sentences = [sentence.strip() for sentence in SENTENCE_PATTERN.split("\n".join(lines[HEADER_LINES:])) if sentence.strip()]
+        used = self.count_tokens(header)
+        if used > budget:
+            return ""
+        kept = set()
+        scores = relevance_scores(query, sentences)
+        for index in sorted(range(len(sentences)), key=lambda index: scores[index], reverse=True):
+            sentence_tokens = self.count_tokens(sentences[index]) + 1
+            if used + sentence_tokens <= budget:
+                kept.add(index)
+                used += sentence_tokens
+        return "\n".join([header] + [sentences[index] for index in sorted(kept)])
+
+    def pack(self, blocks: Sequence[str], query: str, budget: int) -> Tuple[str, List[PackedBlock]]:
+        """Pack the blocks into the budget.
+        Args:
+            blocks (Sequence[str]): The blocks of context
+            query (str): The text the blocks are ranked against
+            budget (int): The number of tokens the packed text may use
+        Returns:
+            Tuple[str, List[PackedBlock]]: The packed text, and what was done with each block
+        """
+        scores = relevance_scores(query, blocks)
+        packed = []
+        for block, score in zip(blocks, scores):
+            source = SOURCE_PATTERN.search(block)
+            label = source.group(1) if source else block.strip()[:60]
+            tokens = self.count_tokens(block)
+            packed.append(PackedBlock(label, score, tokens, tokens, block))
+        if self._joined_tokens(blocks) > budget:
+            separator_tokens = self.count_tokens(BLOCK_SEPARATOR)
+            remaining = budget
+            ranked = sorted(packed, key=lambda block: block.score, reverse=True)
+            for position, block in enumerate(ranked):
+                if block.tokens + separator_tokens <= remaining:
+                    remaining -= block.tokens + separator_tokens
+                    continue
+                # a block that does not fit gets an even share of what is left, so it cannot crowd out the next ones
+                share = max(remaining // (len(ranked) - position), self.min_block_tokens)
+                compressed = self.compress(block.text, query, min(share, remaining) - separator_tokens)
+                block.kept_tokens = self.count_tokens(compressed)
+                block.text = compressed
+                if block.kept_tokens < self.min_block_tokens:
+                    block.kept_tokens, block.text = 0, ""
+                remaining -= block.kept_tokens + separator_tokens if block.kept_tokens else 0
+        for block in packed:
+            if block.action != "kept":
+                logger.info(f"Context packer {block.action} {block.label} (relevance {block.score:.2f}): "
+                            f"{block.tokens} -> {block.kept_tokens} tokens")
+        text = BLOCK_SEPARATOR.join(block.text for block in packed if block.text)
+        logger.info(f"Packed {sum(1 for block in packed if block.text)} of {len(packed)} blocks into "
+                    f"{self._joined_tokens([block.text for block in packed if block.text])} of {budget} tokens")
+        return text, packed
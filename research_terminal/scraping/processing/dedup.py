@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from research_terminal.logger.logger import logger
+
+NUM_PERM = 128
+SHINGLE_SIZE = 5
+THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", 0.8))
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """Split a text into overlapping word shingles
+
+    Args:
+        text (str): The text to split
+        size (int, optional): The number of words per shingle
+
+    Returns:
+        set: The distinct shingles of the text, empty if the text has no words
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Computes MinHash signatures of texts over their word shingles."""
+    def __init__(self, num_perm: int = NUM_PERM, shingle_size: int = SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        # a * hash stays below 2**63 so the permutations never overflow uint64
+        self._a = generator.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Compute the MinHash signature of a text
+
+        Args:
+            text (str): The text to sign
+
+        Returns:
+            Optional[np.ndarray]: The signature, None if the text has no words
+        """
+        text_shingles = shingles(text, self.shingle_size)
+        if not text_shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in text_shingles),
+                             dtype=np.uint64, count=len(text_shingles))
+        permuted = (np.outer(hashes, self._a) + self._b) % np.uint64(MERSENNE_PRIME) & np.uint64(MAX_HASH)
+        return permuted.min(axis=0)
+
+
+def lsh_parameters(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """Pick the number of LSH bands and rows per band whose S-curve rises just below the threshold.
+
+    Erring below the threshold keeps false negatives rare, candidates are verified against
+    the full signature anyway.
+
+    Args:
+        threshold (float): The Jaccard similarity to detect
+        num_perm (int): The length of the signatures
+
+    Returns:
+        Tuple[int, int]: The number of bands and the number of rows per band
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+class DedupIndex:
+    """Locality-sensitive hashing index of MinHash signatures for near-duplicate detection."""
+    def __init__(self, threshold: float = THRESHOLD, num_perm: int = NUM_PERM, shingle_size: int = SHINGLE_SIZE, name: str = "texts"):
+        """Initializes the dedup index.
+        Args:
+            threshold: The estimated Jaccard similarity above which two texts are duplicates.
+            num_perm: The number of hash permutations in each signature.
+            shingle_size: The number of words per shingle.
+            name: The name used in the logs."""
+        self.threshold = threshold
+        self.name = name
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def query(self, text: str) -> Optional[Tuple[str, float]]:
+        """Find an indexed text that is a near-duplicate of the given one.
+        Args:
+            text(str): The text to look up.
+        Returns:
+            Optional[Tuple[str, float]]: The key of the duplicate and the estimated similarity, None if there is none."""
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            return self._query(signature)
+
+    def _query(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        best = None
+        candidates = {key for band, band_key in enumerate(self._band_keys(signature))
+                      for key in self._buckets[band].get(band_key, ())}
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def add(self, key: str, text: str):
+        """Adds a text to the index.
+        Args:
+            key(str): The key to report when the text is matched.
+            text(str): The text to index."""
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return
+        with self._lock:
+            self._add(key, signature)
+
+    def _add(self, key: str, signature: np.ndarray):
+        self._signatures[key] = signature
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def add_many(self, items: Iterable[Tuple[str, str]]):
+        """Adds (key, text) pairs to the index."""
+        for key, text in items:
+            self.add(key, text)
+
+    def check(self, key: str, text: str) -> Optional[Tuple[str, float]]:
+        """Checks a text against the index and adds it if it is new.
+        Args:
+            key(str): The key of the text.
+            text(str): The text to check.
+        Returns:
+            Optional[Tuple[str, float]]: The key of the duplicate and the estimated similarity, None if the text is new."""
+        signature = self.hasher.signature(text)
+        if signature is None:
+            return None
+        with self._lock:
+            duplicate = self._query(signature)
+            if duplicate is None:
+                self._add(key, signature)
+                return None
+            self.hits += 1
+        logger.info(f"Skipping {key}: near-duplicate of {duplicate[0]} in {self.name} (similarity {duplicate[1]:.2f})")
+        return duplicate
+
+    def copy(self) -> "DedupIndex":
+        """Copies the index, so that texts added to the copy do not show up in the original."""
+        index = DedupIndex.__new__(DedupIndex)
+        index.__dict__.update(self.__dict__)
+        with self._lock:
+            index._buckets = [{band_key: list(keys) for band_key, keys in buckets.items()} for buckets in self._buckets]
+            index._signatures = dict(self._signatures)
+        index._lock = threading.Lock()
+        index.hits = 0
+        return index
+
+    def __len__(self) -> int:
+        return len(self._signatures)
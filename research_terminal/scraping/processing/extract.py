@@ -0,0 +1,179 @@
+import re
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Type
+
+from bs4 import BeautifulSoup
+from research_terminal.logger.logger import logger
+
+TEXT_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'p')
+# elements whose content is not text of the page, even when nested in a text element, dropped by every engine
+NON_TEXT_TAGS = ('script', 'style', 'noscript', 'template')
+# lxml refuses str input carrying an encoding declaration, as XHTML pages do
+XML_DECLARATION = re.compile(r"^\s*<\?xml[^>]*\?>")
+SEPARATOR = "\n\n"
+
+
+@dataclass
+class Extraction:
+    """The text extracted from a page and how much of the page's text was discarded."""
+    text: str
+    removed_chars: int = 0
+    removed_tokens: int = 0
+
+
+class TextExtractor(ABC):
+    """Extracts the heading and paragraph text of an HTML page."""
+    name: str = ""
+
+    @abstractmethod
+    def extract(self, html: str) -> str:
+        """Extract the text of the h1-h5 and p elements, in document order
+
+        Args:
+            html (str): The HTML to extract the text from
+
+        Returns:
+            str: The text of each element followed by a blank line
+        """
+        pass
+
+    def extract_with_report(self, html: str, url: Optional[str] = None) -> Extraction:
+        """Extract the text of a page along with how much text was left out
+
+        Args:
+            html (str): The HTML to extract the text from
+            url (str, optional): The url of the page, for extractors that learn from the pages of a site
+
+        Returns:
+            Extraction: The extracted text and the removed characters and tokens
+        """
+        return Extraction(self.extract(html))
+
+
+class BeautifulSoupExtractor(TextExtractor):
+    name = "html.parser"
+
+    def extract(self, html: str) -> str:
+        soup = BeautifulSoup(html, 'html.parser')
+        for element in soup.find_all(NON_TEXT_TAGS):
+            element.decompose()
+        return join_texts(element.text for element in soup.find_all(TEXT_TAGS))
+
+
+class LxmlExtractor(TextExtractor):
+    name = "lxml"
+
+    def __init__(self):
+        import lxml.html
+        self._parse = lxml.html.document_fromstring
+        self._fallback = BeautifulSoupExtractor()
+
+    def extract(self, html: str) -> str:
+        if not html.strip():
+            return ""
+        root = parse_html(html, self._parse)
+        if root is None:
+            return self._fallback.extract(html)
+        return join_texts(element.text_content() for element in root.iter(*TEXT_TAGS))
+
+
+class SelectolaxExtractor(TextExtractor):
+    name = "selectolax"
+
+    def __init__(self):
+        from selectolax.parser import HTMLParser
+        self._parser = HTMLParser
+        self._selector = ", ".join(TEXT_TAGS)
+
+    def extract(self, html: str) -> str:
+        tree = self._parser(html)
+        tree.strip_tags(list(NON_TEXT_TAGS))
+        return join_texts(node.text(deep=True) for node in tree.css(self._selector))
+
+
+EXTRACTORS: Dict[str, Type[TextExtractor]] = {
+    SelectolaxExtractor.name: SelectolaxExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+    BeautifulSoupExtractor.name: BeautifulSoupExtractor,
+}
+
+
+def parse_html(html: str, document_fromstring: Callable):
+    """Parse a page with lxml, without the elements that hold no page text
+
+    Args:
+        html (str): The HTML to parse
+        document_fromstring (Callable): lxml.html.document_fromstring, lxml being imported by the caller
+
+    Returns:
+        Optional[HtmlElement]: The document root, None if lxml cannot parse the page, such as one without any element
+    """
+    from lxml.etree import ParserError
+    try:
+        root = document_fromstring(XML_DECLARATION.sub("", html, count=1))
+    except (ParserError, ValueError) as e:
+        logger.debug(f"lxml could not parse the page, falling back to html.parser: {e}")
+        return None
+    for element in list(root.iter(*NON_TEXT_TAGS)):
+        if element.getparent() is not None:
+            element.drop_tree()
+    return root
+
+
+def join_texts(texts) -> str:
+    """Join element texts into the extractor output without quadratic string concatenation
+
+    Args:
+        texts (Iterable[str]): The text of each element
+
+    Returns:
+        str: The texts, each followed by a blank line
+    """
+    parts = []
+    for text in texts:
+        parts.append(text)
+        parts.append(SEPARATOR)
+    return "".join(parts)
+
+
+def available_extractors() -> Dict[str, TextExtractor]:
+    """Instantiate every extractor whose parser is installed
+
+    Returns:
+        Dict[str, TextExtractor]: The extractors by name, fastest first
+    """
+    extractors = {}
+    for name, extractor_class in EXTRACTORS.items():
+        try:
+            extractors[name] = extractor_class()
+        except ImportError:
+            continue
+    return extractors
+
+
+def get_extractor(name: Optional[str] = None) -> TextExtractor:
+    """Get a text extractor
+
+    Args:
+        name (str, optional): The extractor to use. Defaults to the fastest installed one.
+
+    Returns:
+        TextExtractor: The extractor
+
+    Raises:
+        ValueError: If the extractor is unknown
+        ImportError: If the parser of the requested extractor is not installed
+    """
+    if name is not None:
+        if name not in EXTRACTORS:
+            raise ValueError(f"{name} is not a supported text extractor, choose from {list(EXTRACTORS)}")
+        return EXTRACTORS[name]()
+    for extractor_class in EXTRACTORS.values():
+        try:
+            extractor = extractor_class()
+        except ImportError:
+            continue
+        logger.debug(f"Using the {extractor.name} text extractor")
+        return extractor
+    return BeautifulSoupExtractor()
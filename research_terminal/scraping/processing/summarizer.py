@@ -0,0 +1,222 @@
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from research_terminal.llm.base_llm_model import BaseLLMModel
+from research_terminal.llm.grammar.pydantic_models import Relevant, Summary
+from research_terminal.llm.prompts import summarize_text_prompt
+from research_terminal.scraping.processing.tokens import input_token_budget
+from research_terminal.logger.logger import logger
+
+FAN_IN = 4
+SECTION_SEPARATOR = "\nsection\n"
+# irrelevant summaries of a text's first chunks after which the rest of it is not summarized, 0 to summarize every chunk
+IRRELEVANT_STREAK = int(os.getenv("SUMMARY_IRRELEVANT_STREAK", 2))
+SAMPLING = dict(temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17)
+
+
+@dataclass
+class LevelStats:
+    """The work done at one level of the reduction tree, level 0 being the map phase."""
+    level: int
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    elapsed: float = 0.0
+
+
+class MapReduceSummarizer:
+    """Summarizes a text chunk by chunk and reduces the chunk summaries with a bounded tree.
+
+    The map phase consumes the chunks lazily. As soon as `fan_in` summaries of one level are
+    available, or the next one would overflow the context window, they are reduced into a
+    single summary of the next level. The reduction therefore runs while the map phase is
+    still going, every call fits the context window, and the number of levels grows with
+    the logarithm of the number of chunks.
+
+    Chunks the model finds irrelevant to the question are left out of the reduction. The first
+    `irrelevant_streak` chunks are summarized on their own, and when every one of them is
+    irrelevant the remaining chunks are not summarized at all.
+    """
+    def __init__(self, llm: BaseLLMModel, question: str, system_prompt: str, grammar: Any, max_output_tokens: int,
+                 fan_in: int = FAN_IN, irrelevant_streak: int = IRRELEVANT_STREAK):
+        """Initializes the summarizer.
+        Args:
+            llm: The model to summarize with, it must expose n_ctx and token_counter.
+            question: The question to summarize the text with respect to.
+            system_prompt: The system prompt of every summary call.
+            grammar: The grammar constraining the output to a Summary.
+            max_output_tokens: The number of tokens reserved for each summary.
+            fan_in: The maximum number of summaries reduced into one.
+            irrelevant_streak: The number of first chunks that end the map phase when all are irrelevant, 0 to never end it early."""
+        if fan_in < 2:
+            raise ValueError("fan_in must be at least 2")
+        self.llm = llm
+        self.question = question
+        self.system_prompt = system_prompt
+        self.grammar = grammar
+        self.max_output_tokens = max_output_tokens
+        self.fan_in = fan_in
+        self.irrelevant_streak = irrelevant_streak
+        self.irrelevant_chunks = 0
+        self.aborted = False
+        self.count_tokens = llm.token_counter
+        self.input_budget = input_token_budget(llm.n_ctx, max_output_tokens, system_prompt,
+                                               summarize_text_prompt(question, ""), counter=self.count_tokens)
+        self.stats: Dict[int, LevelStats] = {}
+        self.chunk_summaries: List[Summary] = []
+        self._levels: List[List[str]] = []
+
+    def summarize(self, chunks: Iterable[str], target_tokens: Optional[int] = None) -> str:
+        """Summarizes the chunks and reduces their summaries until they fit the target.
+
+        The chunk summaries are requested through the model's map_chat_completions, so a model
+        serving several calls at once summarizes the next chunks while earlier ones are reduced.
+        Args:
+            chunks (Iterable[str]): The chunks to summarize, consumed lazily
+            target_tokens (int, optional): The size the combined summary has to fit, defaults to one summary call's input budget
+        Returns:
+            str: The combined summary, its sections separated by SECTION_SEPARATOR, empty if no chunk was summarized as relevant
+        """
+        target_tokens = target_tokens or self.input_budget
+        map_stats = self._level_stats(0)
+        start = time.perf_counter()
+        reduce_elapsed = self._reduce_elapsed()
+        chunks = iter(chunks)
+        # the opening chunks are mapped on their own, so no call is sent for the rest before their verdicts are in
+        opening = list(itertools.islice(chunks, self.irrelevant_streak))
+        irrelevant = self._map(map_stats, opening)
+        if self.irrelevant_streak and irrelevant == self.irrelevant_streak:
+            logger.info(f"The first {irrelevant} chunks were irrelevant, summarizing no further")
+            self.aborted = True
+        else:
+            self._map(map_stats, chunks)
+        # reductions run interleaved with the map phase, their time is accounted to their own level
+        map_stats.elapsed += time.perf_counter() - start - (self._reduce_elapsed() - reduce_elapsed)
+        sections = self._finish(target_tokens)
+        self.log_stats()
+        return SECTION_SEPARATOR.join(sections)
+
+    def _map(self, stats: LevelStats, chunks: Iterable[str]) -> int:
+        """Summarizes the chunks and pushes the relevant summaries into the reduction, returning the irrelevant count."""
+        irrelevant = 0
+        responses = self.llm.map_chat_completions(self._map_requests(chunks), **self._call_options())
+        try:
+            for response in responses:
+                summary = self._record(stats, response)
+                if summary is None:
+                    continue
+                self.chunk_summaries.append(summary)
+                if summary.relevance == Relevant.NO:
+                    irrelevant += 1
+                    continue
+                self._push(1, summary.summary)
+        finally:
+            # drops the calls still queued when the summarization fails
+            responses.close()
+        self.irrelevant_chunks += irrelevant
+        return irrelevant
+
+    def _level_stats(self, level: int) -> LevelStats:
+        return self.stats.setdefault(level, LevelStats(level))
+
+    def _reduce_elapsed(self) -> float:
+        return sum(stats.elapsed for stats in self.stats.values() if stats.level)
+
+    def _call_options(self) -> Dict[str, Any]:
+        return dict(system_prompt=self.system_prompt, grammar=self.grammar, max_tokens=self.max_output_tokens,
+                    validate=Summary.model_validate_json, **SAMPLING)
+
+    def _prompt(self, stats: LevelStats, text: str) -> str:
+        prompt = summarize_text_prompt(self.question, text)
+        stats.input_tokens += self.count_tokens(self.system_prompt) + self.count_tokens(prompt)
+        return prompt
+
+    def _map_requests(self, chunks: Iterable[str]) -> Iterator[Dict[str, str]]:
+        stats = self._level_stats(0)
+        for chunk in chunks:
+            yield dict(user_prompt=self._prompt(stats, chunk))
+
+    def _record(self, stats: LevelStats, response: str) -> Optional[Summary]:
+        stats.calls += 1
+        stats.output_tokens += self.count_tokens(response)
+        try:
+            return Summary(**json.loads(response))
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            logger.error(f"Failed to decode the level {stats.level} summary, skipping it: {e}")
+            return None
+
+    def summarize_chunk(self, text: str, level: int) -> Optional[Summary]:
+        """Runs one summary call and records its tokens and timing at the given level."""
+        stats = self._level_stats(level)
+        prompt = self._prompt(stats, text)
+        start = time.perf_counter()
+        response = self.llm.chat_completion(user_prompt=prompt, **self._call_options())
+        stats.elapsed += time.perf_counter() - start
+        return self._record(stats, response)
+
+    def _joined_tokens(self, sections: List[str]) -> int:
+        return sum(self.count_tokens(section) for section in sections) + len(sections) * 3
+
+    def _push(self, level: int, summary: str):
+        while len(self._levels) <= level:
+            self._levels.append([])
+        buffer = self._levels[level]
+        if buffer and self._joined_tokens(buffer + [summary]) > self.input_budget:
+            self._reduce(level)
+            buffer = self._levels[level]
+        buffer.append(summary)
+        if len(buffer) >= self.fan_in:
+            self._reduce(level)
+
+    def _reduce(self, level: int):
+        """Reduces the summaries buffered at a level into one summary of the next level."""
+        buffer, self._levels[level] = self._levels[level], []
+        if len(buffer) == 1:
+            self._push(level + 1, buffer[0])
+            return
+        logger.info(f"Reducing {len(buffer)} summaries at level {level}")
+        summary = self.summarize_chunk(SECTION_SEPARATOR.join(buffer), level)
+        if summary is None:
+            # keep the inputs rather than losing them, they are reduced again further up
+            for section in buffer:
+                self._push(level + 1, section)
+            return
+        self._push(level + 1, summary.summary)
+
+    def _finish(self, target_tokens: int) -> List[str]:
+        """Flushes the tree from the top down and reduces what is left until it fits the target."""
+        # higher levels summarize earlier chunks, so reading top down keeps the document order
+        sections = [section for buffer in reversed(self._levels) for section in buffer]
+        self._levels = []
+        level = max(len(self.stats), 1)
+        while len(sections) > 1 and self._joined_tokens(sections) > target_tokens:
+            reduced = []
+            group: List[str] = []
+            for section in sections + [None]:
+                if section is not None and len(group) < self.fan_in and self._joined_tokens(group + [section]) <= self.input_budget:
+                    group.append(section)
+                    continue
+                if len(group) > 1:
+                    summary = self.summarize_chunk(SECTION_SEPARATOR.join(group), level)
+                    reduced.extend([summary.summary] if summary else group)
+                else:
+                    reduced.extend(group)
+                group = [section] if section is not None else []
+            if len(reduced) >= len(sections):
+                logger.warning("Summaries could not be reduced further, truncating them to the target")
+                break
+            sections = reduced
+            level += 1
+        while sections and self._joined_tokens(sections) > target_tokens:
+            sections.pop()
+        return sections
+
+    def log_stats(self):
+        for stats in sorted(self.stats.values(), key=lambda stats: stats.level):
+            phase = "map" if stats.level == 0 else f"reduce level {stats.level}"
+            logger.info(f"Summarizer {phase}: {stats.calls} calls, {stats.input_tokens} input tokens, "
+                        f"{stats.output_tokens} output tokens, {stats.elapsed:.1f}s")
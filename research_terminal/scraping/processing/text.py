@@ -1,14 +1,23 @@
-from typing import Generator, Optional
-from selenium.webdriver.remote.webdriver import WebDriver 
-from research_terminal.llm.llama_model import LlamaModel
+import re
+from typing import TYPE_CHECKING, Callable, Generator, List, Optional
+from research_terminal.llm.backends import get_llm_model
 from research_terminal.llm.grammar.pydantic_models import Summary, ArticleSummary
-from research_terminal.llm.grammar.pydantic_models_to_grammar import generate_gbnf_grammar_and_documentation
-from research_terminal.llm.prompts import summarize_text_prompt, final_summary_prompt
-from llama_cpp.llama_grammar import LlamaGrammar
+from research_terminal.llm.grammar.grammar_cache import get_grammar_text_and_documentation
+from research_terminal.llm.prompts import final_summary_prompt
+from research_terminal.scraping.processing.dedup import DedupIndex
+from research_terminal.scraping.processing.summarizer import FAN_IN, MapReduceSummarizer
+from research_terminal.scraping.processing.tokens import input_token_budget
 import json
 import os
 from research_terminal.logger.logger import logger
 
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+SUMMARY_MAX_TOKENS = 1024
+FINAL_SUMMARY_MAX_TOKENS = 1536
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
 
 def split_text(text: str, max_length: int = 8000) -> Generator[str, None, None]:
     """Split text into chunks of a maximum length
@@ -42,20 +51,88 @@ def split_text(text: str, max_length: int = 8000) -> Generator[str, None, None]:
         yield "\n".join(current_chunk)
 
 
-def summarize_text(question: str, text: str, max_length: int = 8000, driver: Optional[WebDriver] = None) -> ArticleSummary:
+def split_text_by_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> Generator[str, None, None]:
+    """Split text into chunks that each fit a token budget
+
+    Paragraphs are packed into chunks as long as they fit. Paragraphs that are too long on
+    their own are split at sentence boundaries, and sentences that are still too long are
+    split by words.
+
+    Args:
+        text (str): The text to split
+        max_tokens (int): The maximum number of tokens in each chunk
+        count_tokens (Callable[[str], int]): The function measuring the tokens of a text
+
+    Yields:
+        str: The next chunk of text
+    """
+    logger.info(f"Splitting text into chunks of {max_tokens} tokens")
+    current_tokens = 0
+    current_chunk: List[str] = []
+    chunk_count = 0
+    for paragraph in text.split("\n"):
+        for piece in _fit_pieces(paragraph, max_tokens, count_tokens):
+            # the newline joining the pieces costs about one token
+            piece_tokens = count_tokens(piece) + 1
+            if current_chunk and current_tokens + piece_tokens > max_tokens:
+                chunk_count += 1
+                yield "\n".join(current_chunk)
+                current_chunk, current_tokens = [], 0
+            current_chunk.append(piece)
+            current_tokens += piece_tokens
+    if any(piece.strip() for piece in current_chunk):
+        chunk_count += 1
+        yield "\n".join(current_chunk)
+    logger.info(f"Text split into {chunk_count} chunks")
+
+
+def _fit_pieces(paragraph: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    if count_tokens(paragraph) < max_tokens:
+        return [paragraph]
+    pieces: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    units = SENTENCE_PATTERN.split(paragraph)
+    if len(units) == 1:
+        units = paragraph.split(" ")
+    for unit in units:
+        unit_tokens = count_tokens(unit) + 1
+        if unit_tokens >= max_tokens:
+            # a single sentence longer than the budget, cut it by words
+            if current:
+                pieces.append(" ".join(current))
+                current, current_tokens = [], 0
+            if " " in unit.strip():
+                pieces.extend(_fit_pieces(unit, max_tokens, count_tokens))
+            else:
+                step = max(len(unit) * (max_tokens - 1) // unit_tokens, 1)
+                pieces.extend(unit[i:i + step] for i in range(0, len(unit), step))
+            continue
+        if current and current_tokens + unit_tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def summarize_text(question: str, text: str, fan_in: int = FAN_IN, driver: Optional["WebDriver"] = None,
+                   dedup: Optional[DedupIndex] = None, source: str = "text") -> Optional[ArticleSummary]:
     """Summarizes the text with respect to the question.
     Args:
         question (str): The question to summarize the text with respect to
         text (str): The text to summarize
+        fan_in (int, optional): The number of chunk summaries reduced into one when they do not fit the final prompt
+        dedup (DedupIndex, optional): Index of the chunks already processed, near-duplicate chunks are skipped
+        source (str, optional): The name of the text, used to key its chunks in the dedup index
     Returns:
-        Summary: The summary of the text with respect to the question
+        ArticleSummary: The summary of the text with respect to the question, None if no chunk could be summarized
+            or the final summary could not be parsed
     """
-    summaries = []
-    chunks = list(split_text(text, max_length))
-    scroll_ratio = 1/len(chunks)
-    llm = LlamaModel()
-    gbnf_grammar, documentation = generate_gbnf_grammar_and_documentation([Summary])
-    gbnf_grammar = LlamaGrammar.from_string(gbnf_grammar)
+    llm = get_llm_model(task="summary")
+    gbnf_grammar, documentation = get_grammar_text_and_documentation([Summary])
     summary_system_message = f"""
 You are an advanced research assistant, specialized in summarizing information extracted from the internet based on a given query. Your task is to analyze the provided text and generate a concise, relevant summary that directly addresses the query.
 
@@ -78,48 +155,56 @@ When presented with a query and accompanying text, follow these steps:
 
 Your goal is to provide accurate, focused, and well-formatted summaries that efficiently address the user's query, saving them time and effort in their research process.
 """
-    for i, chunk in enumerate(chunks):
-        if driver:
-            scroll_to_percentage(driver, i * scroll_ratio)
-            logger.info(f"Scrolling to {i * scroll_ratio * 100}% of the page")
-        logger.info(f"Summarizing chunk {i + 1} of {len(chunks)}")
-        summary_prompt = summarize_text_prompt(question, chunk)
-        summary = llm.chat_completion(
-            user_prompt=summary_prompt, system_prompt=summary_system_message,
-            grammar=gbnf_grammar, max_tokens=4096, temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17
-        )
-        try:
-            summary = json.loads(summary) 
-        except json.JSONDecodeError:
-            logger.error(f"Failed to decode JSON response, skipping chunk")
-            continue
-        summaries.append(Summary(**summary).summary)
-    combined_summary = "\nsection\n".join(summaries)
-    
-    # if the text is too long, summarize the combined summary
-    if len(combined_summary) > max_length:
-        logger.info(f"Text is too long, summarizing combined text")
-        summary_prompt = summarize_text_prompt(question, combined_summary)
-        summary = llm.chat_completion(
-            user_prompt=summary_prompt, system_prompt=summary_system_message,
-            grammar=gbnf_grammar, max_tokens=4096
-        )
-        summary = json.loads(summary)
-        combined_summary = Summary(**summary).summary
-    final_summary_ = final_summary_prompt(question, combined_summary)
-    final_grammar, documentation = generate_gbnf_grammar_and_documentation([ArticleSummary])
-    final_grammar = LlamaGrammar.from_string(final_grammar)
+    summarizer = MapReduceSummarizer(llm, question, summary_system_message, gbnf_grammar, SUMMARY_MAX_TOKENS, fan_in)
+    final_grammar, documentation = get_grammar_text_and_documentation([ArticleSummary])
     final_system_message = f"""You are an advanced AI research assistant, tasked with parsing and combining multiple summaries on the same topic into one document. The following is the expected output:\n\n{documentation}"""
+    # the combined summary has to fit the final call next to its own prompt and output
+    final_input_tokens = input_token_budget(llm.n_ctx, FINAL_SUMMARY_MAX_TOKENS, final_system_message,
+                                            final_summary_prompt(question, ""), counter=llm.token_counter)
+    # system prompt + prompt template + chunk + reserved output has to fit the context window
+    chunks = list(split_text_by_tokens(text, summarizer.input_budget, llm.token_counter))
+    scroll_ratio = 1/max(len(chunks), 1)
+    # the chunks the summarizer never asked for are the ones an irrelevant page saved
+    requested = [0]
+
+    def pending_chunks() -> Generator[str, None, None]:
+        for i, chunk in enumerate(chunks):
+            requested[0] = i + 1
+            if driver:
+                scroll_to_percentage(driver, i * scroll_ratio)
+                logger.info(f"Scrolling to {i * scroll_ratio * 100}% of the page")
+            # an empty index is falsy, and it starts empty whenever the database does
+            if dedup is not None and dedup.check(f"{source}#chunk{i + 1}", chunk):
+                continue
+            logger.info(f"Summarizing chunk {i + 1} of {len(chunks)}")
+            yield chunk
+
+    combined_summary = summarizer.summarize(pending_chunks(), target_tokens=final_input_tokens)
+    if summarizer.aborted:
+        skipped = chunks[requested[0]:]
+        logger.info(f"Stopped summarizing {source} after {requested[0]} of {len(chunks)} chunks, "
+                    f"{summarizer.irrelevant_chunks} of them irrelevant; skipped {len(skipped)} chunks, "
+                    f"{sum(llm.token_counter(chunk) for chunk in skipped)} input tokens")
+    elif summarizer.irrelevant_chunks:
+        logger.info(f"Left {summarizer.irrelevant_chunks} irrelevant chunks of {source} out of its summary")
+    if not combined_summary:
+        logger.info(f"Nothing left to summarize in {source}, skipping the final summary")
+        return None
+    final_summary_ = final_summary_prompt(question, combined_summary)
     final_summary = llm.chat_completion(
         user_prompt=final_summary_, system_prompt=final_system_message,
-        grammar=final_grammar, max_tokens=4096, temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17
+        grammar=final_grammar, max_tokens=FINAL_SUMMARY_MAX_TOKENS, validate=ArticleSummary.model_validate_json, temperature=1.31, top_p=0.14, top_k=49, repeat_penalty=1.17
     )
-    final_summary = json.loads(final_summary)
-    return ArticleSummary(**final_summary)    
+    try:
+        return ArticleSummary(**json.loads(final_summary))
+    except (json.JSONDecodeError, TypeError, ValueError) as e:
+        # a truncated or malformed final summary costs this page, not the whole research run
+        logger.error(f"Failed to decode the final summary of {source}, skipping it: {e}")
+        return None
         
         
     
-def scroll_to_percentage(driver: WebDriver, ratio: float) -> None:
+def scroll_to_percentage(driver: "WebDriver", ratio: float) -> None:
     """Scroll to a percentage of the page
 
     Args:
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional
+
+CHARS_PER_TOKEN = 4
+# tokens a chat template adds around the system and user messages
+CHAT_TEMPLATE_TOKENS = 32
+# share of the budget kept free because paragraph token counts do not add up exactly once joined
+SAFETY_MARGIN = 0.05
+COUNTER_CACHE_SIZE = 8192
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of LLM tokens in a text without a tokenizer
+
+    Args:
+        text (str): The text to measure
+
+    Returns:
+        int: The approximate number of tokens
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class TokenCounter:
+    """Counts tokens with a model's tokenizer, memoizing the counts of recently seen texts.
+
+    Without a tokenizer it falls back to the character based estimate.
+    """
+    def __init__(self, tokenize: Optional[Callable[[str], List[int]]] = None, cache_size: int = COUNTER_CACHE_SIZE):
+        """Initializes the token counter.
+        Args:
+            tokenize: A function turning a text into the model's tokens.
+            cache_size: The number of texts whose counts are remembered."""
+        self.tokenize = tokenize
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        """Count the tokens of a text
+
+        Args:
+            text (str): The text to measure
+
+        Returns:
+            int: The number of tokens
+        """
+        if not text:
+            return 0
+        if self.tokenize is None:
+            return estimate_tokens(text)
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+        count = len(self.tokenize(text))
+        with self._lock:
+            self._cache[text] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    __call__ = count
+
+
+def input_token_budget(n_ctx: int, reserved_output: int, *prompt_parts: str, counter: Optional[TokenCounter] = None) -> int:
+    """Get the number of tokens left for the variable part of a prompt
+
+    Args:
+        n_ctx (int): The context window of the model
+        reserved_output (int): The number of tokens kept for the completion
+        *prompt_parts (str): The fixed parts of the prompt, such as the system message and the prompt template
+        counter (TokenCounter, optional): The counter to measure the prompt parts with
+
+    Returns:
+        int: The number of tokens the variable part may use, at least 1
+    """
+    counter = counter or TokenCounter()
+    fixed = sum(counter.count(part) for part in prompt_parts) + CHAT_TEMPLATE_TOKENS
+    return max(int((n_ctx - reserved_output - fixed) * (1 - SAFETY_MARGIN)), 1)
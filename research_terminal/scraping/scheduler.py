@@ -0,0 +1,259 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Generator, List, Optional, Tuple
+from urllib.robotparser import RobotFileParser
+
+import requests
+from research_terminal.scraping.urls import url_host
+from research_terminal.scraping.web_scrape import WebScraper
+from research_terminal.logger.logger import logger
+
+MAX_CONCURRENCY = 6
+MAX_PER_HOST = 2
+REQUESTS_PER_SECOND = 1.0
+BURST = 2
+ROBOTS_TTL = 24 * 60 * 60
+ROBOTS_TIMEOUT = 5
+USER_AGENT = "*"
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity` requests."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Get the number of seconds until a request is allowed, 0 if it is allowed now."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class HostState:
+    """The politeness state of a single host, kept for the whole session."""
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.last_request = 0.0
+        self.crawl_delay: Optional[float] = None
+        # when the robots.txt crawl delay was last looked up, None while it is unknown
+        self.robots_checked: Optional[float] = None
+        self.robots_pending = False
+
+    def apply_crawl_delay(self):
+        """Slows the bucket down to the host's robots.txt Crawl-delay once it is known."""
+        if self.crawl_delay and self.bucket.rate > 1 / self.crawl_delay:
+            self.bucket.rate = 1 / self.crawl_delay
+            self.bucket.capacity = 1
+            self.bucket.tokens = min(self.bucket.tokens, 1)
+
+
+class CrawlScheduler:
+    """Schedules page scrapes across hosts without hammering any of them.
+
+    Each host gets a token bucket and a cap on in-flight requests, slowed down to the
+    Crawl-delay of its robots.txt when it has one. The robots.txt is read before the first
+    request to a host, and the host state is kept across calls, so the limits hold for the
+    whole session rather than per search. A global cap bounds the total number of
+    pages scraped at once, and free slots go to the idlest host first so that one slow or
+    rate-limited domain does not hold up the rest. Pages the scraper's cache holds a fresh
+    copy of are served right away, without waiting on the robots.txt or the rate limit.
+    """
+    def __init__(self, scraper: WebScraper, max_concurrency: int = MAX_CONCURRENCY, max_per_host: int = MAX_PER_HOST,
+                 rate: float = REQUESTS_PER_SECOND, burst: float = BURST, robots_ttl: float = ROBOTS_TTL):
+        """Initializes the crawl scheduler.
+        Args:
+            scraper: The scraper used to fetch the pages, shared by every worker thread.
+            max_concurrency: The maximum number of pages scraped at once across all hosts.
+            max_per_host: The maximum number of pages scraped at once from a single host.
+            rate: The number of requests per second allowed per host on average.
+            burst: The number of requests allowed per host in a burst.
+            robots_ttl: The number of seconds a host's robots.txt crawl delay is cached for."""
+        self.scraper = scraper
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        self.robots_ttl = robots_ttl
+        self._robots: Dict[str, Tuple[float, Optional[float]]] = {}
+        self._robots_lock = threading.Lock()
+        self._hosts: Dict[str, HostState] = {}
+        # guards the host states, shared by the dispatchers of concurrent scrape_all calls
+        self._condition = threading.Condition()
+
+    def _host(self, url: str) -> HostState:
+        name = url_host(url)
+        with self._condition:
+            if name not in self._hosts:
+                self._hosts[name] = HostState(name, self.rate, self.burst)
+            return self._hosts[name]
+
+    def scrape_all(self, urls: List[str]) -> Generator[Tuple[str, str], None, None]:
+        """Scrapes the urls politely and yields each page as soon as it is done.
+
+        Pages keep being scraped in the background while the caller processes the ones
+        already yielded.
+
+        Args:
+            urls (List[str]): The urls to scrape
+        Yields:
+            Tuple[str, str]: The url and the text of the page, the cached pages first and the others in completion order
+        """
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return
+        cached: List[Tuple[str, str]] = []
+        pending: Dict[HostState, Deque[str]] = {}
+        for url in urls:
+            text = self.scraper.cached_text(url)
+            if text is not None:
+                cached.append((url, text))
+            else:
+                pending.setdefault(self._host(url), deque()).append(url)
+        if not pending:
+            yield from cached
+            return
+        results: queue.Queue = queue.Queue()
+        stop = threading.Event()
+        dispatcher = threading.Thread(target=self._run_dispatch, args=(pending, results, stop), name="crawl-dispatcher", daemon=True)
+        dispatcher.start()
+        try:
+            # the other pages are fetched while the caller processes the cached ones
+            yield from cached
+            for _ in range(len(urls) - len(cached)):
+                item = results.get()
+                if item is None:
+                    # the dispatcher failed, the pages it did not report will not come
+                    break
+                url, text, error = item
+                if error is not None:
+                    logger.error(f"Failed to scrape {url}: {error}")
+                    continue
+                yield url, text
+        finally:
+            stop.set()
+            dispatcher.join()
+
+    def _run_dispatch(self, pending: Dict[HostState, Deque[str]], results: queue.Queue, stop: threading.Event):
+        try:
+            self._dispatch(pending, results, stop)
+        except Exception as e:
+            logger.error(f"The crawl dispatcher failed: {e}")
+        finally:
+            # unblocks the consumer when the dispatcher ends without reporting every page
+            results.put(None)
+
+    def _dispatch(self, pending: Dict[HostState, Deque[str]], results: queue.Queue, stop: threading.Event):
+        condition = self._condition
+        in_flight = 0
+
+        def on_done(host: HostState, url: str, future: Future):
+            nonlocal in_flight
+            error = future.exception()
+            results.put((url, None if error else future.result(), error))
+            with condition:
+                host.in_flight -= 1
+                in_flight -= 1
+                condition.notify_all()
+
+        def on_robots(host: HostState, future: Future):
+            with condition:
+                host.crawl_delay = future.result() if future.exception() is None else None
+                host.robots_checked = time.monotonic()
+                host.robots_pending = False
+                host.apply_crawl_delay()
+                condition.notify_all()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="scraper") as executor:
+            with condition:
+                while not stop.is_set() and any(pending.values()):
+                    now = time.monotonic()
+                    for host, urls in pending.items():
+                        stale = host.robots_checked is None or now - host.robots_checked >= self.robots_ttl
+                        if urls and stale and not host.robots_pending:
+                            # the crawl delay has to be known before the first request to the host
+                            host.robots_pending = True
+                            robots = executor.submit(self.crawl_delay, urls[0])
+                            robots.add_done_callback(lambda future, host=host: on_robots(host, future))
+                    host, delay = self._next_host(pending, now) if in_flight < self.max_concurrency else (None, None)
+                    if host is None:
+                        # wait for a slot to free up, a robots.txt to come in or the next token of a waiting host
+                        condition.wait(timeout=min(delay, 1.0) if delay is not None else 1.0)
+                        continue
+                    url = pending[host].popleft()
+                    host.bucket.consume(now)
+                    host.in_flight += 1
+                    host.last_request = now
+                    in_flight += 1
+                    future = executor.submit(self.scraper.scrape, url)
+                    future.add_done_callback(lambda future, host=host, url=url: on_done(host, url, future))
+                for urls in pending.values():
+                    for url in urls:
+                        results.put((url, None, "scrape cancelled"))
+                    urls.clear()
+
+    def _next_host(self, pending: Dict[HostState, Deque[str]], now: float) -> Tuple[Optional[HostState], Optional[float]]:
+        """Picks the idlest host allowed to send a request now.
+
+        Returns:
+            Tuple[Optional[HostState], Optional[float]]: The host, or None along with the seconds until one may be ready
+        """
+        best = None
+        delay = None
+        for host, urls in pending.items():
+            if not urls or host.robots_pending or host.robots_checked is None or host.in_flight >= self.max_per_host:
+                continue
+            host.apply_crawl_delay()
+            wait_time = host.bucket.wait_time(now)
+            if wait_time > 0:
+                delay = wait_time if delay is None else min(delay, wait_time)
+                continue
+            if best is None or (host.in_flight, host.last_request) < (best.in_flight, best.last_request):
+                best = host
+        return best, delay
+
+    def crawl_delay(self, url: str) -> Optional[float]:
+        """Get the Crawl-delay a host's robots.txt asks for, cached for `robots_ttl` seconds
+
+        Args:
+            url (str): A url of the host
+
+        Returns:
+            Optional[float]: The delay in seconds, None if the host does not set one
+        """
+        host = url_host(url)
+        with self._robots_lock:
+            cached = self._robots.get(host)
+        if cached and time.monotonic() - cached[0] < self.robots_ttl:
+            return cached[1]
+        scheme = url.split("://", 1)[0] if "://" in url else "https"
+        delay = None
+        try:
+            session = self.scraper.fetcher.session if self.scraper.fetcher else requests
+            response = session.get(f"{scheme}://{host}/robots.txt", timeout=ROBOTS_TIMEOUT)
+            if response.status_code == 200:
+                parser = RobotFileParser()
+                parser.parse(response.text.splitlines())
+                delay = parser.crawl_delay(USER_AGENT)
+                delay = float(delay) if delay else None
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Could not read robots.txt of {host}: {e}")
+        if delay:
+            logger.info(f"Honouring a crawl delay of {delay}s for {host}")
+        with self._robots_lock:
+            self._robots[host] = (time.monotonic(), delay)
+        return delay
@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from research_terminal.logger.logger import logger
+
+SEARCH_CACHE_PATH = 'research_terminal/scraping/cache/search.sqlite3'
+TTL = float(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a search query so that case and spacing differences hit the same cache entry
+
+    Args:
+        query (str): The query to normalize
+
+    Returns:
+        str: The lowercased query with collapsed whitespace
+    """
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    """SQLite-backed cache of search results keyed by (normalized query, region, max_results)."""
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl: float = TTL):
+        """Initializes the search cache.
+        Args:
+            path: The SQLite file to store the results in.
+            ttl: The number of seconds results are served from the cache."""
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS searches (
+                query TEXT NOT NULL,
+                region TEXT NOT NULL,
+                max_results INTEGER NOT NULL,
+                results TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (query, region, max_results)
+            )""")
+        self._db.commit()
+
+    def get(self, query: str, region: str, max_results: int) -> Optional[List[Dict]]:
+        """Gets the cached results of a search.
+        Args:
+            query(str): The search query.
+            region(str): The search region.
+            max_results(int): The number of results requested.
+        Returns:
+            Optional[List[Dict]]: The results, None if they are not cached or have expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results, created_at FROM searches WHERE query = ? AND region = ? AND max_results = ?",
+                (normalize_query(query), region, max_results)
+            ).fetchone()
+            if row is None or time.time() - row[1] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+        logger.debug(f"Search cache hit for query: {query}")
+        return json.loads(row[0])
+
+    def put(self, query: str, region: str, max_results: int, results: List[Dict]):
+        """Stores the results of a search.
+        Args:
+            query(str): The search query.
+            region(str): The search region.
+            max_results(int): The number of results requested.
+            results(List[Dict]): The results returned by the search engine."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?)",
+                (normalize_query(query), region, max_results, json.dumps(results), time.time())
+            )
+            self._db.execute("DELETE FROM searches WHERE created_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
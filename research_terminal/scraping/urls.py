@@ -0,0 +1,42 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref_src"}
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a url so that trivially different spellings of the same page compare equal.
+
+    The scheme and host are lowercased, default ports, fragments and tracking parameters are
+    dropped and the remaining query parameters are sorted.
+
+    Args:
+        url (str): The url to normalize
+
+    Returns:
+        str: The normalized url
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or "/"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PREFIXES) and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+
+def url_host(url: str) -> str:
+    """Get the lowercased host of a url
+
+    Args:
+        url (str): The url
+
+    Returns:
+        str: The host, without port
+    """
+    return (urlsplit(url).hostname or "").lower()
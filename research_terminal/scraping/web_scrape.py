@@ -1,45 +1,155 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from selenium.webdriver.firefox.options import Options as FirefoxOptions
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import wait
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Deque, Generator, Optional
+import requests
 from bs4 import BeautifulSoup
 from requests.compat import urljoin
+from research_terminal.scraping.browser_pool import BrowserPool, create_driver
+from research_terminal.scraping.http_fetch import FetchedPage, FetchRecord, HttpFetcher, looks_js_rendered
+from research_terminal.scraping.page_cache import CachedPage, PageCache
+from research_terminal.scraping.processing.extract import TEXT_TAGS, TextExtractor, get_extractor, join_texts
 from research_terminal.logger.logger import logger
 
+if TYPE_CHECKING:
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+# fetches kept in the log of a long-lived scraper, the oldest ones are dropped first
+FETCH_LOG_SIZE = int(os.getenv("FETCH_LOG_SIZE", 1000))
+
 class WebScraper:
-    def __init__(self, browser):
-        self.driver = self.get_driver(browser)
-        logger.debug(f"WebScraper initialized with {browser} browser")
+    def __init__(self, browser: str = "firefox", pool: Optional[BrowserPool] = None, fetcher: Optional[HttpFetcher] = None,
+                 cache: Optional[PageCache] = None, extractor: Optional[TextExtractor] = None):
+        """Initializes a web scraper.
+        Args:
+            browser: The browser to use when the scraper owns its driver.
+            pool: A browser pool to lease drivers from. When given, the scraper does not start a
+                driver of its own and can be shared between threads.
+            fetcher: An HTTP fetcher to try before the browser. Pages that look JS-rendered
+                still go through the browser.
+            cache: A page cache to serve fresh pages from and to store fetched pages in.
+            extractor: The engine used to extract text from the HTML, the fastest installed one by default."""
+        self.pool = pool
+        self.fetcher = fetcher
+        self.cache = cache
+        self.extractor = extractor or get_extractor()
+        self.fetch_log: Deque[FetchRecord] = deque(maxlen=FETCH_LOG_SIZE)
+        self.driver = None if pool else self.get_driver(browser)
+        logger.debug(f"WebScraper initialized with {pool.browser if pool else browser} browser")
         
     def get_driver(self, browser: str):
-        drivers = {
-            "chrome": webdriver.Chrome,
-            "firefox": webdriver.Firefox
-        }
-        if browser not in drivers:
-            logger.error(f"{browser} is not a supported browser")
-            raise Exception(f"{browser} is not a supported browser")
-        
-        options = ChromeOptions() if browser == "chrome" else FirefoxOptions()
-        options.add_argument("--headless")
-        options.add_argument("--enable-javascript")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        logger.debug(f"Getting {browser} driver")
-        return drivers[browser](options=options)
+        return create_driver(browser)
+
+    @contextmanager
+    def browser(self) -> Generator["WebDriver", None, None]:
+        """Yields the driver to load a page with, leased from the pool if there is one."""
+        if self.pool:
+            with self.pool.driver() as driver:
+                yield driver
+        else:
+            yield self.driver
         
+    def cached_text(self, url: str) -> Optional[str]:
+        """Get the text of a page from the cache if its copy is still fresh
+
+        Args:
+            url (str): The url of the page
+
+        Returns:
+            Optional[str]: The text of the page, None if it has to be fetched
+        """
+        cached = self.cache.get(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            self.cache.record_hit(cached)
+            return cached.text
+        return None
+
     def scrape(self, url: str):
-        soup = self.get_soup(url)
-        return self.get_text(soup)
-    
+        cached = self.cache.get(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            self.cache.record_hit(cached)
+            return cached.text
+        page = self.fetch_page(url, cached)
+        if cached and page.not_modified:
+            self.cache.revalidated(cached)
+            return cached.text
+        extraction = self.extractor.extract_with_report(page.html, url)
+        text = extraction.text
+        if page.record and extraction.removed_chars:
+            page.record.removed_chars = extraction.removed_chars
+            page.record.removed_tokens = extraction.removed_tokens
+            logger.info(f"Removed {extraction.removed_chars} characters (~{extraction.removed_tokens} tokens) of boilerplate from {url}")
+        if self.cache:
+            self.cache.record_miss(url)
+            self.cache.put(url, page.html, text, page.etag, page.last_modified)
+        return text
+
+    def get_html(self, url: str) -> str:
+        """Get the HTML of a page, over plain HTTP when possible and with the browser otherwise
+
+        Args:
+            url (str): The url of the page
+
+        Returns:
+            str: The HTML of the page
+        """
+        return self.fetch_page(url).html
+
+    def fetch_page(self, url: str, cached: Optional[CachedPage] = None) -> FetchedPage:
+        """Fetch a page over plain HTTP when possible and with the browser otherwise
+
+        Args:
+            url (str): The url of the page
+            cached (CachedPage, optional): A stale cached copy to revalidate with a conditional request
+
+        Returns:
+            FetchedPage: The page, flagged as not modified if the server confirmed the cached copy
+        """
+        start = time.perf_counter()
+        reason = "no http fetcher"
+        if self.fetcher:
+            try:
+                response = self.fetcher.fetch(url, headers=cached.conditional_headers() if cached else None)
+                if response.status_code == 304 and cached:
+                    record = self.record_fetch(FetchRecord(url, "http", time.perf_counter() - start, response.status_code, "not modified"))
+                    return FetchedPage(cached.html, cached.etag, cached.last_modified, not_modified=True, record=record)
+                reason = looks_js_rendered(response)
+                if reason is None:
+                    record = self.record_fetch(FetchRecord(url, "http", time.perf_counter() - start, response.status_code))
+                    return FetchedPage(response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"), record=record)
+            except requests.RequestException as e:
+                reason = f"http error: {e}"
+            logger.debug(f"Falling back to the browser for {url}: {reason}")
+        html = self.render(url)
+        record = self.record_fetch(FetchRecord(url, "browser", time.perf_counter() - start, reason=reason))
+        return FetchedPage(html, record=record)
+
+    def record_fetch(self, record: FetchRecord) -> FetchRecord:
+        self.fetch_log.append(record)
+        logger.info(f"Fetched {record.url} via {record.method} in {record.elapsed:.2f}s")
+        return record
+
+    def render(self, url: str) -> str:
+        """Load a page in the browser and return the rendered body
+
+        Args:
+            url (str): The url of the page
+
+        Returns:
+            str: The outer HTML of the rendered body
+        """
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import wait
+        with self.browser() as driver:
+            driver.get(url)
+            wait.WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "body")))
+            return driver.execute_script("return document.body.outerHTML;")
+
     def get_soup(self, url: str):
         logger.debug(f"Getting soup from {url}")
-        self.driver.get(url)
-        wait.WebDriverWait(self.driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "body")))    
-        page_source = self.driver.execute_script("return document.body.outerHTML;")
-        soup = BeautifulSoup(page_source, 'html.parser')
+        soup = BeautifulSoup(self.render(url), 'html.parser')
         logger.debug(f"Got soup from {url}")
         return soup
     def get_text(self, soup: BeautifulSoup):
@@ -52,11 +162,7 @@ class WebScraper:
             str: The text from the soup
         """
         logger.debug("Getting text from soup")
-        text = ""
-        tags = ['h1', 'h2', 'h3', 'h4', 'h5', 'p']
-        for element in soup.find_all(tags):
-            text += element.text + "\n\n"
-        return text
+        return join_texts(element.text for element in soup.find_all(TEXT_TAGS))
     
     def extract_hyperlinks(self, soup: BeautifulSoup, url: str):
         """Extract the hyperlinks from the soup
@@ -94,8 +200,9 @@ class WebScraper:
     
     
     def quit(self):
-        logger.info("Quitting driver")
-        self.driver.quit()
+        if self.driver:
+            logger.info("Quitting driver")
+            self.driver.quit()
         
 
 
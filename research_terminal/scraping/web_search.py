@@ -1,25 +1,85 @@
-from duckduckgo_search import DDGS
-from typing import List, Dict
+import threading
+from typing import TYPE_CHECKING, Iterable, List, Dict, Optional
+from research_terminal.scraping.search_cache import SearchCache
+from research_terminal.scraping.urls import normalize_url
 from research_terminal.logger.logger import logger
 
+if TYPE_CHECKING:
+    from duckduckgo_search import DDGS
+
+REGION = 'wt-wt'
+RRF_K = 60
+
 
 class Duckduckgo:
     """
     Duckduckgo API Retriever
     """
-    def __init__(self, query):
-        self.ddg = DDGS()
+    # one DDGS session per thread, reused across the queries of the long-lived search threads
+    _sessions = threading.local()
+
+    def __init__(self, query, region: str = REGION, cache: Optional[SearchCache] = None):
         self.query = query
+        self.region = region
+        self.cache = cache
         logger.info(f"Duckduckgo initialized with query: {query}")
 
+    @property
+    def ddg(self) -> "DDGS":
+        session = getattr(self._sessions, "ddg", None)
+        if session is None:
+            from duckduckgo_search import DDGS
+            session = self._sessions.ddg = DDGS()
+        return session
+
     def search(self, max_results=5)-> List[Dict]:
         """
-        Performs the search
+        Performs the search, serving it from the cache when the same query was run recently
         :param query:
         :param max_results:
         :return:
         """
+        if self.cache:
+            results = self.cache.get(self.query, self.region, max_results)
+            if results is not None:
+                logger.info(f"Using cached Duckduckgo results for query: {self.query}")
+                return results
         logger.info(f"Searching Duckduckgo for query: {self.query}")
-        ddgs_gen = self.ddg.text(self.query, region='wt-wt', max_results=max_results)
-        return ddgs_gen
-    
+        results = list(self.ddg.text(self.query, region=self.region, max_results=max_results) or [])
+        if self.cache and results:
+            self.cache.put(self.query, self.region, max_results, results)
+        return results
+
+
+def merge_search_results(result_lists: List[List[Dict]], max_links: int, exclude: Iterable[str] = ()) -> List[str]:
+    """Merge the results of several searches into one ranking of unique urls.
+
+    Urls are scored by reciprocal rank fusion, so a page ranked well by several queries
+    beats one ranked first by a single query. Urls are compared after normalization.
+
+    Args:
+        result_lists (List[List[Dict]]): The results of each search, in rank order
+        max_links (int): The number of urls to return
+        exclude (Iterable[str], optional): Urls to leave out, such as the ones already visited
+
+    Returns:
+        List[str]: The best ranked urls
+    """
+    excluded = {normalize_url(url) for url in exclude}
+    scores: Dict[str, float] = {}
+    urls: Dict[str, str] = {}
+    for results in result_lists:
+        seen = set()
+        for rank, result in enumerate(results):
+            url = result.get('href')
+            if not url:
+                continue
+            key = normalize_url(url)
+            if key in excluded or key in seen:
+                continue
+            seen.add(key)
+            urls.setdefault(key, url)
+            scores[key] = scores.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+    # sorted is stable, so ties keep the order the urls were first seen in
+    ranked = sorted(scores, key=lambda key: scores[key], reverse=True)
+    return [urls[key] for key in ranked[:max_links]]
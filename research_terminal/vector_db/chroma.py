@@ -1,7 +1,4 @@
 from datetime import datetime
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
 from uuid import uuid4
 import logging  
 logger = logging.getLogger(__name__)
@@ -21,15 +18,23 @@ class ChromaDBClient:
             collection_name: The name of the collection to use.
             model_name: The name of the model to use for embeddings."""
         logger.info("Initializing ChromaDB client...")
+        # chromadb takes seconds to import, it is only imported once a client is needed
+        import chromadb
+        from chromadb.config import Settings
+        from research_terminal.vector_db.embeddings import CachedEmbeddingFunction
+        self.model_name = model_name
+        # texts embedded before are served from the embedding store, the model is loaded on the first new one
+        self.embedding_fn = CachedEmbeddingFunction(model_name)
         self.client = chromadb.PersistentClient(persist_directory, settings=Settings(allow_reset=True, anonymized_telemetry=False))
-        self.collection = self.client.get_or_create_collection(collection_name)
-        self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
+        self.collection = self.client.get_or_create_collection(collection_name, embedding_function=self.embedding_fn)
 
         
     def add_text(self, text: str, metadata: Optional[dict] = None):
         """Adds a text to the collection.
         Args:
-            text(str): The text to add."""
+            text(str): The text to add.
+        Returns:
+            List[Tuple[str, str]]: The id and text of each chunk the text was stored as."""
 
         texts = list(split_text(text, max_length=1024))
 
@@ -39,11 +44,13 @@ class ChromaDBClient:
             meta["timestamp"] = datetime.now().isoformat(sep=" ", timespec="minutes")
             metadatas.append(meta)
 
+        ids = [str(uuid4()) for _ in texts]
         self.collection.add(
             documents=texts,
             metadatas=metadatas,
-            ids=[str(uuid4()) for _ in texts],
+            ids=ids,
         )
+        return list(zip(ids, texts))
 
     def query_text(self, text: str, top_k: int = 1, **kwargs):
         """Queries the collection for a text.
@@ -55,9 +62,14 @@ class ChromaDBClient:
         return self.collection.query(
             query_texts=[text],
             n_results=top_k, 
-            include=["documents", "metadatas"],
+            include=["documents", "metadatas", "distances"],
             **kwargs)
 
+    @property
+    def distance_space(self) -> str:
+        """The distance function of the collection, as set by its hnsw:space metadata."""
+        return (self.collection.metadata or {}).get("hnsw:space", "l2")
+
     def get_text(self, ids: str, **kwargs):
         """Gets a text from the collection by its id.
             Args:
@@ -69,6 +81,13 @@ class ChromaDBClient:
             **kwargs
         )
 
+    def get_documents(self, **kwargs):
+        """Gets every document stored in the collection.
+            Returns:
+                List[Tuple[str, str]]: The id and text of each document."""
+        results = self.collection.get(include=["documents"], **kwargs)
+        return list(zip(results["ids"], results["documents"]))
+
     def update_text(self, ids: str, text: str, metadatas={}, **kwargs):
         """Updates a text in the collection by its id.
             Args:
@@ -113,7 +132,8 @@ class ChromaDBClient:
         return self.client.list_collections()
 
     def create_collection(self, name: str, **kwargs):
-        """Creates a new collection."""
+        """Creates a new collection, embedded with the client's embedding function unless another is given."""
+        kwargs.setdefault("embedding_function", self.embedding_fn)
         return self.client.get_or_create_collection(name, **kwargs)
 
     def delete_collection(self, name: str):
@@ -124,3 +144,8 @@ class ChromaDBClient:
         """Resets the entire database. This can't be undone!"""
         return self.client.reset()
 
+    def close(self):
+        """Closes the embedding store."""
+        logger.info(f"Embedding cache stats: {self.embedding_fn.stats()}")
+        self.embedding_fn.close()
+
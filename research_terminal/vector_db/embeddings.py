@@ -0,0 +1,202 @@
+import hashlib
+import importlib.util
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from research_terminal.logger.logger import logger
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "research_terminal/vector_db/cache/embeddings.sqlite3")
+BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+# Chroma's bundled ONNX all-MiniLM-L6-v2, used when sentence_transformers is not installed
+DEFAULT_ENCODER = "chroma-default"
+
+_encoders: Dict[str, object] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model_name: str):
+    """Get a sentence transformer, loaded once per process and shared by every client
+
+    Args:
+        model_name (str): The name of the sentence transformer model, or DEFAULT_ENCODER
+
+    Returns:
+        Union[SentenceTransformer, DefaultEmbeddingFunction]: The model
+    """
+    with _encoders_lock:
+        if model_name not in _encoders:
+            logger.info(f"Loading embedding model {model_name}")
+            if model_name == DEFAULT_ENCODER:
+                from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+                _encoders[model_name] = DefaultEmbeddingFunction()
+            else:
+                # sentence_transformers pulls in torch, it is only imported once something has to be encoded
+                from sentence_transformers import SentenceTransformer
+                _encoders[model_name] = SentenceTransformer(model_name)
+        return _encoders[model_name]
+
+
+def encoder_name(model_name: str) -> str:
+    """Get the encoder embedding for a model, DEFAULT_ENCODER when sentence_transformers is not installed
+
+    Args:
+        model_name (str): The name of the sentence transformer model
+
+    Returns:
+        str: The name the encoder is loaded and its embeddings stored under
+    """
+    if model_name != DEFAULT_ENCODER and importlib.util.find_spec("sentence_transformers") is None:
+        logger.warning(f"sentence_transformers is not installed, embedding with Chroma's default model instead of {model_name}")
+        return DEFAULT_ENCODER
+    return model_name
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """SQLite-backed store of embeddings keyed by model and content hash."""
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        """Initializes the embedding store.
+        Args:
+            path: The SQLite file to store the embeddings in."""
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, hash)
+            )""")
+        self._db.commit()
+
+    def get_many(self, model: str, hashes: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Gets the stored embeddings of several texts.
+        Args:
+            model(str): The name of the model the embeddings were made with.
+            hashes(Sequence[str]): The content hashes of the texts.
+        Returns:
+            Dict[str, np.ndarray]: The embedding of each hash found."""
+        found: Dict[str, np.ndarray] = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # bounded by SQLite's limit on query parameters
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({', '.join('?' * len(batch))})",
+                    (model, *batch)).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        """Stores the embeddings of several texts.
+        Args:
+            model(str): The name of the model the embeddings were made with.
+            vectors(Dict[str, np.ndarray]): The embedding of each content hash."""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in vectors.items()])
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class CachedEmbeddingFunction:
+    """Chroma embedding function that only encodes texts it has not embedded before.
+
+    Embeddings are memoized by content hash in an EmbeddingStore, so repeated queries and
+    re-ingested documents skip the encoder. Texts missing from concurrent calls are pooled
+    and encoded together, in batches of batch_size, by whichever call gets the encoder first.
+    """
+    def __init__(self, model_name: str, store: Optional[EmbeddingStore] = None, batch_size: int = BATCH_SIZE):
+        """Initializes the embedding function, the model is loaded on the first text to encode.
+        Args:
+            model_name: The name of the sentence transformer model, Chroma's default model is used when
+                sentence_transformers is not installed.
+            store: The store the embeddings are memoized in, the default one if not given.
+            batch_size: The number of texts encoded at once."""
+        # the embeddings of the fallback model are stored apart from those of the requested one
+        self.model_name = encoder_name(model_name)
+        self.store = store if store is not None else EmbeddingStore()
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self.encoded = 0
+        self.batches = 0
+        self._pending: Dict[str, str] = {}
+        self._pending_lock = threading.Lock()
+        self._encode_lock = threading.Lock()
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        """Embeds the texts, Chroma calls it with the documents added and the texts queried.
+        Args:
+            input(List[str]): The texts.
+        Returns:
+            List[List[float]]: The normalized embedding of each text."""
+        hashes = [content_hash(text) for text in input]
+        vectors = self.store.get_many(self.model_name, hashes)
+        missing = {key: text for key, text in zip(hashes, input) if key not in vectors}
+        self.hits += len(input) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            self._encode(missing)
+            vectors.update(self.store.get_many(self.model_name, list(missing)))
+        return [vectors[key].tolist() for key in hashes]
+
+    def _encode(self, texts: Dict[str, str]):
+        with self._pending_lock:
+            self._pending.update(texts)
+        with self._encode_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            # empty when a call that got the encoder first took these texts along with its own
+            if not pending:
+                return
+            encoder = get_encoder(self.model_name)
+            keys = list(pending)
+            for start in range(0, len(keys), self.batch_size):
+                batch = keys[start:start + self.batch_size]
+                embeddings = self._embed(encoder, [pending[key] for key in batch])
+                self.store.put_many(self.model_name, dict(zip(batch, embeddings)))
+                self.batches += 1
+            self.encoded += len(keys)
+            logger.debug(f"Encoded {len(keys)} texts in {-(-len(keys) // self.batch_size)} batches")
+
+    def _embed(self, encoder, texts: List[str]) -> np.ndarray:
+        if self.model_name == DEFAULT_ENCODER:
+            embeddings = np.asarray(encoder(texts), dtype=np.float32)
+            # normalized like the sentence transformer ones, so l2 distances map to cosine similarities
+            return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        # normalized like Chroma's default embeddings, so l2 distances map to cosine similarities
+        return encoder.encode(texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True)
+
+    def stats(self) -> dict:
+        """Gets the embedding counters.
+        Returns:
+            dict: The texts served from the store, the ones encoded, the encoder batches and the stored embeddings."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "encoded": self.encoded,
+            "batches": self.batches,
+            "stored": len(self.store),
+        }
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,209 @@
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+from research_terminal.logger.logger import logger
+
+DECISION_LOG_PATH = os.getenv("DB_RELEVANCE_LOG", "research_terminal/vector_db/cache/relevance_decisions.jsonl")
+# similarities at or above ACCEPT are relevant and below REJECT irrelevant without asking the model
+ACCEPT_SIMILARITY = float(os.getenv("DB_RELEVANCE_ACCEPT", 0.75))
+REJECT_SIMILARITY = float(os.getenv("DB_RELEVANCE_REJECT", 0.35))
+# share of the fast path decisions still judged by the model, so the log keeps labels to calibrate on
+AUDIT_RATE = float(os.getenv("DB_RELEVANCE_AUDIT_RATE", 0.05))
+TARGET_PRECISION = 0.95
+# verdicts calibrate() needs in total and of each kind before it moves the thresholds
+MIN_CALIBRATION_SAMPLES = int(os.getenv("DB_RELEVANCE_MIN_SAMPLES", 50))
+MIN_CALIBRATION_SAMPLES_PER_VERDICT = int(os.getenv("DB_RELEVANCE_MIN_SAMPLES_PER_VERDICT", 10))
+
+
+def similarity(distance: float, space: str = "l2") -> float:
+    """Turn a Chroma distance into a cosine similarity
+
+    Args:
+        distance (float): The distance Chroma returned for a query and a document
+        space (str): The distance function of the collection, "l2", "cosine" or "ip"
+
+    Returns:
+        float: The similarity, 1 for the same direction; l2 assumes normalized embeddings, as Chroma's default ones are
+    """
+    if space == "cosine" or space == "ip":
+        return 1 - distance
+    # the squared euclidean distance of unit vectors is 2 - 2 cos
+    return 1 - distance / 2
+
+
+@dataclass
+class GateDecision:
+    """How the relevance of a database result was decided."""
+    similarity: float
+    route: str
+    relevant: bool
+    judged: Optional[bool] = None
+
+    @property
+    def skipped_model(self) -> bool:
+        return self.judged is None
+
+
+class RelevanceGate:
+    """Decides whether a database result answers a question, asking the model only when the similarity is ambiguous.
+
+    Every decision is appended to a JSONL log. The ones the model judged are the labels
+    calibrate() fits the thresholds on.
+    """
+    def __init__(self, accept: float = ACCEPT_SIMILARITY, reject: float = REJECT_SIMILARITY,
+                 log_path: Optional[str] = DECISION_LOG_PATH, audit_rate: float = AUDIT_RATE):
+        """Initializes the gate.
+        Args:
+            accept: The similarity at or above which a result is relevant.
+            reject: The similarity below which a result is irrelevant.
+            log_path: The JSONL file the decisions are appended to, None to not log them.
+            audit_rate: The share of the fast path decisions also judged by the model."""
+        if reject > accept:
+            raise ValueError(f"The reject threshold {reject} is above the accept threshold {accept}")
+        self.accept = accept
+        self.reject = reject
+        self.log_path = log_path
+        self.audit_rate = audit_rate
+        self.decisions = {"accept": 0, "reject": 0, "judge": 0}
+        self._lock = threading.Lock()
+        if log_path:
+            os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+
+    def route(self, similarity: float) -> str:
+        if similarity >= self.accept:
+            return "accept"
+        if similarity < self.reject:
+            return "reject"
+        return "judge"
+
+    def decide(self, question: str, similarity: float, judge: Callable[[], bool]) -> GateDecision:
+        """Decide whether a database result is relevant to the question.
+        Args:
+            question (str): The question
+            similarity (float): The similarity of the question and the result
+            judge (Callable[[], bool]): Asks the model whether the result is relevant
+        Returns:
+            GateDecision: The decision
+        """
+        route = self.route(similarity)
+        judged = None
+        if route == "judge" or random.random() < self.audit_rate:
+            judged = judge()
+        relevant = judged if route == "judge" else route == "accept"
+        decision = GateDecision(similarity, route, bool(relevant), judged)
+        with self._lock:
+            self.decisions[route] += 1
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as log:
+                    log.write(json.dumps({"time": time.time(), "question": question, "similarity": similarity,
+                                          "route": route, "relevant": decision.relevant, "judged": judged}) + "\n")
+        logger.info(f"Database result similarity {similarity:.3f}: {route}"
+                    + (f", judged {'relevant' if judged else 'irrelevant'}" if judged is not None else ""))
+        return decision
+
+    def stats(self) -> dict:
+        total = sum(self.decisions.values())
+        return {**self.decisions, "skipped_model": (total - self.decisions["judge"]) / total if total else 0.0}
+
+
+def load_labels(log_path: str = DECISION_LOG_PATH) -> List[Tuple[float, bool]]:
+    """Read the decisions the model judged from a decision log
+
+    Args:
+        log_path (str): The JSONL decision log
+
+    Returns:
+        List[Tuple[float, bool]]: The similarity and the model's verdict of each judged decision
+    """
+    labels = []
+    if not os.path.exists(log_path):
+        return labels
+    with open(log_path, encoding="utf-8") as log:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("judged") is not None:
+                labels.append((float(record["similarity"]), bool(record["judged"])))
+    return labels
+
+
+def check_labels(labels: List[Tuple[float, bool]], min_samples: int = MIN_CALIBRATION_SAMPLES,
+                 min_per_verdict: int = MIN_CALIBRATION_SAMPLES_PER_VERDICT) -> None:
+    """Make sure there are enough verdicts, relevant and irrelevant ones, to calibrate on
+
+    Args:
+        labels (List[Tuple[float, bool]]): The similarity and the model's verdict of each judged result
+        min_samples (int): The verdicts needed in total
+        min_per_verdict (int): The relevant and the irrelevant verdicts needed each
+
+    Raises:
+        ValueError: If there are too few verdicts
+    """
+    relevant = sum(verdict for _, verdict in labels)
+    irrelevant = len(labels) - relevant
+    if len(labels) < min_samples or relevant < min_per_verdict or irrelevant < min_per_verdict:
+        raise ValueError(f"Too few verdicts to calibrate on: {relevant} relevant and {irrelevant} irrelevant, "
+                         f"{min_samples} in total and {min_per_verdict} of each are needed")
+
+
+def calibrate(labels: List[Tuple[float, bool]], target_precision: float = TARGET_PRECISION,
+              accept: float = ACCEPT_SIMILARITY, reject: float = REJECT_SIMILARITY,
+              min_samples: int = MIN_CALIBRATION_SAMPLES,
+              min_per_verdict: int = MIN_CALIBRATION_SAMPLES_PER_VERDICT) -> Tuple[float, float]:
+    """Fit the thresholds to the model's verdicts
+
+    The accept threshold is the lowest similarity above which the model found at least
+    target_precision of the results relevant, the reject threshold the highest one below
+    which it found at least target_precision of them irrelevant.
+
+    Args:
+        labels (List[Tuple[float, bool]]): The similarity and the model's verdict of each judged result
+        target_precision (float): The share of the fast path decisions that have to agree with the model
+        accept (float): The accept threshold kept when no similarity reaches the target
+        reject (float): The reject threshold kept when no similarity reaches the target
+        min_samples (int): The verdicts needed in total
+        min_per_verdict (int): The relevant and the irrelevant verdicts needed each
+
+    Returns:
+        Tuple[float, float]: The accept and reject thresholds
+
+    Raises:
+        ValueError: If there are too few verdicts, or only one kind of them
+    """
+    check_labels(labels, min_samples, min_per_verdict)
+    ranked = sorted(labels)
+    new_accept = accept
+    relevant = 0
+    # from the most similar down, the lowest cut whose results are still precise enough
+    for count, (score, verdict) in enumerate(reversed(ranked), 1):
+        relevant += verdict
+        if relevant / count >= target_precision:
+            new_accept = score
+    new_reject = reject
+    irrelevant = 0
+    for count, (score, verdict) in enumerate(ranked, 1):
+        irrelevant += not verdict
+        if irrelevant / count >= target_precision and count < len(ranked):
+            # results strictly below the next similarity are rejected
+            new_reject = ranked[count][0]
+    new_reject = min(new_reject, new_accept)
+    logger.info(f"Calibrated on {len(labels)} verdicts: accept at {new_accept:.3f}, reject below {new_reject:.3f}")
+    return new_accept, new_reject
+
+
+if __name__ == "__main__":
+    labels = load_labels()
+    print(f"{len(labels)} judged decisions in {DECISION_LOG_PATH}")
+    try:
+        accept, reject = calibrate(labels)
+    except ValueError as e:
+        raise SystemExit(f"{e}, keeping DB_RELEVANCE_ACCEPT={ACCEPT_SIMILARITY:.3f} and DB_RELEVANCE_REJECT={REJECT_SIMILARITY:.3f}")
+    print(f"DB_RELEVANCE_ACCEPT={accept:.3f}")
+    print(f"DB_RELEVANCE_REJECT={reject:.3f}")
@@ -0,0 +1,46 @@
+from research_terminal.scraping.processing.boilerplate import MainContentExtractor
+
+BANNER = "We use cookies to improve your experience on our site, accept them to continue browsing."
+BYLINE = "Written by the editorial team, who fact-check every article before it is published here."
+
+
+def page(body: str) -> str:
+    return f"""<html><body>
+    <div class="cookie-banner"><p>{BANNER}</p></div>
+    <nav><p>Home, News, Science, Technology, Opinion, Contact and a few other menu entries</p></nav>
+    <article>
+        <h1>Article</h1>
+        <p>{body} The first paragraph goes on with enough words, commas, and detail to score as content.</p>
+        <p>{body} The second paragraph adds more, with further clauses, to keep the block clearly on top.</p>
+        <p>{BYLINE}</p>
+    </article>
+    </body></html>"""
+
+
+def test_reextracting_a_url_keeps_its_content():
+    extractor = MainContentExtractor()
+    html = page("Qubits hold superpositions.")
+    for _ in range(extractor.repeat_threshold + 1):
+        extraction = extractor.extract_with_report(html, "https://example.com/a")
+    assert BANNER not in extraction.text
+    assert BYLINE in extraction.text
+    assert extraction.removed_chars > 0
+
+
+def test_paragraphs_repeated_across_a_host_are_dropped():
+    extractor = MainContentExtractor()
+    for i in range(extractor.repeat_threshold):
+        extraction = extractor.extract_with_report(page(f"Topic {i} is discussed."), f"https://example.com/{i}")
+    assert BYLINE not in extraction.text
+    assert "Topic 2 is discussed." in extraction.text
+    other_host = extractor.extract_with_report(page("Topic 9 is discussed."), "https://example.org/9")
+    assert BYLINE in other_host.text
+
+
+def test_copies_of_a_page_fall_back_to_the_main_content():
+    extractor = MainContentExtractor()
+    html = page("Syndicated story.")
+    for i in range(extractor.repeat_threshold):
+        extraction = extractor.extract_with_report(html, f"https://example.com/story?page={i}")
+    assert BANNER not in extraction.text
+    assert "Syndicated story." in extraction.text
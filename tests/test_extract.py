@@ -0,0 +1,22 @@
+from research_terminal.scraping.processing.extract import available_extractors
+
+PAGE = """<?xml version="1.0" encoding="utf-8"?>
+<html><head><style>p { color: red; }</style><script>var tracking = 1;</script></head>
+<body>
+<h1>Quantum computing</h1>
+<p>Qubits hold <b>superpositions</b>.<script>document.write("injected")</script></p>
+<noscript><p>Enable JavaScript to continue.</p></noscript>
+<template><p>Hidden template text.</p></template>
+<p>Error correction is still an open problem.</p>
+</body></html>"""
+
+
+def test_every_engine_extracts_the_same_text():
+    extractors = available_extractors()
+    texts = {name: extractor.extract(PAGE) for name, extractor in extractors.items()}
+    for name, text in texts.items():
+        assert "Quantum computing" in text, name
+        assert "Qubits hold superpositions." in text, name
+        for hidden in ("tracking", "injected", "Enable JavaScript", "Hidden template", "color: red"):
+            assert hidden not in text, (name, hidden)
+    assert len(set(texts.values())) == 1, texts
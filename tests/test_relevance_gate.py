@@ -0,0 +1,21 @@
+import pytest
+
+from research_terminal.vector_db.relevance_gate import calibrate
+
+
+def test_calibrate_needs_enough_verdicts():
+    with pytest.raises(ValueError):
+        calibrate([(0.9, True), (0.1, False)], min_samples=10, min_per_verdict=2)
+
+
+def test_calibrate_needs_both_verdicts():
+    labels = [(0.5 + i / 100, True) for i in range(40)]
+    with pytest.raises(ValueError):
+        calibrate(labels, min_samples=10, min_per_verdict=2)
+
+
+def test_calibrate_fits_separated_verdicts():
+    labels = [(0.8 + i / 100, True) for i in range(10)] + [(0.1 + i / 100, False) for i in range(10)]
+    accept, reject = calibrate(labels, min_samples=20, min_per_verdict=10)
+    assert accept == pytest.approx(0.8)
+    assert reject == pytest.approx(0.8)
@@ -0,0 +1,44 @@
+import threading
+
+from research_terminal.scraping.scheduler import CrawlScheduler
+
+
+class FakeScraper:
+    fetcher = None
+
+    def __init__(self, cached):
+        self.cached = cached
+        self.scraped = []
+        self._lock = threading.Lock()
+
+    def cached_text(self, url):
+        return self.cached.get(url)
+
+    def scrape(self, url):
+        with self._lock:
+            self.scraped.append(url)
+        return f"text of {url}"
+
+
+def test_cached_pages_skip_robots_and_rate_limit():
+    scraper = FakeScraper({"https://a.com/1": "cached 1", "https://a.com/2": "cached 2"})
+    scheduler = CrawlScheduler(scraper, rate=0.001, burst=1)
+    robots = []
+    scheduler.crawl_delay = lambda url: robots.append(url)
+
+    pages = list(scheduler.scrape_all(["https://a.com/1", "https://a.com/2"]))
+
+    assert pages == [("https://a.com/1", "cached 1"), ("https://a.com/2", "cached 2")]
+    assert robots == []
+    assert scraper.scraped == []
+
+
+def test_uncached_pages_are_scraped_after_the_cached_ones():
+    scraper = FakeScraper({"https://a.com/1": "cached 1"})
+    scheduler = CrawlScheduler(scraper)
+    scheduler.crawl_delay = lambda url: None
+
+    pages = list(scheduler.scrape_all(["https://a.com/1", "https://b.com/1"]))
+
+    assert pages == [("https://a.com/1", "cached 1"), ("https://b.com/1", "text of https://b.com/1")]
+    assert scraper.scraped == ["https://b.com/1"]
@@ -0,0 +1,43 @@
+import json
+
+from research_terminal.scraping.processing import text
+from research_terminal.scraping.processing.dedup import DedupIndex
+from research_terminal.scraping.processing.tokens import TokenCounter
+
+CHUNK = ("Quantum computers use qubits that can hold a superposition of states, which lets some algorithms "
+         "such as Shor's factoring and Grover's search run faster than on classical machines, although "
+         "today's devices remain noisy and small enough that error correction is still an open problem.")
+
+
+class FakeModel:
+    n_ctx = 4096
+    token_counter = TokenCounter()
+
+    def __init__(self):
+        self.prompts = []
+
+    def chat_completion(self, system_prompt, user_prompt, **kwargs):
+        self.prompts.append(user_prompt)
+        if kwargs.get("max_tokens") == text.FINAL_SUMMARY_MAX_TOKENS:
+            return json.dumps({"title": "t", "question": "q", "main_ides": "m", "chunk_summaries": []})
+        return json.dumps({"question": "q", "summary": "qubits", "relevance": "yes"})
+
+    def map_chat_completions(self, requests, **kwargs):
+        for request in requests:
+            yield self.chat_completion(**kwargs, **request)
+
+
+def test_empty_dedup_index_skips_repeated_chunk(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(text, "get_llm_model", lambda task=None: model)
+    monkeypatch.setattr(text, "get_grammar_text_and_documentation", lambda models: (None, ""))
+    monkeypatch.setattr(text, "split_text_by_tokens", lambda *args: iter([CHUNK, CHUNK]))
+    dedup = DedupIndex()
+    assert len(dedup) == 0
+
+    summary = text.summarize_text("What is quantum computing?", CHUNK * 2, dedup=dedup, source="page")
+
+    assert summary is not None
+    chunk_prompts = [prompt for prompt in model.prompts if CHUNK in prompt]
+    assert len(chunk_prompts) == 1
+    assert len(dedup) == 1
@@ -0,0 +1,16 @@
+from research_terminal.scraping import web_scrape
+from research_terminal.scraping.http_fetch import FetchRecord
+from research_terminal.scraping.web_scrape import WebScraper
+
+
+class FakePool:
+    browser = "firefox"
+
+
+def test_fetch_log_keeps_only_the_latest_fetches(monkeypatch):
+    monkeypatch.setattr(web_scrape, "FETCH_LOG_SIZE", 3)
+    scraper = WebScraper(pool=FakePool())
+    for i in range(5):
+        scraper.record_fetch(FetchRecord(f"https://a.com/{i}", "http", 0.1))
+
+    assert [record.url for record in scraper.fetch_log] == [f"https://a.com/{i}" for i in range(2, 5)]